@@ -0,0 +1,173 @@
+"""
+Short code allocation for URL shortener
+"""
+
+import hashlib
+from typing import Optional
+
+from .config import settings
+from .metrics import CODE_ALLOCATION_SECONDS, timed
+from .storage import LinkExistsError, LinkLimits, StorageEngine
+from .utils import BASE62_ALPHABET, RESERVED_CODES, encode_base62, generate_short_code
+
+
+class FeistelPermutation:
+    """
+    Keyed bijection over range(size).
+
+    A balanced Feistel network over the smallest even number of bits that
+    covers the range, with cycle walking to stay inside it. Consecutive
+    inputs map to unrelated outputs, and without the key the next output
+    cannot be predicted from earlier ones.
+    """
+
+    def __init__(self, key: bytes, size: int, rounds: int = 4):
+        bits = max((size - 1).bit_length(), 2)
+        bits += bits & 1
+        self.size = size
+        self.half = bits // 2
+        self.mask = (1 << self.half) - 1
+        self.rounds = rounds
+        self.key = key
+        self._tweak = size.to_bytes(16, "big")
+
+    def _round(self, index: int, value: int) -> int:
+        digest = hashlib.blake2b(
+            bytes([index]) + self._tweak + value.to_bytes(16, "big"),
+            key=self.key,
+            digest_size=16,
+        ).digest()
+        return int.from_bytes(digest, "big") & self.mask
+
+    def permute(self, value: int) -> int:
+        while True:
+            left, right = value >> self.half, value & self.mask
+            for index in range(self.rounds):
+                left, right = right, left ^ self._round(index, right)
+            value = (left << self.half) | right
+            if value < self.size:
+                return value
+
+
+class CodeAllocator:
+    """Base class for short code allocators"""
+
+    def __init__(self, storage: StorageEngine):
+        self.storage = storage
+        self.collisions = 0
+
+    def next_code(self) -> str:
+        """Return a candidate code that is not known to be taken"""
+        raise NotImplementedError
+
+    @timed(CODE_ALLOCATION_SECONDS)
+    def create(self, url: str, limits: Optional[LinkLimits] = None) -> str:
+        """Allocate a free short code and store the URL under it"""
+        while True:
+            short_code = self.next_code()
+            try:
+                self.storage.add_link(short_code, url, limits)
+                return short_code
+            except LinkExistsError:
+                # Another worker or a custom code took it since the check
+                self.collisions += 1
+
+
+class RandomAllocator(CodeAllocator):
+    """
+    Random codes checked against storage.
+
+    After ``max_attempts`` collisions at one length the code length grows
+    by one, so allocation stays constant time as the table fills up.
+    """
+
+    def __init__(self, storage: StorageEngine, length: int = 6, max_attempts: int = 8):
+        super().__init__(storage)
+        self.length = length
+        self.max_attempts = max_attempts
+
+    def next_code(self) -> str:
+        while True:
+            for _ in range(self.max_attempts):
+                short_code = generate_short_code(self.length)
+                if short_code not in RESERVED_CODES and not self.storage.exists(short_code):
+                    return short_code
+                self.collisions += 1
+            self.length += 1
+
+
+class CounterAllocator(CodeAllocator):
+    """
+    Base62-encoded monotonic counter.
+
+    IDs are leased from storage in blocks, so workers hand out disjoint
+    ranges without coordinating per link. IDs fill all codes of the
+    minimum length before moving to the next length. With a scramble key,
+    each length's ID range is permuted so codes are not sequential.
+    """
+
+    def __init__(
+        self,
+        storage: StorageEngine,
+        length: int = 6,
+        block_size: int = 1000,
+        scramble_key: Optional[str] = None,
+    ):
+        super().__init__(storage)
+        self.min_length = length
+        self.block_size = block_size
+        self.key = hashlib.sha256(scramble_key.encode()).digest() if scramble_key else None
+        self._next = 0
+        self._end = 0
+        self._permutations = {}
+
+    def _next_id(self) -> int:
+        if self._next >= self._end:
+            self._next = self.storage.lease_ids(self.block_size)
+            self._end = self._next + self.block_size
+        value = self._next
+        self._next += 1
+        return value
+
+    def encode(self, value: int) -> str:
+        """Map a counter value to its short code"""
+        length = self.min_length
+        size = len(BASE62_ALPHABET) ** length
+        while value >= size:
+            value -= size
+            length += 1
+            size *= len(BASE62_ALPHABET)
+
+        if self.key is not None:
+            permutation = self._permutations.get(length)
+            if permutation is None:
+                permutation = FeistelPermutation(self.key, size)
+                self._permutations[length] = permutation
+            value = permutation.permute(value)
+        return encode_base62(value, length)
+
+    def next_code(self) -> str:
+        while True:
+            short_code = self.encode(self._next_id())
+            # Custom codes share the namespace and may already hold it
+            if short_code not in RESERVED_CODES and not self.storage.exists(short_code):
+                return short_code
+            self.collisions += 1
+
+
+def create_allocator(storage: StorageEngine) -> CodeAllocator:
+    """Create the short code allocator selected in settings"""
+    if settings.CODE_ALLOCATOR == "random":
+        return RandomAllocator(
+            storage,
+            length=settings.SHORT_CODE_LENGTH,
+            max_attempts=settings.CODE_MAX_ATTEMPTS,
+        )
+    if settings.CODE_ALLOCATOR == "counter":
+        return CounterAllocator(
+            storage,
+            length=settings.SHORT_CODE_LENGTH,
+            block_size=settings.CODE_BLOCK_SIZE,
+            scramble_key=settings.CODE_SCRAMBLE_KEY,
+        )
+    raise ValueError(f"Unknown code allocator: {settings.CODE_ALLOCATOR}")
@@ -0,0 +1,192 @@
+"""
+Per-link click time series for URL shortener
+"""
+
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+MINUTE_SLOTS = 120  # current and previous hour
+HOUR_SLOTS = 48  # current and previous day
+
+# Range name -> (resolution, number of buckets)
+RANGES: Dict[str, Tuple[str, int]] = {
+    "1h": ("minute", 60),
+    "24h": ("hour", 24),
+    "7d": ("day", 7),
+    "30d": ("day", 30),
+    "90d": ("day", 90),
+}
+
+
+class LinkSeries:
+    """
+    Minute, hour and day click counters for one link in a single array.
+
+    Clicks are only added to minute buckets. When an hour ends its minutes
+    are rolled up into an hour bucket, and when a day ends its hours are
+    rolled up into a day bucket, so each level keeps just the recent
+    window it needs and the array never grows.
+
+    Counters start at 16 bits, which is plenty for most links; a link
+    whose counts outgrow them has its array widened to 32 bits.
+    """
+
+    __slots__ = ("counts", "days", "minute", "since")
+
+    def __init__(self, days: int, minute: int):
+        self.days = days
+        self.counts = array("H", bytes(2 * (MINUTE_SLOTS + HOUR_SLOTS + days)))
+        self.minute: Optional[int] = None
+        # Minute tracking started; earlier clicks are not in the series
+        self.since = minute
+
+    def _set(self, slot: int, value: int) -> None:
+        try:
+            self.counts[slot] = value
+        except OverflowError:
+            self.counts = array("I", self.counts)
+            self.counts[slot] = value
+
+    def _clear(self, first: int, count: int) -> None:
+        self.counts[first:first + count] = array(self.counts.typecode, bytes(self.counts.itemsize * count))
+
+    # Slot positions within the array
+
+    def _minute_slot(self, minute: int) -> int:
+        return minute % MINUTE_SLOTS
+
+    def _hour_slot(self, hour: int) -> int:
+        return MINUTE_SLOTS + hour % HOUR_SLOTS
+
+    def _day_slot(self, day: int) -> int:
+        return MINUTE_SLOTS + HOUR_SLOTS + day % self.days
+
+    def add(self, minute: int, count: int) -> None:
+        self.advance(minute)
+        # A clock stepping back must not write into already rolled-up slots
+        slot = self._minute_slot(self.minute)
+        self._set(slot, self.counts[slot] + count)
+
+    def advance(self, minute: int) -> None:
+        """Roll up completed hours and days up to the given minute"""
+        last = self.minute
+        if last is not None and minute <= last:
+            return
+        self.minute = minute
+        if last is None:
+            return
+
+        last_hour, hour = last // 60, minute // 60
+        if hour > last_hour:
+            first = self._minute_slot(last_hour * 60)
+            self._set(self._hour_slot(last_hour), sum(self.counts[first:first + 60]))
+            # Skipped hours are still zero from when their day started, but
+            # the minute slots of the new hour (and of the one before it, if
+            # that was skipped) hold data from two hours back
+            stale = [hour] if hour == last_hour + 1 else [hour, hour - 1]
+            for stale_hour in stale:
+                self._clear(self._minute_slot(stale_hour * 60), 60)
+
+        last_day, day = last_hour // 24, hour // 24
+        if day > last_day:
+            first = self._hour_slot(last_day * 24)
+            self._set(self._day_slot(last_day), sum(self.counts[first:first + 24]))
+            # Day slots are reused every retention period, so skipped ones
+            # must be cleared explicitly
+            for skipped in range(last_day + 1, min(day, last_day + self.days)):
+                self.counts[self._day_slot(skipped)] = 0
+            stale = [day] if day == last_day + 1 else [day, day - 1]
+            for stale_day in stale:
+                self._clear(self._hour_slot(stale_day * 24), 24)
+
+    def by_minute(self, minute: int, count: int) -> List[int]:
+        return [self.counts[self._minute_slot(m)] for m in range(minute - count + 1, minute + 1)]
+
+    def by_hour(self, minute: int, count: int) -> List[int]:
+        hour = minute // 60
+        values = [self.counts[self._hour_slot(h)] for h in range(hour - count + 1, hour)]
+        # The current hour has not been rolled up yet
+        first = self._minute_slot(hour * 60)
+        return values + [sum(self.counts[first:first + 60])]
+
+    def by_day(self, minute: int, count: int) -> List[int]:
+        day = minute // 1440
+        values = [self.counts[self._day_slot(d)] for d in range(day - count + 1, day)]
+        # Today is the completed hours so far plus the current hour
+        hours = self.by_hour(minute, minute // 60 - day * 24 + 1)
+        return values + [sum(hours)]
+
+
+class ClickAnalytics:
+    """
+    Time-bucketed click counts for the most recently clicked links.
+
+    Each tracked link costs one fixed-size array, about 800 bytes with the
+    default retention. At most ``max_links`` links are tracked; the least
+    recently clicked one is dropped when a new link needs room.
+
+    Series only hold the clicks this process is told about since it
+    started or began tracking the link - with SQLite storage, just its own
+    redirects - and they are not persisted.
+    """
+
+    def __init__(self, max_links: int = 100000, days: int = 90):
+        self.max_links = max_links
+        self.days = days
+        self._series: "OrderedDict[str, LinkSeries]" = OrderedDict()
+
+    def record(self, deltas: Dict[str, int], now: Optional[float] = None) -> None:
+        """Add aggregated clicks that happened at ``now``"""
+        minute = int((time.time() if now is None else now) // 60)
+        series_by_code = self._series
+        for short_code, count in deltas.items():
+            series = series_by_code.get(short_code)
+            if series is None:
+                if len(series_by_code) >= self.max_links:
+                    series_by_code.popitem(last=False)
+                series = series_by_code[short_code] = LinkSeries(self.days, minute)
+            else:
+                series_by_code.move_to_end(short_code)
+            series.add(minute, count)
+
+    def query(self, short_code: str, range_name: str, now: Optional[float] = None) -> dict:
+        """Return per-bucket click counts for a range ending now"""
+        resolution, count = RANGES[range_name]
+        if resolution == "day" and count > self.days:
+            raise ValueError(f"Range exceeds the {self.days} day retention")
+
+        minute = int((time.time() if now is None else now) // 60)
+        series = self._series.get(short_code)
+        since = None
+        if series is None:
+            values = [0] * count
+        else:
+            series.advance(minute)
+            if resolution == "minute":
+                values = series.by_minute(minute, count)
+            elif resolution == "hour":
+                values = series.by_hour(minute, count)
+            else:
+                values = series.by_day(minute, count)
+            since = datetime.fromtimestamp(series.since * 60, timezone.utc).isoformat()
+
+        step = {"minute": 60, "hour": 3600, "day": 86400}[resolution]
+        current = minute * 60 // step * step
+        buckets = [
+            {
+                "start": datetime.fromtimestamp(current - (count - 1 - i) * step, timezone.utc).isoformat(),
+                "clicks": value,
+            }
+            for i, value in enumerate(values)
+        ]
+        return {
+            "range": range_name,
+            "resolution": resolution,
+            "clicks": sum(values),
+            # Clicks before this were not counted; None if the link is not tracked
+            "tracked_since": since,
+            "buckets": buckets,
+        }
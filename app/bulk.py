@@ -0,0 +1,240 @@
+"""
+Bulk URL shortening for URL shortener
+"""
+
+import codecs
+import json
+import math
+from typing import Any, AsyncIterator, Callable, List, Optional, Tuple
+
+from pydantic import ValidationError
+from starlette.responses import StreamingResponse
+
+from .allocator import CodeAllocator
+from .metrics import SHORTEN_SECONDS, timed
+from .models import URLCreate, URLResponse
+from .normalize import dedupe_key
+from .storage import StorageEngine
+from .storage_io import StorageIO
+from .utils import link_limits, validate_url_create
+
+
+class BulkItemError(ValueError):
+    """An input item answered with an error instead of being stored"""
+
+
+class BulkParseError(BulkItemError):
+    """An input item that could not be parsed"""
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    """
+    Streaming NDJSON response that can be sent while the request body is
+    still being read.
+
+    StreamingResponse normally listens for a client disconnect, which
+    consumes the request body; bulk imports read that body lazily from the
+    response generator, so this variant only sends.
+    """
+
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def iter_json_items(
+    chunks: AsyncIterator[bytes], ndjson: bool, max_item_bytes: int
+) -> AsyncIterator[Any]:
+    """
+    Incrementally parse a JSON array or an NDJSON stream.
+
+    Yields each decoded item, or a BulkParseError for an item that could
+    not be decoded. Only one item plus one chunk is buffered at a time.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    started = ndjson
+
+    async for chunk in chunks:
+        buffer += text.decode(chunk)
+
+        if ndjson:
+            *lines, buffer = buffer.split("\n")
+            for line in lines:
+                if line.strip():
+                    yield _decode_line(line)
+        else:
+            pos = 0
+            while True:
+                pos = _skip_separators(buffer, pos)
+                if pos == len(buffer):
+                    break
+                if not started:
+                    if buffer[pos] != "[":
+                        yield BulkParseError("Expected a JSON array")
+                        return
+                    started = True
+                    pos += 1
+                    continue
+                if buffer[pos] == "]":
+                    return
+                try:
+                    item, pos = decoder.raw_decode(buffer, pos)
+                except ValueError:
+                    # Item continues in the next chunk
+                    break
+                yield item
+            buffer = buffer[pos:]
+
+        if len(buffer) > max_item_bytes:
+            yield BulkParseError("Item too large")
+            return
+
+    buffer += text.decode(b"", final=True)
+    if ndjson:
+        if buffer.strip():
+            yield _decode_line(buffer)
+    elif buffer.strip():
+        yield BulkParseError("Malformed JSON array")
+
+
+def _decode_line(line: str) -> Any:
+    try:
+        return json.loads(line)
+    except ValueError:
+        return BulkParseError("Malformed JSON line")
+
+
+def _skip_separators(buffer: str, pos: int) -> int:
+    while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+        pos += 1
+    return pos
+
+
+@timed(SHORTEN_SECONDS.labels("bulk_batch"))
+def shorten_batch(
+    storage: StorageEngine,
+    allocator: CodeAllocator,
+    items: List[Any],
+    start_index: int,
+    base_url: str,
+    dedupe: bool = False,
+) -> List[str]:
+    """Validate and store a batch of create requests; return NDJSON lines"""
+    results: List[Any] = [None] * len(items)
+    requests: List[Any] = [None] * len(items)
+    links = []
+    limits = []
+    positions = []
+    # Dedupe key -> position of the first item in this batch with that URL
+    seen = {}
+
+    for i, item in enumerate(items):
+        if isinstance(item, BulkItemError):
+            results[i] = str(item)
+            continue
+        try:
+            request = URLCreate.model_validate(item)
+        except ValidationError:
+            results[i] = "Invalid request"
+            continue
+        error = validate_url_create(request)
+        if error:
+            results[i] = error
+            continue
+        requests[i] = request
+        request_limits = link_limits(request)
+        # Links with limits are never shared
+        if dedupe and not request.custom_code and request_limits is None:
+            key = dedupe_key(request.url)
+            existing = storage.find_by_url(request.url)
+            if existing is not None:
+                results[i] = _response(base_url, existing, request.url)
+                continue
+            if key in seen:
+                # Resolved once the first occurrence is stored
+                results[i] = seen[key]
+                continue
+            seen[key] = i
+        links.append((request.custom_code or allocator.next_code(), request.url))
+        limits.append(request_limits)
+        positions.append(i)
+
+    # One storage write for the whole batch
+    inserted = storage.add_links(links, limits) if links else []
+    for (short_code, url), i, ok in zip(links, positions, inserted):
+        if not ok:
+            if requests[i].custom_code:
+                results[i] = "Custom code already exists"
+                continue
+            # Generated code taken since it was checked; allocate another
+            short_code = allocator.create(url, link_limits(requests[i]))
+        results[i] = _response(base_url, short_code, url)
+
+    lines = []
+    for i, result in enumerate(results):
+        if isinstance(result, int):
+            result = _response(base_url, results[result].short_code, requests[i].url)
+        if isinstance(result, URLResponse):
+            lines.append(result.model_dump_json() + "\n")
+        else:
+            lines.append(json.dumps({"index": start_index + i, "detail": result}) + "\n")
+    return lines
+
+
+def _response(base_url: str, short_code: str, url: str) -> URLResponse:
+    return URLResponse(
+        short_url=f"{base_url}/{short_code}",
+        original_url=url,
+        short_code=short_code,
+    )
+
+
+async def shorten_stream(
+    io: StorageIO,
+    storage: StorageEngine,
+    allocator: CodeAllocator,
+    items: AsyncIterator[Any],
+    base_url: str,
+    batch_size: int,
+    dedupe: bool = False,
+    admit: Optional[Callable[[int], Tuple[int, float]]] = None,
+) -> AsyncIterator[str]:
+    """
+    Shorten streamed items batch by batch, yielding one line per item.
+
+    ``admit(n)`` returns how many of the next n items may be stored, and
+    the seconds until more may; the rest are answered with an error.
+    """
+    batch = []
+    index = 0
+    async for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            for line in await io.run(
+                shorten_batch, storage, allocator, _admit(batch, admit), index, base_url, dedupe
+            ):
+                yield line
+            index += len(batch)
+            batch = []
+    if batch:
+        for line in await io.run(
+            shorten_batch, storage, allocator, _admit(batch, admit), index, base_url, dedupe
+        ):
+            yield line
+
+
+def _admit(
+    batch: List[Any], admit: Optional[Callable[[int], Tuple[int, float]]]
+) -> List[Any]:
+    if admit is None:
+        return batch
+    granted, retry_after = admit(len(batch))
+    if granted < len(batch):
+        error = BulkItemError(f"Rate limit exceeded; retry after {math.ceil(retry_after)} seconds")
+        batch[granted:] = [error] * (len(batch) - granted)
+    return batch
@@ -17,6 +17,7 @@ class Settings:
     # Server settings
     HOST: str = os.getenv("HOST", "0.0.0.0")
     PORT: int = int(os.getenv("PORT", 8000))
+    WORKERS: int = int(os.getenv("WORKERS", os.getenv("WEB_CONCURRENCY", 1)))
     
     # CORS settings
     ALLOWED_ORIGINS: List[str] = [
@@ -26,15 +27,116 @@ class Settings:
         "https://*.vercel.app"
     ]
     
+    # Seconds browsers may reuse the home page before revalidating
+    HOME_CACHE_MAX_AGE: int = int(os.getenv("HOME_CACHE_MAX_AGE", 300))
+    
     # Storage settings
     DATA_DIR: str = os.getenv("DATA_DIR", "data")
     DATA_FILE: str = os.path.join(DATA_DIR, "url_data.json")
     STATS_FILE: str = os.path.join(DATA_DIR, "stats_data.json")
+    STORAGE_BACKEND: str = os.getenv("STORAGE_BACKEND", "log")
+    # Lock and tail the event log so several worker processes can share it
+    SHARED_STORAGE: bool = os.getenv(
+        "SHARED_STORAGE", str(WORKERS > 1)
+    ).lower() == "true"
+    
+    # Event log settings
+    # In-memory link layout: "dict" (fastest) or "compact" (far less memory)
+    LINK_TABLE: str = os.getenv("LINK_TABLE", "dict")
+    SNAPSHOT_FILE: str = os.path.join(DATA_DIR, "snapshot.dat")
+    # Snapshot written by earlier versions, read only when SNAPSHOT_FILE is missing
+    LEGACY_SNAPSHOT_FILE: str = os.path.join(DATA_DIR, "snapshot.json")
+    LOG_FILE: str = os.path.join(DATA_DIR, "events.log")
+    # Memory-mapped link index written by the "mmap" backend in place of a snapshot
+    INDEX_FILE: str = os.path.join(DATA_DIR, "links.idx")
+    LOG_FSYNC_BATCH: int = int(os.getenv("LOG_FSYNC_BATCH", 256))
+    LOG_FSYNC_INTERVAL: float = float(os.getenv("LOG_FSYNC_INTERVAL", 1.0))
+    SNAPSHOT_MIN_EVENTS: int = int(os.getenv("SNAPSHOT_MIN_EVENTS", 10000))
+    SNAPSHOT_INTERVAL: float = float(os.getenv("SNAPSHOT_INTERVAL", 300))
+    
+    # SQLite settings
+    SQLITE_FILE: str = os.getenv("SQLITE_FILE", os.path.join(DATA_DIR, "links.db"))
+    SQLITE_BUSY_TIMEOUT: float = float(os.getenv("SQLITE_BUSY_TIMEOUT", 5.0))
+    # Filter of stored codes that answers most unknown codes without a lookup:
+    # "auto" (sqlite with one worker), "true" or "false"
+    LINK_FILTER: str = os.getenv("LINK_FILTER", "auto")
+    LINK_FILTER_ERROR_RATE: float = float(os.getenv("LINK_FILTER_ERROR_RATE", 0.01))
+    # Codes the filter is sized for, at least twice the stored links
+    LINK_FILTER_CAPACITY: int = int(os.getenv("LINK_FILTER_CAPACITY", 1000000))
+    # Storage writes queued for the I/O thread before callers have to wait
+    STORAGE_IO_QUEUE_SIZE: int = int(os.getenv("STORAGE_IO_QUEUE_SIZE", 1024))
+    
+    # Click counter settings
+    CLICK_FLUSH_INTERVAL: float = float(os.getenv("CLICK_FLUSH_INTERVAL", 1.0))
+    CLICK_FLUSH_THRESHOLD: int = int(os.getenv("CLICK_FLUSH_THRESHOLD", 1000))
+    CLICK_BUFFER_SHARDS: int = int(os.getenv("CLICK_BUFFER_SHARDS", 16))
+    
+    # Click analytics settings
+    ANALYTICS_MAX_LINKS: int = int(os.getenv("ANALYTICS_MAX_LINKS", 100000))
+    ANALYTICS_RETENTION_DAYS: int = int(os.getenv("ANALYTICS_RETENTION_DAYS", 90))
     
     # Short code settings
     SHORT_CODE_LENGTH: int = 6
+    CODE_ALLOCATOR: str = os.getenv("CODE_ALLOCATOR", "random")
+    CODE_MAX_ATTEMPTS: int = int(os.getenv("CODE_MAX_ATTEMPTS", 8))
+    CODE_BLOCK_SIZE: int = int(os.getenv("CODE_BLOCK_SIZE", 1000))
+    CODE_SCRAMBLE_KEY: str = os.getenv("CODE_SCRAMBLE_KEY", "")
+    # Return the existing code when the same URL is shortened again
+    DEDUPE_URLS: bool = os.getenv("DEDUPE_URLS", "False").lower() == "true"
     CUSTOM_CODE_MIN_LENGTH: int = 3
     CUSTOM_CODE_MAX_LENGTH: int = 20
+    # Validate and normalize URLs before storing them: lower-case scheme and
+    # host, IDNA hosts, canonical percent-encoding, blocked domains
+    URL_NORMALIZE: bool = os.getenv("URL_NORMALIZE", "False").lower() == "true"
+    URL_MAX_LENGTH: int = int(os.getenv("URL_MAX_LENGTH", 2048))
+    # Domains refused with URL_NORMALIZE, with their subdomains: a comma
+    # separated list, and/or a file with one domain per line
+    BLOCKED_DOMAINS: str = os.getenv("BLOCKED_DOMAINS", "")
+    BLOCKED_DOMAINS_FILE: str = os.getenv("BLOCKED_DOMAINS_FILE", "")
+    
+    # Redirect fast path settings
+    FAST_REDIRECT: bool = os.getenv("FAST_REDIRECT", "True").lower() == "true"
+    
+    # Hot-link cache in front of storage, used by all redirects
+    LINK_CACHE_SIZE: int = int(
+        os.getenv("LINK_CACHE_SIZE", os.getenv("FAST_REDIRECT_CACHE_SIZE", 100000))
+    )
+    # Seconds before a cached link is read from storage again
+    LINK_CACHE_TTL: float = float(os.getenv("LINK_CACHE_TTL", 300))
+    # Unknown codes remembered, and for how long, so 404 floods skip storage
+    LINK_CACHE_NEGATIVE_SIZE: int = int(os.getenv("LINK_CACHE_NEGATIVE_SIZE", 10000))
+    LINK_CACHE_NEGATIVE_TTL: float = float(os.getenv("LINK_CACHE_NEGATIVE_TTL", 5))
+    
+    # Link expiry settings
+    EXPIRY_REAP_INTERVAL: float = float(os.getenv("EXPIRY_REAP_INTERVAL", 1.0))
+    EXPIRY_REAP_BATCH: int = int(os.getenv("EXPIRY_REAP_BATCH", 1000))
+    
+    # Rate limits on link creation, per client address and across all clients
+    RATE_LIMIT_ENABLED: bool = os.getenv("RATE_LIMIT_ENABLED", "True").lower() == "true"
+    RATE_LIMIT_PER_SECOND: float = float(os.getenv("RATE_LIMIT_PER_SECOND", 5))
+    RATE_LIMIT_BURST: float = float(os.getenv("RATE_LIMIT_BURST", 20))
+    RATE_LIMIT_GLOBAL_PER_SECOND: float = float(os.getenv("RATE_LIMIT_GLOBAL_PER_SECOND", 500))
+    RATE_LIMIT_GLOBAL_BURST: float = float(os.getenv("RATE_LIMIT_GLOBAL_BURST", 1000))
+    # Bulk items are written in batches, so they get a separate, larger budget
+    RATE_LIMIT_BULK_PER_SECOND: float = float(os.getenv("RATE_LIMIT_BULK_PER_SECOND", 1000))
+    RATE_LIMIT_BULK_BURST: float = float(os.getenv("RATE_LIMIT_BULK_BURST", 10000))
+    RATE_LIMIT_BULK_GLOBAL_PER_SECOND: float = float(os.getenv("RATE_LIMIT_BULK_GLOBAL_PER_SECOND", 5000))
+    RATE_LIMIT_BULK_GLOBAL_BURST: float = float(os.getenv("RATE_LIMIT_BULK_GLOBAL_BURST", 50000))
+    RATE_LIMIT_MAX_CLIENTS: int = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", 100000))
+    # Take the client address from X-Forwarded-For; only behind a trusted proxy
+    RATE_LIMIT_TRUST_PROXY: bool = os.getenv("RATE_LIMIT_TRUST_PROXY", "False").lower() == "true"
+    # Number of trusted proxies in front of the app, each appending one entry
+    RATE_LIMIT_PROXY_HOPS: int = int(os.getenv("RATE_LIMIT_PROXY_HOPS", 1))
+    
+    # Prometheus metrics at /metrics, and the timing behind them
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "True").lower() == "true"
+    
+    # Readiness reports not ready when clicks wait longer than this to be flushed
+    READY_MAX_FLUSH_LAG: float = float(os.getenv("READY_MAX_FLUSH_LAG", 30))
+    
+    # Bulk import settings
+    BULK_BATCH_SIZE: int = int(os.getenv("BULK_BATCH_SIZE", 1000))
+    BULK_MAX_ITEM_BYTES: int = int(os.getenv("BULK_MAX_ITEM_BYTES", 65536))
 
 
 settings = Settings()
\ No newline at end of file
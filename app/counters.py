@@ -0,0 +1,106 @@
+"""
+Write-behind click counters for URL shortener
+"""
+
+import asyncio
+import time
+from typing import Dict
+
+from .metrics import STORAGE_SECONDS, timed
+from .storage import StorageEngine
+from .storage_io import StorageIO
+
+
+class ClickBuffer:
+    """
+    Sharded in-memory buffer of click deltas awaiting persistence.
+
+    Redirects only bump a counter here; a background task drains the
+    shards and hands the aggregated deltas to the storage engine once per
+    interval, or sooner when the number of pending clicks reaches the
+    flush threshold. A crash therefore loses at most one interval or one
+    threshold worth of clicks; deltas whose write fails are put back and
+    retried by the next flush.
+    """
+
+    def __init__(self, shards: int = 16, flush_threshold: int = 1000):
+        if shards < 1 or shards & (shards - 1):
+            raise ValueError("Shard count must be a power of two")
+        self._shards = [{} for _ in range(shards)]
+        self._mask = shards - 1
+        self.flush_threshold = flush_threshold
+        self.pending = 0
+        self.last_flush = time.monotonic()
+        self._wakeup = asyncio.Event()
+
+    def incr(self, short_code: str) -> None:
+        """Record one click"""
+        shard = self._shards[hash(short_code) & self._mask]
+        shard[short_code] = shard.get(short_code, 0) + 1
+        self.pending += 1
+        if self.pending >= self.flush_threshold:
+            self._wakeup.set()
+
+    def get(self, short_code: str) -> int:
+        """Return clicks recorded for a short code but not yet flushed"""
+        return self._shards[hash(short_code) & self._mask].get(short_code, 0)
+
+    def drain(self) -> Dict[str, int]:
+        """Swap out every shard and return the merged deltas"""
+        deltas = {}
+        for i, shard in enumerate(self._shards):
+            if shard:
+                self._shards[i] = {}
+                deltas.update(shard)
+        self.pending = 0
+        return deltas
+
+    def merge(self, deltas: Dict[str, int]) -> None:
+        """Put drained deltas back, e.g. after a failed write"""
+        shards, mask = self._shards, self._mask
+        for short_code, amount in deltas.items():
+            shard = shards[hash(short_code) & mask]
+            shard[short_code] = shard.get(short_code, 0) + amount
+        self.pending += sum(deltas.values())
+
+    async def flush(self, storage: StorageEngine, io: StorageIO) -> int:
+        """Persist pending deltas and return the number of clicks written"""
+        pending = self.pending
+        deltas = self.drain()
+        if deltas:
+            try:
+                await io.run(_write_clicks, storage, deltas)
+            except Exception:
+                # Not stored; keep them for the next flush
+                self.merge(deltas)
+                raise
+        self.last_flush = time.monotonic()
+        return pending
+
+    def lag(self) -> float:
+        """Upper bound in seconds on how long a pending click has waited"""
+        return time.monotonic() - self.last_flush if self.pending else 0.0
+
+    async def run(self, storage: StorageEngine, io: StorageIO, interval: float) -> None:
+        """Flush on every interval, or earlier when the threshold is hit"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush(storage, io)
+            except Exception as e:
+                print(f"Error flushing clicks: {e}")
+
+
+@timed(STORAGE_SECONDS.labels("click_flush"))
+def _write_clicks(storage: StorageEngine, deltas: Dict[str, int]) -> None:
+    storage.add_clicks(deltas)
+    try:
+        storage.flush()
+    except OSError as e:
+        # The clicks are stored, so they must not be written again; the
+        # sync is retried with the next flush
+        print(f"Error syncing clicks: {e}")
@@ -0,0 +1,81 @@
+"""
+Background removal of expired links for URL shortener
+"""
+
+import asyncio
+import heapq
+import time
+from typing import Iterable, List, Optional, Tuple
+
+from .storage import StorageEngine
+from .storage_io import StorageIO
+
+
+class ExpiryReaper:
+    """
+    Min-heap of link expiry times, drained by a background task.
+
+    Only links that expire are in the heap, and each pass pops just the
+    entries that are due, so reaping never scans the whole link table.
+    Links that run out of clicks are pushed as due when a redirect
+    notices. Entries go stale: the link may be gone already, or its code
+    reused for a new link, here or by another worker. So a pass only
+    removes links whose stored limits say they are due; a capped link
+    whose clicks are not flushed yet is pushed again by its next redirect.
+    """
+
+    def __init__(self, batch_size: int = 1000):
+        self.batch_size = batch_size
+        self._heap: List[Tuple[float, str]] = []
+        self.reaped = 0
+
+    def load(self, links: Iterable[Tuple[str, float]]) -> None:
+        """Replace the heap with (short_code, expires_at) pairs"""
+        self._heap = [(expires_at, short_code) for short_code, expires_at in links]
+        heapq.heapify(self._heap)
+
+    def schedule(self, links: Iterable[Tuple[str, float]]) -> None:
+        """Add (short_code, expires_at) pairs"""
+        for short_code, expires_at in links:
+            heapq.heappush(self._heap, (expires_at, short_code))
+
+    def expire_now(self, short_code: str) -> None:
+        """Reap a link on the next pass, e.g. once it has run out of clicks"""
+        heapq.heappush(self._heap, (time.time(), short_code))
+
+    def due(self, now: float) -> List[str]:
+        """Pop up to one batch of codes whose expiry time has passed"""
+        heap = self._heap
+        codes = []
+        while heap and heap[0][0] <= now and len(codes) < self.batch_size:
+            codes.append(heapq.heappop(heap)[1])
+        return codes
+
+    async def reap(self, storage: StorageEngine, io: StorageIO, now: Optional[float] = None) -> int:
+        """Remove every link due by ``now``; return how many existed"""
+        now = time.time() if now is None else now
+        removed = 0
+        while True:
+            codes = self.due(now)
+            if not codes:
+                return removed
+            try:
+                batch = len(await io.run(storage.remove_expired, codes, now))
+            except Exception:
+                # Retry them on the next pass
+                self.schedule((short_code, now) for short_code in codes)
+                raise
+            removed += batch
+            self.reaped += batch
+
+    async def run(self, storage: StorageEngine, io: StorageIO, interval: float) -> None:
+        """Reap due links every interval"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reap(storage, io)
+            except Exception as e:
+                print(f"Error removing expired links: {e}")
+
+    def __len__(self) -> int:
+        return len(self._heap)
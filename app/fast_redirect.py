@@ -0,0 +1,87 @@
+"""
+Fast-path redirects for URL shortener
+"""
+
+import time
+from typing import List, Optional, Set, Tuple
+from urllib.parse import quote
+
+from .counters import ClickBuffer
+from .link_cache import LinkCache
+from .metrics import Histogram
+
+Headers = List[Tuple[bytes, bytes]]
+
+
+class RedirectCache:
+    """Prebuilt 302 response headers per short code, kept on link cache entries"""
+
+    def __init__(self, links: LinkCache):
+        self.links = links
+        self.clicks: Optional[ClickBuffer] = None
+        self.reserved: Set[str] = set()
+
+    def bind(self, clicks: ClickBuffer, reserved: Set[str]) -> None:
+        """Attach the click buffer once storage is loaded"""
+        self.clicks = clicks
+        self.reserved = reserved
+
+    async def get(self, short_code: str) -> Optional[Headers]:
+        """Return the redirect headers for a short code, or None if unknown"""
+        entry = await self.links.lookup(short_code)
+        if entry is None:
+            return None
+        if entry.headers is None:
+            entry.headers = build_redirect_headers(entry.url)
+        return entry.headers
+
+
+def build_redirect_headers(url: str) -> Headers:
+    """Build the same headers RedirectResponse sends for a URL"""
+    location = quote(url, safe=":/%#?=@[]!$&'()*+,;")
+    return [(b"location", location.encode("latin-1")), (b"content-length", b"0")]
+
+
+class FastRedirectMiddleware:
+    """
+    Raw ASGI middleware answering ``GET /{short_code}`` before routing.
+
+    Known codes get a 302 straight from the prebuilt headers, with the
+    click recorded exactly as redirect_url would. Everything else,
+    including unknown codes, falls through to the FastAPI app, so 404s and
+    all other routes behave as before. A code that was looked up and not
+    found is flagged as ``link_missing`` in the request state, so the app
+    does not look it up - and count an expired link's use - a second time.
+    Answered redirects are timed into ``latency`` when it is given.
+    """
+
+    def __init__(self, app, cache: RedirectCache, latency: Optional[Histogram] = None):
+        self.app = app
+        self.cache = cache
+        self.latency = latency
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] == "http" and scope["method"] in ("GET", "HEAD"):
+            short_code = scope["path"][1:]
+            cache = self.cache
+            if (
+                short_code
+                and cache.clicks is not None
+                and "/" not in short_code
+                and short_code not in cache.reserved
+            ):
+                start = time.perf_counter()
+                headers = await cache.get(short_code)
+                if headers is not None:
+                    cache.clicks.incr(short_code)
+                    await send({
+                        "type": "http.response.start",
+                        "status": 302,
+                        "headers": headers,
+                    })
+                    await send({"type": "http.response.body", "body": b""})
+                    if self.latency is not None:
+                        self.latency.observe(time.perf_counter() - start)
+                    return
+                scope.setdefault("state", {})["link_missing"] = True
+        await self.app(scope, receive, send)
@@ -0,0 +1,194 @@
+"""
+Hot-link cache for URL shortener
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .storage import LinkLimits, StorageEngine
+
+Link = Tuple[str, Optional[LinkLimits], int]
+
+
+class CachedLink:
+    """A cached URL, plus whatever the redirect path derives from it"""
+
+    __slots__ = ("url", "expires", "headers", "expires_at", "max_clicks", "clicks")
+
+    def __init__(self, link: Link, expires: float):
+        self.url, limits, self.clicks = link
+        self.expires = expires
+        self.expires_at, self.max_clicks = limits or (None, None)
+        # Prebuilt redirect headers, filled in by the fast path on first use
+        self.headers: Optional[List[Tuple[bytes, bytes]]] = None
+
+    def use(self, now: float) -> bool:
+        """Count one redirect; return False if the link has expired or run out of clicks"""
+        if self.expires_at is not None and now >= self.expires_at:
+            return False
+        if self.max_clicks is not None:
+            if self.clicks >= self.max_clicks:
+                return False
+            self.clicks += 1
+        return True
+
+
+class LinkCache:
+    """
+    Bounded short code -> URL cache in front of the storage engine.
+
+    Entries are evicted least recently used first beyond ``max_entries``
+    and reloaded ``ttl`` seconds after they were read, so links changed by
+    other workers are picked up. Unknown codes are remembered in a separate,
+    smaller LRU for ``negative_ttl`` seconds, so a flood of 404s does not
+    reach storage; codes the storage's link filter rules out are answered
+    without either. Engines with blocking reads are read off the event loop,
+    and concurrent misses on one code share a single read.
+
+    Expiry times and click caps are checked on the cached entry, so they
+    cost nothing extra per redirect. Click caps count this worker's
+    redirects on top of the clicks stored when the entry was loaded, so
+    with several workers a cap may be overshot by up to one cache TTL's
+    worth of their clicks.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 100000,
+        ttl: float = 300.0,
+        negative_entries: int = 10000,
+        negative_ttl: float = 5.0,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_entries = negative_entries
+        self.negative_ttl = negative_ttl
+        self.storage: Optional[StorageEngine] = None
+        self._entries: "OrderedDict[str, CachedLink]" = OrderedDict()
+        # Code -> monotonic time its absence stops being trusted
+        self._missing: "OrderedDict[str, float]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Future] = {}
+        # Called with codes found expired or out of clicks
+        self.on_expired: Optional[Callable[[str], None]] = None
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.filtered = 0
+        self.loads = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def bind(self, storage: StorageEngine) -> None:
+        """Attach the storage engine once it is loaded"""
+        self.storage = storage
+        self.clear()
+
+    async def get(self, short_code: str) -> Optional[str]:
+        """Return the URL to redirect a short code to, or None"""
+        entry = await self.lookup(short_code)
+        return entry.url if entry is not None else None
+
+    async def lookup(self, short_code: str) -> Optional[CachedLink]:
+        """
+        Return the cache entry to redirect a short code with, or None.
+
+        None means the code is unknown, expired or out of clicks; each
+        entry returned counts as one click toward the link's cap.
+        """
+        entry = await self._load(short_code)
+        if entry is None or entry.use(time.time()):
+            return entry
+        if self.on_expired is not None:
+            self.on_expired(short_code)
+        return None
+
+    async def _load(self, short_code: str) -> Optional[CachedLink]:
+        """Return the cache entry for a short code, loading it on a miss"""
+        now = time.monotonic()
+        entry = self._entries.get(short_code)
+        if entry is not None:
+            if entry.expires > now:
+                self._entries.move_to_end(short_code)
+                self.hits += 1
+                return entry
+            del self._entries[short_code]
+            self.expirations += 1
+        else:
+            expires = self._missing.get(short_code)
+            if expires is not None:
+                if expires > now:
+                    self.negative_hits += 1
+                    return None
+                del self._missing[short_code]
+                self.expirations += 1
+
+        self.misses += 1
+        if not self.storage.might_exist(short_code):
+            # Rejected by the link filter without a storage read
+            self.filtered += 1
+            return None
+        if not self.storage.blocking_reads:
+            self.loads += 1
+            return self._store(short_code, self.storage.get_link(short_code))
+
+        future = self._loading.get(short_code)
+        if future is None:
+            self.loads += 1
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(None, self.storage.get_link, short_code)
+            self._loading[short_code] = future
+            future.add_done_callback(lambda _: self._loading.pop(short_code, None))
+        else:
+            self.coalesced += 1
+        # A cancelled request must not cancel the read others are waiting on
+        link = await asyncio.shield(future)
+        return self._store(short_code, link)
+
+    def _store(self, short_code: str, link: Optional[Link]) -> Optional[CachedLink]:
+        now = time.monotonic()
+        if link is None:
+            self._missing[short_code] = now + self.negative_ttl
+            self._missing.move_to_end(short_code)
+            while len(self._missing) > self.negative_entries:
+                self._missing.popitem(last=False)
+                self.evictions += 1
+            return None
+
+        # Requests that shared one read share one entry
+        entry = self._entries.get(short_code)
+        if entry is None or entry.url != link[0]:
+            entry = CachedLink(link, now + self.ttl)
+            self._entries[short_code] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def invalidate(self, short_codes: Iterable[str]) -> None:
+        """Forget what is cached about these codes, e.g. after they were created or removed"""
+        for short_code in short_codes:
+            self._entries.pop(short_code, None)
+            self._missing.pop(short_code, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._missing.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Sizes and hit/miss/eviction counters"""
+        return {
+            "entries": len(self._entries),
+            "negative_entries": len(self._missing),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "filtered": self.filtered,
+            "loads": self.loads,
+            "coalesced_loads": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
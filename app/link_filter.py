@@ -0,0 +1,99 @@
+"""
+Probabilistic short code membership for URL shortener
+"""
+
+import math
+from typing import Iterable
+
+# More hash functions barely shrink the filter at the error rates used
+# here, and each one is another probe on every lookup
+MAX_HASHES = 4
+COUNTER_MAX = 15
+MASK32 = 0xFFFFFFFF
+
+
+class LinkFilter:
+    """
+    Counting Bloom filter over short codes.
+
+    ``code in filter`` is False only for codes that were never added, or
+    were removed since; it may be True for codes that were not, with
+    about ``error_rate`` probability while it holds at most ``capacity``
+    codes. Counters are 4 bits, two to a byte, so removal is supported;
+    a counter that reaches 15 stays there, which can only cost a false
+    positive, never a false negative.
+
+    Positions come from Python's str hash, which is cached on the string
+    and salted per process, so the filter is rebuilt rather than saved.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        capacity = max(capacity, 1)
+        optimal_hashes = round(-math.log(error_rate) / math.log(2))
+        self.hashes = max(1, min(MAX_HASHES, optimal_hashes))
+        # Counters needed for error_rate at capacity with this many hashes
+        self.size = math.ceil(
+            -self.hashes * capacity / math.log(1 - error_rate ** (1 / self.hashes))
+        )
+        self.capacity = capacity
+        self.counters = bytearray((self.size + 1) // 2)
+        self.count = 0
+
+    @classmethod
+    def build(cls, codes: Iterable[str], capacity: int, error_rate: float = 0.01) -> "LinkFilter":
+        link_filter = cls(capacity, error_rate)
+        add = link_filter.add
+        for short_code in codes:
+            add(short_code)
+        return link_filter
+
+    def __contains__(self, short_code: str) -> bool:
+        h = hash(short_code)
+        position = h & MASK32
+        step = ((h >> 32) & MASK32) | 1
+        size = self.size
+        counters = self.counters
+        for _ in range(self.hashes):
+            index = position % size
+            if not (counters[index >> 1] >> ((index & 1) << 2)) & COUNTER_MAX:
+                return False
+            position += step
+        return True
+
+    def add(self, short_code: str) -> None:
+        self._update(short_code, 1)
+        self.count += 1
+
+    def remove(self, short_code: str) -> None:
+        """Forget a code that was added"""
+        self._update(short_code, -1)
+        self.count -= 1
+
+    def _update(self, short_code: str, delta: int) -> None:
+        h = hash(short_code)
+        position = h & MASK32
+        step = ((h >> 32) & MASK32) | 1
+        size = self.size
+        counters = self.counters
+        for _ in range(self.hashes):
+            index = position % size
+            shift = (index & 1) << 2
+            byte = counters[index >> 1]
+            counter = (byte >> shift) & COUNTER_MAX
+            if counter != COUNTER_MAX:
+                counter += delta
+                counters[index >> 1] = (byte & ~(COUNTER_MAX << shift)) | (counter << shift)
+            position += step
+
+    def error_rate(self) -> float:
+        """Expected false positive rate at the current number of codes"""
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+    def stats(self) -> dict:
+        return {
+            "codes": self.count,
+            "capacity": self.capacity,
+            "bytes": len(self.counters),
+            "hashes": self.hashes,
+            "expected_error_rate": round(self.error_rate(), 6),
+        }
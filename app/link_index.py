@@ -0,0 +1,373 @@
+"""
+Memory-mapped link index for URL shortener
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Type, Union
+
+from .link_table import GOLDEN, MASK64, LinkTable, Row
+from .normalize import url_fingerprint
+from .snapshot import CorruptDataError, fsync_dir
+
+MAGIC = b"URLIDX1\n"
+
+# magic, generation, next_id, links, clicks, capacity, entries size, body CRC32, header CRC32
+HEADER = struct.Struct("<8sQQQQQQII")
+# Hash slot: key, file offset of the entry
+SLOT = struct.Struct("<QQ")
+# Entry: code length, URL length, clicks; followed by the code and URL bytes
+ENTRY = struct.Struct("<IIQ")
+
+MAX_LOAD = 0.5
+
+
+def _code_key(raw: bytes) -> int:
+    """Non-zero 64-bit hash key of an encoded short code"""
+    if len(raw) <= 8:
+        key = int.from_bytes(raw, "big")
+    else:
+        key = zlib.crc32(raw) << 32 | zlib.adler32(raw)
+    return key or 1
+
+
+def _fingerprint_key(fingerprint: int) -> int:
+    return (fingerprint & MASK64) or 1
+
+
+def write_index(
+    path: str, generation: int, next_id: int, links: Iterable[Row], extra: Optional[dict] = None
+) -> None:
+    """
+    Atomically replace the index at ``path`` with the given (code, url, clicks) rows.
+
+    The file is a fixed-size header, two open-addressing hash tables of
+    (key, entry offset) slots - one keyed by short code, one by URL
+    fingerprint for dedupe - and the entries themselves, back to back.
+    All integers are little-endian. ``extra`` is stored as JSON after the
+    entries, for the small amount of data that is read in full at startup.
+    """
+    entries = bytearray()
+    offsets = array("Q")
+    code_keys = array("Q")
+    fingerprint_keys = array("Q")
+    total_clicks = 0
+    for short_code, url, clicks in links:
+        raw_code = short_code.encode("utf-8")
+        raw_url = url.encode("utf-8")
+        offsets.append(len(entries))
+        code_keys.append(_code_key(raw_code))
+        fingerprint_keys.append(_fingerprint_key(url_fingerprint(url)))
+        entries += ENTRY.pack(len(raw_code), len(raw_url), clicks)
+        entries += raw_code
+        entries += raw_url
+        total_clicks += clicks
+
+    capacity = 16
+    while capacity * MAX_LOAD < len(offsets):
+        capacity *= 2
+    entries_start = HEADER.size + 2 * SLOT.size * capacity
+    tables = []
+    for keys in (code_keys, fingerprint_keys):
+        slots = array("Q", bytes(SLOT.size * capacity))
+        shift = 64 - (capacity.bit_length() - 1)
+        mask = capacity - 1
+        for key, offset in zip(keys, offsets):
+            i = ((key * GOLDEN) & MASK64) >> shift
+            while slots[2 * i]:
+                i = (i + 1) & mask
+            slots[2 * i] = key
+            slots[2 * i + 1] = entries_start + offset
+        if sys.byteorder == "big":
+            slots.byteswap()
+        tables.append(slots.tobytes())
+
+    extra_data = json.dumps(extra).encode("utf-8") if extra else b""
+    body_crc = zlib.crc32(tables[1], zlib.crc32(tables[0]))
+    body_crc = zlib.crc32(extra_data, zlib.crc32(entries, body_crc))
+    fields = (MAGIC, generation, next_id, len(offsets), total_clicks, capacity, len(entries), body_crc)
+    header = HEADER.pack(*fields, 0)
+    header = HEADER.pack(*fields, zlib.crc32(header[:-4]))
+
+    tmp_file = path + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(header)
+        for table in tables:
+            f.write(table)
+        f.write(entries)
+        f.write(extra_data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+    fsync_dir(path)
+
+
+class LinkIndex:
+    """
+    Read-only view of an index file written by ``write_index``.
+
+    The file is memory-mapped rather than read, so opening it costs the
+    same for any number of links, and pages are only read from disk as
+    lookups touch them. Worker processes mapping the same file share one
+    copy in the page cache. Only the header is validated on open; the body
+    checksum is verified when the index is read in full.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            try:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise CorruptDataError(f"{path}: empty index file")
+        if hasattr(self._data, "madvise"):
+            # Lookups jump around; readahead would only fill the cache with neighbours
+            self._data.madvise(mmap.MADV_RANDOM)
+
+        if len(self._data) < HEADER.size:
+            raise CorruptDataError(f"{path}: truncated index header")
+        (magic, self.generation, self.next_id, self.links, self.clicks,
+         self.capacity, entries_size, self._body_crc, header_crc) = HEADER.unpack_from(self._data)
+        if magic != MAGIC or zlib.crc32(self._data[:HEADER.size - 4]) != header_crc:
+            raise CorruptDataError(f"{path}: not an index file, or its header is damaged")
+        self._code_slots = HEADER.size
+        self._fingerprint_slots = HEADER.size + SLOT.size * self.capacity
+        self._entries = self._fingerprint_slots + SLOT.size * self.capacity
+        self._entries_end = self._entries + entries_size
+        if self._entries_end > len(self._data):
+            raise CorruptDataError(f"{path}: index size does not match its header")
+        try:
+            self.extra: dict = json.loads(self._data[self._entries_end:] or b"{}")
+        except ValueError:
+            raise CorruptDataError(f"{path}: unreadable extra data")
+        self._shift = 64 - (self.capacity.bit_length() - 1)
+        self._mask = self.capacity - 1
+
+    def _probe(self, slots: int, key: int) -> Iterator[int]:
+        """Yield entry offsets stored under ``key``"""
+        data, mask = self._data, self._mask
+        i = ((key * GOLDEN) & MASK64) >> self._shift
+        while True:
+            found, offset = SLOT.unpack_from(data, slots + SLOT.size * i)
+            if not found:
+                return
+            if found == key:
+                yield offset
+            i = (i + 1) & mask
+
+    def _find(self, short_code: str) -> int:
+        """Return the entry offset for a code, or -1"""
+        # The hot path of every lookup, so the probe loop is inlined
+        raw = short_code.encode("utf-8")
+        key = _code_key(raw)
+        data, mask, unpack_slot = self._data, self._mask, SLOT.unpack_from
+        i = ((key * GOLDEN) & MASK64) >> self._shift
+        while True:
+            found, offset = unpack_slot(data, self._code_slots + 16 * i)
+            if not found:
+                return -1
+            if found == key:
+                start = offset + ENTRY.size
+                if data[start:start + len(raw)] == raw and ENTRY.unpack_from(data, offset)[0] == len(raw):
+                    return offset
+            i = (i + 1) & mask
+
+    def _read(self, offset: int) -> Row:
+        short_code, url, clicks, _ = self._read_entry(offset)
+        return short_code, url, clicks
+
+    def _read_entry(self, offset: int):
+        """Return the entry's code, URL and clicks, and the offset of the next entry"""
+        code_length, url_length, clicks = ENTRY.unpack_from(self._data, offset)
+        start = offset + ENTRY.size
+        end = start + code_length + url_length
+        short_code = self._data[start:start + code_length].decode("utf-8")
+        return short_code, self._data[start + code_length:end].decode("utf-8"), clicks, end
+
+    def get_url(self, short_code: str) -> Optional[str]:
+        offset = self._find(short_code)
+        if offset < 0:
+            return None
+        code_length, url_length, _ = ENTRY.unpack_from(self._data, offset)
+        start = offset + ENTRY.size + code_length
+        return self._data[start:start + url_length].decode("utf-8")
+
+    def get_clicks(self, short_code: str) -> int:
+        offset = self._find(short_code)
+        return ENTRY.unpack_from(self._data, offset)[2] if offset >= 0 else 0
+
+    def codes_for_fingerprint(self, fingerprint: int) -> Iterator[str]:
+        """Yield codes whose URL may have this dedupe fingerprint"""
+        for offset in self._probe(self._fingerprint_slots, _fingerprint_key(fingerprint)):
+            yield self._read(offset)[0]
+
+    def items(self) -> Iterator[Row]:
+        with memoryview(self._data)[self._code_slots:] as body:
+            crc = zlib.crc32(body)
+        if crc != self._body_crc:
+            raise CorruptDataError(f"{self.path}: checksum mismatch, the index is damaged")
+        offset, end = self._entries, self._entries_end
+        while offset < end:
+            short_code, url, clicks, offset = self._read_entry(offset)
+            yield short_code, url, clicks
+
+    def total_clicks(self) -> int:
+        return self.clicks
+
+    def __len__(self) -> int:
+        return self.links
+
+    def __contains__(self, short_code: str) -> bool:
+        return self._find(short_code) >= 0
+
+
+class LayeredLinkTable(LinkTable):
+    """
+    A mutable overlay on top of a read-only base.
+
+    The base is a ``LinkIndex``, or another layered table frozen when the
+    log was rotated for compaction. New links go into the overlay; clicks
+    on links in the base are kept as deltas, and links removed from the
+    base as a set of codes that hides them. ``generation`` is the log
+    generation the overlay starts at, which is how ``rebase`` knows which
+    layers a newly written index replaces.
+    """
+
+    def __init__(
+        self,
+        base: Optional[Union[LinkIndex, "LayeredLinkTable"]],
+        overlay: LinkTable,
+        generation: int,
+        clicks: Optional[Dict[str, int]] = None,
+        fingerprints: Optional[Dict[int, str]] = None,
+        removed: Optional[Set[str]] = None,
+    ):
+        self.base = base
+        self.overlay = overlay
+        self.generation = generation
+        # Clicks on links in the base since it was written
+        self.clicks: Dict[str, int] = clicks if clicks is not None else {}
+        # URL fingerprint -> first overlay code, for dedupe
+        self.fingerprints: Dict[int, str] = fingerprints if fingerprints is not None else {}
+        # Codes removed from the base; a code may since be reused in the overlay
+        self.removed: Set[str] = removed if removed is not None else set()
+
+    def load(self, codes: List[str], urls: List[str], clicks: List[int]) -> None:
+        self.overlay.load(codes, urls, clicks)
+        self.fingerprints = {}
+        for short_code, url in zip(codes, urls):
+            self.fingerprints.setdefault(url_fingerprint(url), short_code)
+
+    def get_url(self, short_code: str) -> Optional[str]:
+        url = self.overlay.get_url(short_code)
+        if url is None and self._in_base(short_code):
+            url = self.base.get_url(short_code)
+        return url
+
+    def _in_base(self, short_code: str) -> bool:
+        if self.base is None or (self.removed and short_code in self.removed):
+            return False
+        return short_code in self.base
+
+    def get_clicks(self, short_code: str) -> int:
+        if short_code in self.overlay or not self._in_base(short_code):
+            return self.overlay.get_clicks(short_code)
+        return self.base.get_clicks(short_code) + self.clicks.get(short_code, 0)
+
+    def add(self, short_code: str, url: str) -> bool:
+        if self._in_base(short_code):
+            return False
+        if not self.overlay.add(short_code, url):
+            return False
+        self.fingerprints.setdefault(url_fingerprint(url), short_code)
+        return True
+
+    def add_clicks(self, short_code: str, amount: int) -> bool:
+        if self.overlay.add_clicks(short_code, amount):
+            return True
+        if not self._in_base(short_code):
+            return False
+        self.clicks[short_code] = self.clicks.get(short_code, 0) + amount
+        return True
+
+    def remove(self, short_code: str) -> bool:
+        url = self.overlay.get_url(short_code)
+        if url is not None:
+            self.overlay.remove(short_code)
+        elif self._in_base(short_code):
+            url = self.base.get_url(short_code)
+            self.removed.add(short_code)
+            self.clicks.pop(short_code, None)
+        else:
+            return False
+        fingerprint = url_fingerprint(url)
+        if self.fingerprints.get(fingerprint) == short_code:
+            del self.fingerprints[fingerprint]
+        return True
+
+    def unshare(self, short_code: str) -> None:
+        """Stop listing an overlay code for dedupe, so a later link with its URL is listed instead"""
+        url = self.overlay.get_url(short_code)
+        if url is not None:
+            fingerprint = url_fingerprint(url)
+            if self.fingerprints.get(fingerprint) == short_code:
+                del self.fingerprints[fingerprint]
+
+    def codes_for_fingerprint(self, fingerprint: int) -> Iterator[str]:
+        """Yield codes whose URL may have this dedupe fingerprint"""
+        short_code = self.fingerprints.get(fingerprint)
+        if short_code is not None:
+            yield short_code
+        if self.base is not None:
+            yield from self.base.codes_for_fingerprint(fingerprint)
+
+    def items(self) -> Iterator[Row]:
+        if self.base is not None:
+            clicks, removed = self.clicks, self.removed
+            for short_code, url, count in self.base.items():
+                if short_code not in removed:
+                    yield short_code, url, count + clicks.get(short_code, 0)
+        yield from self.overlay.items()
+
+    def total_clicks(self) -> int:
+        total = self.overlay.total_clicks() + sum(self.clicks.values())
+        if self.base is not None:
+            total += self.base.total_clicks()
+            total -= sum(self.base.get_clicks(short_code) for short_code in self.removed)
+        return total
+
+    def rebase(self, index: LinkIndex) -> "LayeredLinkTable":
+        """Return this table with the layers ``index`` was written from replaced by it"""
+        if self.generation == index.generation:
+            base = index
+        elif isinstance(self.base, LayeredLinkTable):
+            base = self.base.rebase(index)
+        else:
+            return self
+        return LayeredLinkTable(
+            base, self.overlay, self.generation, self.clicks, self.fingerprints, self.removed
+        )
+
+    def push(self, overlay_table: Type[LinkTable], generation: int) -> "LayeredLinkTable":
+        """Freeze this table as the base of a new, empty overlay"""
+        return LayeredLinkTable(self, overlay_table(), generation)
+
+    def copy(self) -> "LayeredLinkTable":
+        # The base is never written to, so it can be shared
+        return LayeredLinkTable(
+            self.base, self.overlay.copy(), self.generation, dict(self.clicks),
+            dict(self.fingerprints), set(self.removed),
+        )
+
+    def __len__(self) -> int:
+        base = len(self.base) - len(self.removed) if self.base is not None else 0
+        return len(self.overlay) + base
+
+    def __contains__(self, short_code: str) -> bool:
+        return short_code in self.overlay or self._in_base(short_code)
@@ -0,0 +1,305 @@
+"""
+In-memory link tables for URL shortener
+"""
+
+from array import array
+from itertools import accumulate
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+Row = Tuple[str, str, int]
+
+# Fibonacci hashing multiplier; spreads packed codes over the whole table
+GOLDEN = 0x9E3779B97F4A7C15
+MASK64 = (1 << 64) - 1
+
+
+class LinkTable:
+    """Short code -> (URL, clicks) mapping held by in-memory storage engines"""
+
+    def load(self, codes: List[str], urls: List[str], clicks: List[int]) -> None:
+        """Replace the contents with matching columns of codes, URLs and clicks"""
+        raise NotImplementedError
+
+    def get_url(self, short_code: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def get_clicks(self, short_code: str) -> int:
+        raise NotImplementedError
+
+    def add(self, short_code: str, url: str) -> bool:
+        """Insert a link; return False if the code is taken"""
+        raise NotImplementedError
+
+    def add_clicks(self, short_code: str, amount: int) -> bool:
+        """Add clicks to a link; return False if there is no such link"""
+        raise NotImplementedError
+
+    def remove(self, short_code: str) -> bool:
+        """Delete a link, freeing its code; return False if there is no such link"""
+        raise NotImplementedError
+
+    def items(self) -> Iterator[Row]:
+        """Iterate over (short_code, url, clicks) rows"""
+        raise NotImplementedError
+
+    def total_clicks(self) -> int:
+        """Return the number of clicks over all links"""
+        raise NotImplementedError
+
+    def copy(self) -> "LinkTable":
+        """Return an independent copy, e.g. to write a snapshot from"""
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def __contains__(self, short_code: str) -> bool:
+        return self.get_url(short_code) is not None
+
+
+class DictLinkTable(LinkTable):
+    """Links as two dicts of Python objects; fastest, but a few hundred bytes per link"""
+
+    def __init__(self):
+        self.urls: Dict[str, str] = {}
+        self.clicks: Dict[str, int] = {}
+
+    def load(self, codes: List[str], urls: List[str], clicks: List[int]) -> None:
+        self.urls = dict(zip(codes, urls))
+        self.clicks = dict(zip(codes, clicks))
+
+    def get_url(self, short_code: str) -> Optional[str]:
+        return self.urls.get(short_code)
+
+    def get_clicks(self, short_code: str) -> int:
+        return self.clicks.get(short_code, 0)
+
+    def add(self, short_code: str, url: str) -> bool:
+        if short_code in self.urls:
+            return False
+        self.clicks[short_code] = 0
+        self.urls[short_code] = url
+        return True
+
+    def add_clicks(self, short_code: str, amount: int) -> bool:
+        if short_code not in self.clicks:
+            return False
+        self.clicks[short_code] += amount
+        return True
+
+    def remove(self, short_code: str) -> bool:
+        if self.urls.pop(short_code, None) is None:
+            return False
+        del self.clicks[short_code]
+        return True
+
+    def items(self) -> Iterator[Row]:
+        clicks = self.clicks
+        for short_code, url in self.urls.items():
+            yield short_code, url, clicks[short_code]
+
+    def total_clicks(self) -> int:
+        return sum(self.clicks.values())
+
+    def copy(self) -> "DictLinkTable":
+        table = DictLinkTable()
+        table.urls = dict(self.urls)
+        table.clicks = dict(self.clicks)
+        return table
+
+    def __len__(self) -> int:
+        return len(self.urls)
+
+    def __contains__(self, short_code: str) -> bool:
+        return short_code in self.urls
+
+
+class CompactLinkTable(LinkTable):
+    """
+    Links packed into flat arrays instead of per-link Python objects.
+
+    Codes of up to eight ASCII characters are packed into a 64-bit integer
+    and found through an open-addressing hash table of two arrays (packed
+    code, link number). URLs are stored back to back in one bytes arena,
+    and offsets, clicks and packed codes are arrays indexed by link
+    number, so a link costs its URL bytes plus a few dozen bytes.
+    Longer or non-ASCII codes fall back to a dict.
+
+    Lookups may run while another thread inserts: a link is fully written
+    before its key is published, and a grown hash table is swapped in as
+    one tuple.
+
+    Removed links stay in the arrays, marked in a set, and their keys stay
+    in the hash table as tombstones so probe chains are not broken. Growing
+    the hash table drops the tombstones; the removed links themselves keep
+    their link numbers and arena bytes until the table is next loaded,
+    i.e. until the storage engine compacts and restarts.
+    """
+
+    MAX_LOAD = 0.7
+
+    def __init__(self):
+        self._arena = bytearray()
+        # Link number -> arena offset, with one extra entry for the end
+        self._offsets = array("Q", [0])
+        self._clicks = array("Q")
+        self._packed = array("Q")  # 0 for codes kept in _long_codes
+        self._long_codes: Dict[str, int] = {}
+        self._long_by_number: Dict[int, str] = {}
+        self._removed: Set[int] = set()
+        self._set_index(16)
+
+    def _set_index(self, capacity: int) -> None:
+        keys = array("Q", bytes(8 * capacity))
+        numbers = array("I", bytes(4 * capacity))
+        shift = 64 - (capacity.bit_length() - 1)
+        removed = self._removed
+        for number, key in enumerate(self._packed):
+            if key and number not in removed:
+                self._insert_key(keys, numbers, shift, capacity - 1, key, number)
+        self._index = (keys, numbers, shift, capacity - 1)
+
+    @staticmethod
+    def _insert_key(keys: array, numbers: array, shift: int, mask: int, key: int, number: int) -> None:
+        i = ((key * GOLDEN) & MASK64) >> shift
+        while keys[i]:
+            i = (i + 1) & mask
+        numbers[i] = number
+        keys[i] = key
+
+    def _find(self, short_code: str) -> int:
+        """Return the link number for a code, or -1"""
+        key = self._pack(short_code)
+        if not key:
+            return self._long_codes.get(short_code, -1)
+        keys, numbers, shift, mask = self._index
+        removed = self._removed
+        i = ((key * GOLDEN) & MASK64) >> shift
+        while True:
+            found = keys[i]
+            if found == key and not (removed and numbers[i] in removed):
+                return numbers[i]
+            if not found:
+                return -1
+            i = (i + 1) & mask
+
+    @staticmethod
+    def _pack(short_code: str) -> int:
+        """Pack a code into a non-zero 64-bit key, or return 0 if it does not fit"""
+        try:
+            raw = short_code.encode("ascii")
+        except UnicodeEncodeError:
+            return 0
+        return int.from_bytes(raw, "big") if 0 < len(raw) <= 8 else 0
+
+    def load(self, codes: List[str], urls: List[str], clicks: List[int]) -> None:
+        encoded = [url.encode("utf-8") for url in urls]
+        self._arena = bytearray().join(encoded)
+        self._offsets = array("Q", [0])
+        self._offsets.extend(accumulate(map(len, encoded)))
+        del encoded
+        self._clicks = array("Q", clicks)
+        self._packed = array("Q", map(self._pack, codes))
+        self._long_codes = {}
+        self._long_by_number = {}
+        self._removed = set()
+        for number, key in enumerate(self._packed):
+            if not key:
+                self._long_codes[codes[number]] = number
+                self._long_by_number[number] = codes[number]
+
+        capacity = 16
+        while capacity * self.MAX_LOAD < len(codes):
+            capacity *= 2
+        self._set_index(capacity)
+
+    def get_url(self, short_code: str) -> Optional[str]:
+        number = self._find(short_code)
+        if number < 0:
+            return None
+        return self._arena[self._offsets[number]:self._offsets[number + 1]].decode("utf-8")
+
+    def get_clicks(self, short_code: str) -> int:
+        number = self._find(short_code)
+        return self._clicks[number] if number >= 0 else 0
+
+    def add(self, short_code: str, url: str) -> bool:
+        if self._find(short_code) >= 0:
+            return False
+        number = len(self._clicks)
+        key = self._pack(short_code)
+        keys, numbers, shift, mask = self._index
+        if number + 1 > (mask + 1) * self.MAX_LOAD:
+            self._set_index((mask + 1) * 2)
+            keys, numbers, shift, mask = self._index
+
+        self._arena += url.encode("utf-8")
+        self._offsets.append(len(self._arena))
+        self._clicks.append(0)
+        self._packed.append(key)
+        # Publish the code last, once everything it points to is in place
+        if key:
+            self._insert_key(keys, numbers, shift, mask, key, number)
+        else:
+            self._long_by_number[number] = short_code
+            self._long_codes[short_code] = number
+        return True
+
+    def add_clicks(self, short_code: str, amount: int) -> bool:
+        number = self._find(short_code)
+        if number < 0:
+            return False
+        self._clicks[number] += amount
+        return True
+
+    def remove(self, short_code: str) -> bool:
+        number = self._find(short_code)
+        if number < 0:
+            return False
+        # Hidden from lookups first, then cleaned up
+        self._removed.add(number)
+        self._clicks[number] = 0
+        if short_code in self._long_codes:
+            del self._long_codes[short_code]
+            del self._long_by_number[number]
+        return True
+
+    def items(self) -> Iterator[Row]:
+        arena, offsets, clicks, removed = self._arena, self._offsets, self._clicks, self._removed
+        for number, key in enumerate(self._packed):
+            if number in removed:
+                continue
+            if key:
+                short_code = key.to_bytes(8, "big").lstrip(b"\0").decode("ascii")
+            else:
+                short_code = self._long_by_number[number]
+            url = arena[offsets[number]:offsets[number + 1]].decode("utf-8")
+            yield short_code, url, clicks[number]
+
+    def total_clicks(self) -> int:
+        return sum(self._clicks)
+
+    def copy(self) -> "CompactLinkTable":
+        table = CompactLinkTable()
+        table._arena = bytearray(self._arena)
+        table._offsets = array("Q", self._offsets)
+        table._clicks = array("Q", self._clicks)
+        table._packed = array("Q", self._packed)
+        table._long_codes = dict(self._long_codes)
+        table._long_by_number = dict(self._long_by_number)
+        table._removed = set(self._removed)
+        keys, numbers, shift, mask = self._index
+        table._index = (array("Q", keys), array("I", numbers), shift, mask)
+        return table
+
+    def __len__(self) -> int:
+        return len(self._clicks) - len(self._removed)
+
+    def __contains__(self, short_code: str) -> bool:
+        return self._find(short_code) >= 0
+
+
+LINK_TABLES = {
+    "dict": DictLinkTable,
+    "compact": CompactLinkTable,
+}
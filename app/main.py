@@ -3,20 +3,44 @@ FastAPI URL Shortener Application
 A modern, clean URL shortener with web interface
 """
 
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
+import asyncio
+import math
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
 
+from .allocator import create_allocator
+from .analytics import RANGES, ClickAnalytics
+from .bulk import NDJSONStreamingResponse, iter_json_items, shorten_stream
+from .counters import ClickBuffer
+from .expiry import ExpiryReaper
+from .fast_redirect import FastRedirectMiddleware, RedirectCache
+from .link_cache import LinkCache
+from .metrics import (
+    IN_FLIGHT,
+    REDIRECT_SECONDS,
+    REDIRECTS_NOT_FOUND,
+    REGISTRY,
+    SHORTEN_SECONDS,
+    STORAGE_SECONDS,
+    timed,
+)
+from .rate_limit import RateLimiter
+from .static_page import PrecompressedPage
+from .storage_io import StorageIO
 from .models import URLCreate, URLResponse
 from .utils import (
-    generate_short_code,
-    is_valid_url,
-    is_valid_custom_code,
+    RESERVED_CODES,
+    link_limits,
+    validate_url_create,
     load_data,
     save_data,
     get_html_content
 )
 from .config import settings
+from .storage import LinkExistsError, LinkLimits
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -25,6 +49,23 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Hot links and recently unknown codes, in front of storage
+link_cache = LinkCache(
+    max_entries=settings.LINK_CACHE_SIZE,
+    ttl=settings.LINK_CACHE_TTL,
+    negative_entries=settings.LINK_CACHE_NEGATIVE_SIZE,
+    negative_ttl=settings.LINK_CACHE_NEGATIVE_TTL,
+)
+
+# Serve known short codes before routing; added first so CORS still wraps it
+redirect_cache = RedirectCache(link_cache)
+if settings.FAST_REDIRECT:
+    app.add_middleware(
+        FastRedirectMiddleware,
+        cache=redirect_cache,
+        latency=REDIRECT_SECONDS.labels("fast") if settings.METRICS_ENABLED else None,
+    )
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -34,46 +75,234 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global storage
-url_storage = {}
-stats_storage = {}
+# Global storage; writes run on the storage I/O thread
+storage = None
+allocator = None
+storage_io = StorageIO(max_pending=settings.STORAGE_IO_QUEUE_SIZE)
+clicks = ClickBuffer(
+    shards=settings.CLICK_BUFFER_SHARDS,
+    flush_threshold=settings.CLICK_FLUSH_THRESHOLD,
+)
+analytics = ClickAnalytics(
+    max_links=settings.ANALYTICS_MAX_LINKS,
+    days=settings.ANALYTICS_RETENTION_DAYS,
+)
+reaper = ExpiryReaper(batch_size=settings.EXPIRY_REAP_BATCH)
+# Link creation budgets; each request or item costs one token
+shorten_limiter = RateLimiter(
+    rate=settings.RATE_LIMIT_PER_SECOND,
+    burst=settings.RATE_LIMIT_BURST,
+    global_rate=settings.RATE_LIMIT_GLOBAL_PER_SECOND,
+    global_burst=settings.RATE_LIMIT_GLOBAL_BURST,
+    max_clients=settings.RATE_LIMIT_MAX_CLIENTS,
+)
+bulk_limiter = RateLimiter(
+    rate=settings.RATE_LIMIT_BULK_PER_SECOND,
+    burst=settings.RATE_LIMIT_BULK_BURST,
+    global_rate=settings.RATE_LIMIT_BULK_GLOBAL_PER_SECOND,
+    global_burst=settings.RATE_LIMIT_BULK_GLOBAL_BURST,
+    max_clients=settings.RATE_LIMIT_MAX_CLIENTS,
+)
+link_cache.on_expired = reaper.expire_now
+background_tasks = []
+
+# Home page bytes, compressed once
+home_page = PrecompressedPage(
+    get_html_content(),
+    media_type="text/html",
+    max_age=settings.HOME_CACHE_MAX_AGE,
+)
+
+# Gauges and counters read from the components that already keep them
+REGISTRY.callback(
+    "url_shortener_links", "Stored links", "gauge",
+    lambda: storage.count_links() if storage is not None else 0,
+)
+REGISTRY.callback(
+    "url_shortener_code_collisions_total", "Generated codes that were already taken", "counter",
+    lambda: allocator.collisions if allocator is not None else 0,
+)
+REGISTRY.callback(
+    "url_shortener_pending_clicks", "Clicks buffered in memory, not yet persisted", "gauge",
+    lambda: clicks.pending,
+)
+REGISTRY.callback(
+    "url_shortener_link_cache_entries", "Links in the link cache", "gauge",
+    lambda: link_cache.stats()["entries"],
+)
+REGISTRY.callback(
+    "url_shortener_link_cache_negative_entries", "Unknown codes in the link cache", "gauge",
+    lambda: link_cache.stats()["negative_entries"],
+)
+REGISTRY.callback(
+    "url_shortener_link_cache_events_total", "Link cache lookups and evictions, by event", "counter",
+    lambda: {
+        event: value
+        for event, value in link_cache.stats().items()
+        if event not in ("entries", "negative_entries")
+    },
+    labelname="event",
+)
+REGISTRY.callback(
+    "url_shortener_storage_io_pending", "Jobs queued for the storage I/O thread", "gauge",
+    lambda: storage_io.pending,
+)
+REGISTRY.callback(
+    "url_shortener_storage_io_backpressure_waits_total",
+    "Writes that waited for room in the storage I/O queue", "counter",
+    lambda: storage_io.backpressure_waits,
+)
+REGISTRY.callback(
+    "url_shortener_storage_io_busy_seconds_total", "Time the storage I/O thread spent running jobs", "counter",
+    lambda: storage_io.busy_seconds,
+)
+REGISTRY.callback(
+    "url_shortener_rate_limited_total", "Create requests and bulk batches over a rate limit", "counter",
+    lambda: {"shorten": shorten_limiter.limited, "bulk": bulk_limiter.limited},
+    labelname="endpoint",
+)
+REGISTRY.callback(
+    "url_shortener_link_filter_bytes", "Memory held by the link filter", "gauge",
+    lambda: link_filter_stats().get("bytes", 0),
+)
+REGISTRY.callback(
+    "url_shortener_link_filter_expected_error_rate",
+    "Expected share of unknown codes the link filter lets through", "gauge",
+    lambda: link_filter_stats().get("expected_error_rate", 0),
+)
+REGISTRY.callback(
+    "url_shortener_expiring_links", "Expiry times waiting in the reaper's heap", "gauge",
+    lambda: len(reaper),
+)
+REGISTRY.callback(
+    "url_shortener_links_reaped_total", "Expired links removed", "counter",
+    lambda: reaper.reaped,
+)
+
+@timed(STORAGE_SECONDS.labels("flush"))
+def flush_storage() -> None:
+    """Catch up on other workers' writes and fsync buffered log events"""
+    # Following the log here keeps idle workers from falling behind compaction
+    storage.refresh()
+    storage.flush()
+
+def link_filter_stats() -> dict:
+    """Link filter stats, or {} while it is off or being built"""
+    link_filter = storage.link_filter if storage is not None else None
+    return link_filter.stats() if link_filter is not None else {}
+
+async def read_storage(read, *args):
+    """Run a storage read, off the event loop when the backend may block on disk"""
+    if not storage.blocking_reads:
+        return read(*args)
+    return await asyncio.get_running_loop().run_in_executor(None, read, *args)
+
+async def build_link_filter():
+    """Build the link filter a batch at a time, between storage writes"""
+    while not await storage_io.run(storage.build_filter):
+        pass
+
+async def storage_maintenance():
+    """Periodically fsync the event log and write compacted snapshots"""
+    while True:
+        await asyncio.sleep(settings.LOG_FSYNC_INTERVAL)
+        await storage_io.run(flush_storage)
+        if storage.needs_compaction():
+            await storage_io.run(save_data, storage)
 
 @app.on_event("startup")
 async def startup_event():
     """Load data on startup"""
-    global url_storage, stats_storage
-    url_storage, stats_storage = load_data()
+    global storage, allocator
+    storage_io.start()
+    storage = await storage_io.run(load_data)
+    # Clicks are reported from the I/O thread; analytics lives on the loop
+    loop = asyncio.get_running_loop()
+    storage.on_clicks = lambda deltas: loop.call_soon_threadsafe(analytics.record, deltas)
+    # New codes may be remembered as unknown, removed ones as links
+    storage.on_links = lambda codes: loop.call_soon_threadsafe(link_cache.invalidate, codes)
+    storage.on_expiring = lambda links: loop.call_soon_threadsafe(reaper.schedule, links)
+    storage.on_reload = lambda: loop.call_soon_threadsafe(link_cache.clear)
+    reaper.load(await storage_io.run(storage.expiring_links))
+    allocator = create_allocator(storage)
+    RESERVED_CODES.update(
+        route.path.split("/")[1] for route in app.routes if "{" not in route.path
+    )
+    link_cache.bind(storage)
+    redirect_cache.bind(clicks, reserved=RESERVED_CODES)
+    background_tasks.append(asyncio.create_task(storage_maintenance()))
+    background_tasks.append(asyncio.create_task(build_link_filter()))
+    background_tasks.append(
+        asyncio.create_task(clicks.run(storage, storage_io, settings.CLICK_FLUSH_INTERVAL))
+    )
+    background_tasks.append(
+        asyncio.create_task(reaper.run(storage, storage_io, settings.EXPIRY_REAP_INTERVAL))
+    )
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background tasks and flush storage"""
+    for task in background_tasks:
+        task.cancel()
+    await clicks.flush(storage, storage_io)
+    await storage_io.run(storage.close)
+    await storage_io.stop()
 
 @app.get("/", response_class=HTMLResponse)
-async def home():
+async def home(req: Request):
     """Serve the main HTML page"""
-    return HTMLResponse(content=get_html_content())
+    return home_page.respond(req.headers)
+
+def client_address(req: Request) -> str:
+    """Address rate limits are kept per"""
+    if settings.RATE_LIMIT_TRUST_PROXY:
+        forwarded = req.headers.get("x-forwarded-for")
+        if forwarded:
+            # Each proxy appends the address it saw, so only the last
+            # RATE_LIMIT_PROXY_HOPS entries were not set by the client
+            hops = forwarded.split(",")
+            return hops[max(len(hops) - settings.RATE_LIMIT_PROXY_HOPS, 0)].strip()
+    return req.client.host if req.client else "unknown"
+
+def create_link(url: str, limits: Optional[LinkLimits]) -> str:
+    """Store a URL under a new code, or reuse its code when deduplicating"""
+    # Links with limits are never shared
+    short_code = storage.find_by_url(url) if settings.DEDUPE_URLS and limits is None else None
+    if short_code is None:
+        short_code = allocator.create(url, limits)
+    return short_code
 
 @app.post("/shorten", response_model=URLResponse)
+@timed(SHORTEN_SECONDS.labels("shorten"), IN_FLIGHT.labels("shorten"))
 async def shorten_url(request: URLCreate, req: Request):
     """Create a shortened URL"""
+    if settings.RATE_LIMIT_ENABLED:
+        retry_after = shorten_limiter.acquire(client_address(req))
+        if retry_after:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
     
-    # Validate URL
-    if not is_valid_url(request.url):
-        raise HTTPException(status_code=400, detail="Invalid URL format")
+    # Validate URL and custom code
+    error = validate_url_create(request)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
     
+    limits = link_limits(request)
+
     # Handle custom code
     if request.custom_code:
-        if not is_valid_custom_code(request.custom_code):
-            raise HTTPException(
-                status_code=400, 
-                detail="Invalid custom code format"
-            )
-        if request.custom_code in url_storage:
-            raise HTTPException(status_code=400, detail="Custom code already exists")
         short_code = request.custom_code
+        # Another worker may take the code between a check and the insert,
+        # so the insert itself is the existence check
+        try:
+            await storage_io.run(storage.add_link, short_code, request.url, limits)
+        except LinkExistsError:
+            raise HTTPException(status_code=400, detail="Custom code already exists")
     else:
-        short_code = generate_short_code()
-    
-    # Store URL mapping
-    url_storage[short_code] = request.url
-    stats_storage[short_code] = 0
-    save_data(url_storage, stats_storage)
+        short_code = await storage_io.run(create_link, request.url, limits)
     
     # Build short URL
     base_url = str(req.base_url).rstrip('/')
@@ -85,31 +314,108 @@ async def shorten_url(request: URLCreate, req: Request):
         short_code=short_code
     )
 
+@app.post("/shorten/bulk")
+async def shorten_bulk(req: Request):
+    """Create shortened URLs from a JSON array or an NDJSON stream"""
+    ndjson = "ndjson" in req.headers.get("content-type", "")
+    items = iter_json_items(
+        req.stream(), ndjson=ndjson, max_item_bytes=settings.BULK_MAX_ITEM_BYTES
+    )
+    base_url = str(req.base_url).rstrip('/')
+    admit = None
+    if settings.RATE_LIMIT_ENABLED:
+        client = client_address(req)
+        admit = lambda count: bulk_limiter.grant(client, count)
+    return NDJSONStreamingResponse(
+        shorten_stream(
+            storage_io,
+            storage,
+            allocator,
+            items,
+            base_url,
+            settings.BULK_BATCH_SIZE,
+            dedupe=settings.DEDUPE_URLS,
+            admit=admit,
+        )
+    )
+
+# Fixed routes must be declared before the /{short_code} catch-all
+
 @app.get("/stats")
 async def get_stats():
     """Get usage statistics"""
-    total_urls = len(url_storage)
-    total_clicks = sum(stats_storage.values())
+    total_urls = await read_storage(storage.count_links)
+    total_clicks = await read_storage(storage.total_clicks) + clicks.pending
     
     return {
         "total_urls": total_urls,
         "total_clicks": total_clicks
     }
 
+@app.get("/stats/{short_code}")
+async def get_link_stats(short_code: str, range_name: str = Query("24h", alias="range")):
+    """Get click counts over time for one short code"""
+    if range_name not in RANGES:
+        raise HTTPException(
+            status_code=400, detail=f"Range must be one of: {', '.join(RANGES)}"
+        )
+    if not await read_storage(storage.exists, short_code):
+        raise HTTPException(status_code=404, detail="Short URL not found")
+    try:
+        series = analytics.query(short_code, range_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    stored_clicks = await read_storage(storage.get_clicks, short_code)
+    return {
+        "short_code": short_code,
+        "total_clicks": stored_clicks + clicks.get(short_code),
+        **series,
+    }
+
+@app.get("/health")
+async def health_check():
+    """Health check endpoint"""
+    return {"status": "healthy", "total_urls": await read_storage(storage.count_links)}
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness check reporting how far persistence lags behind"""
+    click_lag = clicks.lag()
+    ready = max(click_lag, storage_io.lag()) <= settings.READY_MAX_FLUSH_LAG
+    body = {
+        "status": "ready" if ready else "lagging",
+        "pending_clicks": clicks.pending,
+        "click_flush_lag_seconds": round(click_lag, 3),
+        "storage": storage.persistence_lag(),
+        "storage_io": storage_io.stats(),
+        "link_cache": link_cache.stats(),
+        "expiry": {"scheduled": len(reaper), "reaped": reaper.reaped},
+        "link_filter": link_filter_stats(),
+    }
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def metrics():
+        """Prometheus metrics"""
+        # The links gauge reads storage
+        body = await read_storage(REGISTRY.render)
+        return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
 @app.get("/{short_code}")
-async def redirect_url(short_code: str):
+@timed(REDIRECT_SECONDS.labels("app"), IN_FLIGHT.labels("redirect"))
+async def redirect_url(short_code: str, request: Request):
     """Redirect to original URL"""
-    if short_code not in url_storage:
+    original_url = None
+    # The fast path has already looked the code up and found nothing
+    if not getattr(request.state, "link_missing", False):
+        original_url = await link_cache.get(short_code)
+    if original_url is None:
+        REDIRECTS_NOT_FOUND.inc()
         raise HTTPException(status_code=404, detail="Short URL not found")
     
-    # Increment click count
-    stats_storage[short_code] = stats_storage.get(short_code, 0) + 1
-    save_data(url_storage, stats_storage)
+    # Increment click count; persisted by the background flusher
+    clicks.incr(short_code)
     
-    original_url = url_storage[short_code]
     return RedirectResponse(url=original_url, status_code=302)
-
-@app.get("/health")
-async def health_check():
-    """Health check endpoint"""
-    return {"status": "healthy", "total_urls": len(url_storage)}
\ No newline at end of file
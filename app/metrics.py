@@ -0,0 +1,309 @@
+"""
+Prometheus metrics for URL shortener
+"""
+
+import asyncio
+import functools
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from .config import settings
+
+# Request latencies; an in-process redirect takes tens of microseconds
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+# Loads, fsyncs and snapshots
+STORAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Metric:
+    """Base class: a named family of samples, one child per label set"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], "Metric"] = {}
+
+    def labels(self, *values: str) -> "Metric":
+        """Return the child for one set of label values, creating it once"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}")
+            child = self._children[values] = self._child()
+        return child
+
+    def _child(self) -> "Metric":
+        return type(self)(self.name, self.documentation)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """Return (suffix, labels, value) rows for the exposition format"""
+        if not self.labelnames:
+            return self._samples("")
+        rows = []
+        for values, child in list(self._children.items()):
+            rows.extend(child._samples(_format_labels(self.labelnames, values)))
+        return rows
+
+    def _samples(self, labels: str) -> List[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Monotonic count; by convention its name ends in ``_total``"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def _samples(self, labels: str) -> List[Tuple[str, str, float]]:
+        return [("", labels, self.value)]
+
+
+class Gauge(Metric):
+    """Value that goes up and down, e.g. requests in flight"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def _samples(self, labels: str) -> List[Tuple[str, str, float]]:
+        return [("", labels, self.value)]
+
+
+class Histogram(Metric):
+    """
+    Fixed-bucket histogram.
+
+    ``observe`` is one bisect and two additions; counts are kept per
+    bucket and only made cumulative when rendered.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def _child(self) -> "Histogram":
+        return Histogram(self.name, self.documentation, buckets=self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def _samples(self, labels: str) -> List[Tuple[str, str, float]]:
+        prefix = labels[1:-1] + "," if labels else ""
+        rows = []
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            rows.append(("_bucket", '{%sle="%s"}' % (prefix, _format_value(bound)), total))
+        rows.append(("_sum", labels, self.sum))
+        rows.append(("_count", labels, total))
+        return rows
+
+
+class CallbackMetric(Metric):
+    """
+    Metric read from existing state when rendered, e.g. cache counters.
+
+    ``read`` returns a number, or a dict from label value to number when
+    a label name is given.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        kind: str,
+        read: Callable[[], Union[float, Dict[str, float]]],
+        labelname: Optional[str] = None,
+    ):
+        super().__init__(name, documentation)
+        self.kind = kind
+        self.read = read
+        self.labelname = labelname
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        value = self.read()
+        if self.labelname is None:
+            return [("", "", value)]
+        return [
+            ("", _format_labels((self.labelname,), (label,)), number)
+            for label, number in value.items()
+        ]
+
+
+class Registry:
+    """
+    Metrics rendered by ``GET /metrics``.
+
+    Updates are not locked: each metric here is written from one thread,
+    either the event loop or the storage I/O thread, and a render racing
+    an update is at most one observation behind.
+    """
+
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(
+        self,
+        name: str,
+        documentation: str,
+        kind: str,
+        read: Callable[[], Union[float, Dict[str, float]]],
+        labelname: Optional[str] = None,
+    ) -> CallbackMetric:
+        return self.register(CallbackMetric(name, documentation, kind, read, labelname))
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                # One broken reader must not hide every other metric
+                print(f"Error reading metric {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{metric.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REDIRECT_SECONDS = REGISTRY.histogram(
+    "url_shortener_redirect_duration_seconds",
+    "Time to answer a redirect, by the path that answered it",
+    ("path",),
+)
+REDIRECTS_NOT_FOUND = REGISTRY.counter(
+    "url_shortener_redirects_not_found_total",
+    "Redirects answered 404: unknown, expired or out of clicks",
+)
+SHORTEN_SECONDS = REGISTRY.histogram(
+    "url_shortener_shorten_duration_seconds",
+    "Time to answer a shorten request, or to store one bulk batch",
+    ("endpoint",),
+)
+IN_FLIGHT = REGISTRY.gauge(
+    "url_shortener_requests_in_flight",
+    "Requests being handled, by endpoint",
+    ("endpoint",),
+)
+CODE_ALLOCATION_SECONDS = REGISTRY.histogram(
+    "url_shortener_code_allocation_duration_seconds",
+    "Time to allocate a short code and store its link",
+)
+STORAGE_SECONDS = REGISTRY.histogram(
+    "url_shortener_storage_operation_duration_seconds",
+    "Time spent in storage operations: load, flush, snapshot and click_flush",
+    ("operation",),
+    buckets=STORAGE_BUCKETS,
+)
+
+
+def timed(histogram: Histogram, in_flight: Optional[Gauge] = None):
+    """
+    Decorate a function, sync or async, to observe its duration;
+    ``in_flight`` counts running calls of async functions.
+
+    With METRICS_ENABLED off the function is returned unchanged, so
+    disabled metrics cost nothing.
+    """
+    def decorate(fn):
+        if not settings.METRICS_ENABLED:
+            return fn
+
+        if not asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start)
+            return wrapper
+
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            if in_flight is not None:
+                in_flight.inc()
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+                if in_flight is not None:
+                    in_flight.dec()
+        return async_wrapper
+
+    return decorate
@@ -2,6 +2,8 @@
 Pydantic models for URL shortener
 """
 
+from datetime import datetime
+
 from pydantic import BaseModel, HttpUrl
 from typing import Optional
 
@@ -10,6 +12,10 @@ class URLCreate(BaseModel):
     """Request model for creating short URL"""
     url: str
     custom_code: Optional[str] = None
+    # The link stops redirecting at this time (UTC if no offset is given)...
+    expires_at: Optional[datetime] = None
+    # ...or after this many clicks, whichever comes first
+    max_clicks: Optional[int] = None
 
 
 class URLResponse(BaseModel):
@@ -0,0 +1,234 @@
+"""
+URL normalization for URL shortener
+"""
+
+import functools
+import hashlib
+import ipaddress
+import re
+from typing import Iterable, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+from .config import settings
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+# Characters a URL may hold unescaped (RFC 3986 reserved and unreserved)
+URI_CHARS = "A-Za-z0-9\\-._~:/?#\\[\\]@!$&'()*+,;="
+UNRESERVED = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~")
+
+# One pass over a path, query or fragment finds every escape to fix: a
+# valid escape, a stray %, or a character that must be escaped
+ESCAPES = re.compile("%([0-9A-Fa-f]{2})|%|[^" + URI_CHARS + "%]")
+# Components that need no changes, which is almost all of them
+CANONICAL = re.compile("[" + URI_CHARS + "]*")
+CONTROL_CHARS = re.compile("[\x00-\x1f\x7f]")
+HOST_LABEL = re.compile("(?!-)[a-z0-9_-]{1,63}(?<!-)")
+
+# Scheme, authority, path, query and fragment of any absolute URL (RFC 3986)
+URL_PARTS = re.compile("([A-Za-z][A-Za-z0-9+.-]*)://([^/?#]*)([^?#]*)(\\?[^#]*)?(#.*)?", re.DOTALL)
+
+# Path, query and fragment characters that never need escaping
+PLAIN_CHARS = "A-Za-z0-9\\-._~!$&'()*+,;=:@/"
+# An escape already in canonical form: upper-case hex, not an unreserved character
+CANONICAL_ESCAPE = "%(?:[01][0-9A-F]|2[0-9A-CF]|3[A-F]|40|5[B-E]|60|7[B-DF]|[89A-F][0-9A-F])"
+# A URL that only needs its case and port normalized, which is most of
+# them, is checked and taken apart by this one match; anything else,
+# e.g. with other escapes, non-ASCII or an IP literal, is parsed in full.
+# Host labels are checked for empty or hyphen-edged labels afterwards,
+# which is cheaper than spelling them out here
+PLAIN_URL = re.compile(
+    "([Hh][Tt][Tt][Pp][Ss]?)://"
+    "([A-Za-z0-9_](?:[A-Za-z0-9_.-]*+(?<=[A-Za-z0-9_]))?)"
+    "(?::([0-9]{1,5}))?"
+    "(/[" + PLAIN_CHARS + "]*+(?:" + CANONICAL_ESCAPE + "[" + PLAIN_CHARS + "]*+)*+)?"
+    "(\\?(?=[^#])[" + PLAIN_CHARS + "?]*+(?:" + CANONICAL_ESCAPE + "[" + PLAIN_CHARS + "?]*+)*+)?"
+    "(#(?=.)[" + PLAIN_CHARS + "?]*+(?:" + CANONICAL_ESCAPE + "[" + PLAIN_CHARS + "?]*+)*+)?"
+)
+# A URL that dedupe_key would leave as it is, e.g. any normalized URL:
+# lower-case scheme and host, a path, no empty query or fragment, and
+# nothing urlsplit strips or checks
+DEDUPED_URL = re.compile(
+    "[a-z][a-z0-9+.-]*+://[a-z0-9\\-._~!$&'()*+,;=:@]++/[^\\s\x00-\x1f\x7f?#]*+"
+    "(?:\\?[^\\s\x00-\x1f\x7f#]++)?(?:#[^\\s\x00-\x1f\x7f]++)?"
+)
+
+
+class InvalidURLError(ValueError):
+    """A URL that cannot be shortened; the message says why"""
+
+
+def dedupe_key(url: str) -> str:
+    """Return the form of a URL used to detect duplicates"""
+    if DEDUPED_URL.fullmatch(url):
+        return url
+    parts = urlsplit(url.strip())
+    return urlunsplit((
+        parts.scheme.lower(),
+        parts.netloc.lower(),
+        parts.path or "/",
+        parts.query,
+        parts.fragment,
+    ))
+
+
+def url_fingerprint(url: str) -> int:
+    """Stable signed 64-bit hash of a URL's dedupe key"""
+    digest = hashlib.blake2b(dedupe_key(url).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def _escape(match: "re.Match") -> str:
+    hex_digits = match.group(1)
+    if hex_digits is not None:
+        char = chr(int(hex_digits, 16))
+        return char if char in UNRESERVED else "%" + hex_digits.upper()
+    return "".join("%{:02X}".format(byte) for byte in match.group().encode("utf-8"))
+
+
+def canonical_escapes(component: str) -> str:
+    """
+    Canonicalize percent-encoding: unreserved characters are unescaped,
+    other escapes use upper-case hex, and characters that may not appear
+    in a URL, including a stray %, are escaped as UTF-8.
+    """
+    if "%" not in component and CANONICAL.fullmatch(component):
+        return component
+    return ESCAPES.sub(_escape, component)
+
+
+class URLNormalizer:
+    """
+    Validates a URL and returns its normalized form, in one pass.
+
+    The scheme and host are lower-cased, an internationalized host is
+    IDNA-encoded, a default port is dropped, an empty path becomes "/",
+    and percent-encoding is made canonical. URLs whose host, or any domain
+    above it, is in ``blocked_domains`` are rejected; that is one set
+    lookup per label of the host, done once per host and cached, since
+    most links point at a few popular hosts.
+    """
+
+    def __init__(self, blocked_domains: Iterable[str] = (), max_length: int = 2048):
+        self.blocked_domains = frozenset(
+            _normalize_host(domain.strip()) for domain in blocked_domains if domain.strip()
+        )
+        self.max_length = max_length
+        self._plain_host = functools.lru_cache(maxsize=4096)(self._check_plain_host)
+
+    @classmethod
+    def from_settings(cls) -> "URLNormalizer":
+        domains = settings.BLOCKED_DOMAINS.split(",")
+        if settings.BLOCKED_DOMAINS_FILE:
+            with open(settings.BLOCKED_DOMAINS_FILE, encoding="utf-8") as f:
+                domains += [line for line in f if not line.startswith("#")]
+        return cls(domains, settings.URL_MAX_LENGTH)
+
+    def normalize(self, url: str) -> str:
+        """Return the normalized URL, or raise InvalidURLError"""
+        url = url.strip()
+        if len(url) > self.max_length:
+            raise InvalidURLError("URL is too long")
+
+        match = PLAIN_URL.fullmatch(url)
+        if match is not None:
+            scheme, raw_host, port, path, query, fragment = match.groups()
+            checked = self._plain_host(raw_host)
+            if checked is not None and (port is None or int(port) <= 65535):
+                host, blocked = checked
+                if blocked:
+                    raise InvalidURLError("URL domain is blocked")
+                if port is None and path is not None and host == raw_host and scheme in DEFAULT_PORTS:
+                    # Already normalized, as most URLs are
+                    return url
+                scheme = scheme.lower()
+                if port is not None and int(port) != DEFAULT_PORTS[scheme]:
+                    host += ":" + str(int(port))
+                return scheme + "://" + host + (path or "/") + (query or "") + (fragment or "")
+        return self._normalize_parsed(url)
+
+    def _check_plain_host(self, host: str) -> Optional[Tuple[str, bool]]:
+        """
+        Return a host matched by PLAIN_URL lower-cased, and whether it is
+        blocked; or None if its labels are malformed and need a full parse.
+        """
+        if ".." in host or ".-" in host or "-." in host or (len(host) > 63 and not _labels_fit(host)):
+            return None
+        host = host.lower()
+        return host, bool(self.blocked_domains) and self.is_blocked(host)
+
+    def _normalize_parsed(self, url: str) -> str:
+        match = URL_PARTS.fullmatch(url)
+        if match is None or CONTROL_CHARS.search(url):
+            raise InvalidURLError("Invalid URL format")
+        scheme, netloc, path, query, fragment = match.groups()
+        scheme = scheme.lower()
+        if scheme not in DEFAULT_PORTS:
+            raise InvalidURLError("Invalid URL format")
+        if "@" in netloc:
+            raise InvalidURLError("URL must not contain credentials")
+        if netloc.startswith("["):
+            host, bracket, port = netloc[1:].partition("]")
+            if not bracket or ":" not in host or (port and not port.startswith(":")):
+                raise InvalidURLError("Invalid URL format")
+            port = port[1:]
+        else:
+            host, _, port = netloc.partition(":")
+        if not host or (port and not (port.isascii() and port.isdigit() and int(port) <= 65535)):
+            raise InvalidURLError("Invalid URL format")
+
+        host = _normalize_host(host)
+        if self.blocked_domains and self.is_blocked(host):
+            raise InvalidURLError("URL domain is blocked")
+
+        netloc = "[" + host + "]" if ":" in host else host
+        if port and int(port) != DEFAULT_PORTS[scheme]:
+            netloc += ":" + str(int(port))
+        try:
+            normalized = scheme + "://" + netloc + (canonical_escapes(path) or "/")
+            if query and len(query) > 1:
+                normalized += "?" + canonical_escapes(query[1:])
+            if fragment and len(fragment) > 1:
+                normalized += "#" + canonical_escapes(fragment[1:])
+        except UnicodeEncodeError:
+            # Lone surrogates, which JSON strings can carry
+            raise InvalidURLError("Invalid URL format")
+        return normalized
+
+    def is_blocked(self, host: str) -> bool:
+        """Check a normalized host and each domain above it"""
+        blocked = self.blocked_domains
+        while True:
+            if host in blocked:
+                return True
+            dot = host.find(".")
+            if dot < 0:
+                return False
+            host = host[dot + 1:]
+
+
+def _labels_fit(host: str) -> bool:
+    return len(host) <= 253 and all(len(label) <= 63 for label in host.split("."))
+
+
+@functools.lru_cache(maxsize=4096)
+def _normalize_host(host: str) -> str:
+    """Lower-case and IDNA-encode a host, raising InvalidURLError if it is malformed"""
+    host = host.lower().rstrip(".")
+    if ":" in host:
+        try:
+            return str(ipaddress.IPv6Address(host))
+        except ValueError:
+            raise InvalidURLError("Invalid URL host")
+    if not host.isascii():
+        try:
+            host = host.encode("idna").decode("ascii")
+        except UnicodeError:
+            raise InvalidURLError("Invalid URL host")
+    if len(host) > 253 or not all(HOST_LABEL.fullmatch(label) for label in host.split(".")):
+        raise InvalidURLError("Invalid URL host")
+    return host
+
+
+def create_normalizer() -> Optional[URLNormalizer]:
+    """The URL normalizer create requests go through, or None if URL_NORMALIZE is off"""
+    return URLNormalizer.from_settings() if settings.URL_NORMALIZE else None
@@ -0,0 +1,125 @@
+"""
+Rate limiting for URL shortener
+"""
+
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+
+class TokenBucket:
+    """``rate`` tokens per second, holding at most ``burst``"""
+
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+    def refill(self, now: float, rate: float, burst: float) -> float:
+        tokens = self.tokens + (now - self.updated) * rate
+        self.tokens = tokens if tokens < burst else burst
+        self.updated = now
+        return self.tokens
+
+
+class RateLimiter:
+    """
+    Per-client token buckets, plus an optional global bucket shared by all.
+
+    Client buckets live in an LRU of at most ``max_clients``. A bucket
+    left alone for ``burst / rate`` seconds is full again, which is the
+    same as having none, so sweeps drop those; since the LRU is ordered by
+    last use, a sweep stops at the first bucket still refilling. Evicting
+    a bucket early only forgives its client, and the global bucket still
+    bounds the total.
+
+    A check is two dict operations and a little arithmetic per request.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        global_rate: Optional[float] = None,
+        global_burst: Optional[float] = None,
+        max_clients: int = 100000,
+        sweep_interval: float = 60.0,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.global_rate = global_rate
+        self.global_burst = global_burst if global_burst is not None else global_rate
+        self.max_clients = max_clients
+        self.sweep_interval = sweep_interval
+        self._clients: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        now = time.monotonic()
+        self._global = TokenBucket(self.global_burst, now) if global_rate else None
+        self._next_sweep = now + sweep_interval
+        self.limited = 0
+        self.evictions = 0
+
+    def acquire(self, client: str, cost: float = 1.0) -> float:
+        """Take ``cost`` tokens; return 0.0, or the seconds to wait before retrying"""
+        return self._take(client, cost, partial=False)[1]
+
+    def grant(self, client: str, wanted: int) -> Tuple[int, float]:
+        """Take up to ``wanted`` whole tokens; return how many, and the wait for the rest"""
+        return self._take(client, wanted, partial=True)
+
+    def _take(self, client: str, wanted: float, partial: bool) -> Tuple[int, float]:
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self.sweep(now)
+
+        bucket = self._clients.get(client)
+        if bucket is None:
+            bucket = self._clients[client] = TokenBucket(self.burst, now)
+            if len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+                self.evictions += 1
+            available = self.burst
+        else:
+            self._clients.move_to_end(client)
+            available = bucket.refill(now, self.rate, self.burst)
+
+        shared = self._global
+        if shared is not None:
+            shared_available = shared.refill(now, self.global_rate, self.global_burst)
+            if shared_available < available:
+                available = shared_available
+
+        taken = wanted if available >= wanted else (int(available) if partial else 0)
+        if taken:
+            bucket.tokens -= taken
+            if shared is not None:
+                shared.tokens -= taken
+        if taken == wanted:
+            return taken, 0.0
+
+        # Wait until both buckets hold the next token the caller needs
+        self.limited += 1
+        needed = (wanted - taken) if not partial else 1
+        retry_after = max(needed - bucket.tokens, 0.0) / self.rate
+        if shared is not None:
+            retry_after = max(retry_after, max(needed - shared.tokens, 0.0) / self.global_rate)
+        return int(taken), retry_after
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Drop client buckets that have refilled; return how many"""
+        now = time.monotonic() if now is None else now
+        self._next_sweep = now + self.sweep_interval
+        refill_seconds = self.burst / self.rate
+        clients = self._clients
+        dropped = 0
+        while clients:
+            bucket = next(iter(clients.values()))
+            if now - bucket.updated < refill_seconds:
+                break
+            clients.popitem(last=False)
+            dropped += 1
+        return dropped
+
+    def stats(self) -> dict:
+        """Tracked clients and rejection counters"""
+        return {"clients": len(self._clients), "limited": self.limited, "evictions": self.evictions}
@@ -0,0 +1,171 @@
+"""
+Snapshot files for URL shortener
+"""
+
+import json
+import os
+import zlib
+from typing import Dict, Iterable, List, Tuple
+
+Row = Tuple[str, str, int]
+
+MAGIC = b"URLSNAP 2\n"
+
+# Body sections, in file order
+SECTIONS = ("codes", "urls", "clicks", "index_fingerprints", "index_codes", "extra")
+
+
+class CorruptDataError(Exception):
+    """Raised when persisted data fails validation and cannot be trusted"""
+
+
+def write_snapshot(path: str, snapshot: dict) -> None:
+    """
+    Atomically replace the snapshot at ``path``.
+
+    ``snapshot["links"]`` is an iterable of (code, url, clicks) rows. The
+    file is a magic line, a JSON header line, then newline-separated
+    columns: codes, URLs and click counts in matching order, and the dedupe
+    index as fingerprints and codes. Links that cannot be stored in a
+    newline-separated column go into a trailing JSON section, along with
+    ``snapshot["limits"]``. The header records each section's length and a
+    CRC32 of the whole body.
+    """
+    codes: List[str] = []
+    urls: List[str] = []
+    clicks: List[str] = []
+    extra_urls: Dict[str, str] = {}
+    extra_clicks: Dict[str, int] = {}
+    links: Iterable[Row] = snapshot["links"]
+    for short_code, url, count in links:
+        if "\n" in short_code or "\n" in url:
+            extra_urls[short_code] = url
+            extra_clicks[short_code] = count
+        else:
+            codes.append(short_code)
+            urls.append(url)
+            clicks.append(str(count))
+    url_index: Dict[int, str] = snapshot.get("url_index") or {}
+
+    body = {
+        "codes": "\n".join(codes).encode("utf-8"),
+        "urls": "\n".join(urls).encode("utf-8"),
+        "clicks": "\n".join(clicks).encode(),
+        "index_fingerprints": "\n".join(map(str, url_index)).encode(),
+        "index_codes": "\n".join(url_index.values()).encode("utf-8"),
+        "extra": json.dumps({
+            "urls": extra_urls,
+            "clicks": extra_clicks,
+            "limits": snapshot.get("limits") or {},
+        }).encode("utf-8"),
+    }
+    crc = 0
+    for name in SECTIONS:
+        crc = zlib.crc32(body[name], crc)
+    header = {
+        "generation": snapshot["generation"],
+        "next_id": snapshot["next_id"],
+        "links": len(codes),
+        "index": len(url_index),
+        "dedupe": "url_index" in snapshot,
+        "lengths": [len(body[name]) for name in SECTIONS],
+        "crc32": crc,
+    }
+
+    tmp_file = path + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(MAGIC)
+        f.write(json.dumps(header).encode("utf-8") + b"\n")
+        for name in SECTIONS:
+            f.write(body[name])
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+    fsync_dir(path)
+
+
+def read_snapshot(path: str) -> dict:
+    """
+    Load a snapshot, raising CorruptDataError if it fails validation.
+
+    Links are returned as ``snapshot["links"]``: matching lists of codes,
+    URLs and clicks.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if data.startswith(b"{"):
+        return _read_json_snapshot(data, path)
+    if not data.startswith(MAGIC):
+        raise CorruptDataError(f"{path}: not a snapshot file")
+    header_end = data.find(b"\n", len(MAGIC))
+    try:
+        header = json.loads(data[len(MAGIC):header_end])
+    except ValueError:
+        raise CorruptDataError(f"{path}: unreadable header")
+
+    body = memoryview(data)[header_end + 1:]
+    if len(body) != sum(header["lengths"]) or zlib.crc32(body) != header["crc32"]:
+        raise CorruptDataError(f"{path}: checksum mismatch, the file is truncated or damaged")
+
+    sections = {}
+    offset = 0
+    for name, length in zip(SECTIONS, header["lengths"]):
+        sections[name] = bytes(body[offset:offset + length])
+        offset += length
+
+    codes = _split(sections["codes"], header["links"])
+    urls = _split(sections["urls"], header["links"])
+    clicks = list(map(int, _split(sections["clicks"], header["links"])))
+    extra = json.loads(sections["extra"])
+    for short_code, url in extra["urls"].items():
+        codes.append(short_code)
+        urls.append(url)
+        clicks.append(extra["clicks"].get(short_code, 0))
+
+    snapshot = {
+        "generation": header["generation"],
+        "next_id": header["next_id"],
+        "links": (codes, urls, clicks),
+        "limits": extra.get("limits", {}),
+    }
+    if header["dedupe"]:
+        snapshot["url_index"] = dict(zip(
+            map(int, _split(sections["index_fingerprints"], header["index"])),
+            _split(sections["index_codes"], header["index"]),
+        ))
+    return snapshot
+
+
+def _split(section: bytes, count: int) -> List[str]:
+    return section.decode("utf-8").split("\n") if count else []
+
+
+def _read_json_snapshot(data: bytes, path: str) -> dict:
+    """Load a snapshot written as a single JSON document"""
+    try:
+        snapshot = json.loads(data)
+    except ValueError:
+        raise CorruptDataError(f"{path}: unreadable JSON snapshot")
+    urls: Dict[str, str] = snapshot.pop("urls")
+    clicks: Dict[str, int] = snapshot.pop("clicks")
+    snapshot["links"] = json_columns(urls, clicks)
+    if snapshot.get("url_index") is not None:
+        pairs: List[Tuple[int, str]] = snapshot["url_index"]
+        snapshot["url_index"] = {fingerprint: code for fingerprint, code in pairs}
+    snapshot.setdefault("next_id", 0)
+    return snapshot
+
+
+def json_columns(urls: Dict[str, str], clicks: Dict[str, int]) -> Tuple[List[str], List[str], List[int]]:
+    """Turn the code -> URL and code -> clicks dicts of older formats into columns"""
+    return list(urls), list(urls.values()), [clicks.get(short_code, 0) for short_code in urls]
+
+
+def fsync_dir(path: str) -> None:
+    """Make a rename or file creation in the file's directory durable"""
+    fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
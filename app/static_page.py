@@ -0,0 +1,89 @@
+"""
+Precompressed static page delivery for URL shortener
+"""
+
+import gzip
+import hashlib
+from typing import Dict, List, Mapping, Tuple
+
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+
+class PrecompressedPage:
+    """
+    A page encoded once, up front, in every supported content coding.
+
+    Each representation gets its own strong ETag, so conditional requests
+    are answered with a bodyless 304 and everything else is served from
+    the prebuilt bytes.
+    """
+
+    def __init__(self, content: str, media_type: str, max_age: int = 300):
+        self.media_type = media_type
+        body = content.encode("utf-8")
+        digest = hashlib.sha256(body).hexdigest()[:20]
+
+        # Content coding -> (body, etag), in order of preference
+        self.variants: Dict[str, Tuple[bytes, str]] = {}
+        if brotli is not None:
+            self.variants["br"] = (brotli.compress(body, quality=11), f'"{digest}-br"')
+        self.variants["gzip"] = (gzip.compress(body, compresslevel=9, mtime=0), f'"{digest}-gz"')
+        self.variants["identity"] = (body, f'"{digest}"')
+        self.etags = {etag for _, etag in self.variants.values()}
+
+        self.cache_control = f"public, max-age={max_age}"
+
+    def respond(self, headers: Mapping[str, str]) -> Response:
+        """Build the response for a request's headers"""
+        coding = self._choose_coding(headers.get("accept-encoding", ""))
+        body, etag = self.variants[coding]
+        response_headers = {
+            "ETag": etag,
+            "Cache-Control": self.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+
+        if_none_match = headers.get("if-none-match")
+        if if_none_match and self._matches(if_none_match):
+            return Response(status_code=304, headers=response_headers)
+
+        if coding != "identity":
+            response_headers["Content-Encoding"] = coding
+        return Response(body, headers=response_headers, media_type=self.media_type)
+
+    def _matches(self, if_none_match: str) -> bool:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        # A weak comparison is what If-None-Match calls for
+        return "*" in tags or any(tag.removeprefix("W/") in self.etags for tag in tags)
+
+    def _choose_coding(self, accept_encoding: str) -> str:
+        accepted = _parse_accept_encoding(accept_encoding)
+        for coding in self.variants:
+            if coding != "identity" and accepted.get(coding, accepted.get("*", 0)) > 0:
+                return coding
+        return "identity"
+
+
+def _parse_accept_encoding(header: str) -> Dict[str, float]:
+    """Map content codings to their q-values"""
+    accepted = {}
+    for part in header.split(","):
+        params: List[str] = part.strip().split(";")
+        coding = params[0].strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params[1:]:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
@@ -0,0 +1,1471 @@
+"""
+Storage engines for URL shortener
+"""
+
+import gc
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from itertools import islice
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from .config import settings
+from .link_filter import LinkFilter
+from .link_index import LayeredLinkTable, LinkIndex, write_index
+from .link_table import LINK_TABLES, LinkTable
+from .normalize import dedupe_key, url_fingerprint
+from .snapshot import CorruptDataError, fsync_dir, json_columns, read_snapshot, write_snapshot
+
+
+class LinkExistsError(Exception):
+    """Raised when a short code is already taken"""
+
+
+class LinkLimits(NamedTuple):
+    """When a link stops redirecting: an expiry time (Unix seconds) and/or a click cap"""
+    expires_at: Optional[float] = None
+    max_clicks: Optional[int] = None
+
+
+class StorageEngine:
+    """Base class for pluggable storage engines"""
+
+    # Called with the click deltas of every write, including those other
+    # workers' writes picked up from shared storage
+    on_clicks: Optional[Callable[[Dict[str, int]], None]] = None
+    # Called with the codes of links stored or removed, likewise
+    on_links: Optional[Callable[[List[str]], None]] = None
+    # Called with (short_code, expires_at) for new links that expire, likewise
+    on_expiring: Optional[Callable[[List[Tuple[str, float]]], None]] = None
+    # Called when shared storage was reloaded wholesale, so anything derived
+    # from earlier lookups may be stale
+    on_reload: Optional[Callable[[], None]] = None
+    # Whether lookups may wait on disk and should run off the event loop
+    blocking_reads = False
+    # Codes known to exist, when the link filter is on; checked before lookups
+    link_filter: Optional[LinkFilter] = None
+
+    @classmethod
+    def from_settings(cls) -> "StorageEngine":
+        """Create the engine from application settings"""
+        raise NotImplementedError
+
+    def load(self) -> None:
+        """Load persisted data"""
+        raise NotImplementedError
+
+    def get_url(self, short_code: str) -> Optional[str]:
+        """Return the original URL for a short code, or None"""
+        raise NotImplementedError
+
+    def exists(self, short_code: str) -> bool:
+        """Check whether a short code is taken"""
+        return self.get_url(short_code) is not None
+
+    def might_exist(self, short_code: str) -> bool:
+        """Cheap, non-blocking check; False only if the code is certainly not stored"""
+        return True
+
+    def build_filter(self) -> bool:
+        """Build the link filter one step at a time; return True once it is done"""
+        return True
+
+    def add_link(self, short_code: str, url: str, limits: Optional[LinkLimits] = None) -> None:
+        """Store a new short code mapping, raising LinkExistsError if taken"""
+        if not self.add_links([(short_code, url)], [limits])[0]:
+            raise LinkExistsError(short_code)
+
+    def add_links(
+        self, links: List[Tuple[str, str]], limits: Optional[List[Optional[LinkLimits]]] = None
+    ) -> List[bool]:
+        """
+        Store a batch of (short_code, url) pairs; return which were inserted.
+
+        ``limits`` optionally gives each link's LinkLimits, or None for
+        links that never expire.
+        """
+        raise NotImplementedError
+
+    def remove_links(self, short_codes: List[str]) -> List[str]:
+        """Delete links, freeing their codes; return the codes that existed"""
+        raise NotImplementedError
+
+    def remove_expired(self, short_codes: List[str], now: float) -> List[str]:
+        """
+        Delete those of these links that expired by ``now`` or ran out of
+        clicks, going by their stored limits; return the codes removed.
+        """
+        raise NotImplementedError
+
+    def get_limits(self, short_code: str) -> Optional[LinkLimits]:
+        """Return a link's expiry and click cap, or None if it has neither"""
+        raise NotImplementedError
+
+    def get_link(self, short_code: str) -> Optional[Tuple[str, Optional[LinkLimits], int]]:
+        """Return (url, limits, clicks) for a short code, or None; clicks may be 0 unless capped"""
+        url = self.get_url(short_code)
+        if url is None:
+            return None
+        limits = self.get_limits(short_code)
+        if limits is None or limits.max_clicks is None:
+            return url, limits, 0
+        return url, limits, self.get_clicks(short_code)
+
+    def expiring_links(self) -> List[Tuple[str, float]]:
+        """Return (short_code, expires_at) for every link with an expiry time"""
+        raise NotImplementedError
+
+    def find_by_url(self, url: str) -> Optional[str]:
+        """Return an existing short code for the same URL, or None; links with limits are never shared"""
+        raise NotImplementedError
+
+    def incr_clicks(self, short_code: str, amount: int = 1) -> None:
+        """Add clicks to a short code"""
+        raise NotImplementedError
+
+    def add_clicks(self, deltas: Dict[str, int]) -> None:
+        """Add a batch of aggregated click deltas"""
+        for short_code, amount in deltas.items():
+            self.incr_clicks(short_code, amount)
+
+    def get_clicks(self, short_code: str) -> int:
+        """Return the click count for a short code"""
+        raise NotImplementedError
+
+    def count_links(self) -> int:
+        """Return the number of stored links"""
+        raise NotImplementedError
+
+    def total_clicks(self) -> int:
+        """Return the number of clicks over all links"""
+        raise NotImplementedError
+
+    def lease_ids(self, count: int) -> int:
+        """Reserve a block of code counter values and return its start"""
+        raise NotImplementedError
+
+    def refresh(self) -> None:
+        """Pick up changes written by other worker processes"""
+
+    def needs_compaction(self) -> bool:
+        """Check whether a compacted snapshot is due"""
+        return False
+
+    def persistence_lag(self) -> Dict[str, float]:
+        """Report how far durable state trails the in-memory state"""
+        return {}
+
+    def flush(self) -> None:
+        """Make pending writes durable"""
+
+    def compact(self) -> None:
+        """Write a compacted snapshot of the current state"""
+
+    def close(self) -> None:
+        """Flush and release resources"""
+        self.flush()
+
+    def _notify_clicks(self, deltas: Dict[str, int]) -> None:
+        if self.on_clicks is not None and deltas:
+            self.on_clicks(deltas)
+
+    def _notify_links(self, short_codes: List[str]) -> None:
+        if self.on_links is not None and short_codes:
+            self.on_links(short_codes)
+
+    def _notify_expiring(self, links: List[Tuple[str, float]]) -> None:
+        if self.on_expiring is not None and links:
+            self.on_expiring(links)
+
+    def _notify_reload(self) -> None:
+        if self.on_reload is not None:
+            self.on_reload()
+
+
+class LogStorageEngine(StorageEngine):
+    """
+    In-memory storage backed by an append-only event log.
+
+    Every change is appended to the log as one JSON line and fsynced in
+    batches. The log is periodically folded into a snapshot so replay at
+    startup stays short. Each log file starts with a generation record;
+    the snapshot stores the first generation it does not include, which
+    keeps replay correct if the process dies halfway through compaction.
+
+    With ``shared=True`` several worker processes can use the same files:
+    appends happen under an exclusive file lock after catching up on the
+    log, so link creation is consistent across workers, and each worker
+    tails the log to pick up links and clicks written by the others. A
+    worker whose tail was rotated out follows the rotated logs one
+    generation at a time; if compaction already removed one, it reloads
+    from the snapshot.
+
+    Writes are expected to come from a single thread. Lookups may run on
+    another thread at the same time; catching up on the tail is guarded by
+    a mutex, which is only taken once the file lock is held, and fsyncs
+    happen outside it, so neither a slow disk nor a busy peer holds up a
+    lookup.
+    """
+
+    def __init__(
+        self,
+        snapshot_file: str,
+        log_file: str,
+        fsync_batch: int = 256,
+        fsync_interval: float = 1.0,
+        snapshot_min_events: int = 10000,
+        snapshot_interval: float = 300.0,
+        shared: bool = False,
+        dedupe: bool = False,
+        legacy_snapshot_files: Tuple[str, ...] = (),
+        link_table: str = "dict",
+        filter_error_rate: Optional[float] = None,
+        filter_capacity: int = 1000000,
+    ):
+        if shared and fcntl is None:
+            raise RuntimeError("Shared log storage requires POSIX file locking")
+        if link_table not in LINK_TABLES:
+            raise ValueError(f"Unknown link table: {link_table}")
+
+        self.snapshot_file = snapshot_file
+        self.legacy_snapshot_files = legacy_snapshot_files
+        self.log_file = log_file
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.snapshot_min_events = snapshot_min_events
+        self.snapshot_interval = snapshot_interval
+        self.shared = shared
+        self.dedupe = dedupe
+        self.filter_error_rate = filter_error_rate
+        self.filter_capacity = filter_capacity
+
+        self.links: LinkTable = LINK_TABLES[link_table]()
+        self.next_id = 0
+        self.clicks_total = 0
+        # URL fingerprint -> first short code, maintained only with dedupe on
+        self.url_index: Dict[int, str] = {}
+        # Only links that expire or have a click cap
+        self.limits: Dict[str, LinkLimits] = {}
+
+        self.generation = 0
+        self.log_events = 0
+        self._log = None
+        self._tail = None
+        self._lock_fd = None
+        self._snapshot_lock_fd = None
+        # Length of the active log up to its last complete record
+        self._log_valid_size: Optional[int] = None
+        self._mutex = threading.RLock()
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._last_snapshot = time.monotonic()
+
+    @classmethod
+    def from_settings(cls) -> "LogStorageEngine":
+        return cls(
+            snapshot_file=settings.SNAPSHOT_FILE,
+            log_file=settings.LOG_FILE,
+            fsync_batch=settings.LOG_FSYNC_BATCH,
+            fsync_interval=settings.LOG_FSYNC_INTERVAL,
+            snapshot_min_events=settings.SNAPSHOT_MIN_EVENTS,
+            snapshot_interval=settings.SNAPSHOT_INTERVAL,
+            shared=settings.SHARED_STORAGE,
+            dedupe=settings.DEDUPE_URLS,
+            legacy_snapshot_files=(settings.LEGACY_SNAPSHOT_FILE,),
+            link_table=settings.LINK_TABLE,
+            filter_error_rate=_filter_error_rate(default=False),
+            filter_capacity=settings.LINK_FILTER_CAPACITY,
+        )
+
+    # Locking
+
+    @contextmanager
+    def _locked(self, fd: Optional[int] = None):
+        """Hold an exclusive lock on the log across threads and worker processes"""
+        if fd is None:
+            # Waiting for another worker must not keep lookups out of the mutex
+            with self._flocked(self._lock_fd):
+                with self._mutex:
+                    yield
+        else:
+            with self._flocked(fd):
+                yield
+
+    @contextmanager
+    def _flocked(self, fd: Optional[int]):
+        if not self.shared:
+            yield
+            return
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    # Loading
+
+    def load(self) -> None:
+        os.makedirs(os.path.dirname(self.log_file) or ".", exist_ok=True)
+        if self.shared:
+            flags = os.O_RDWR | os.O_CREAT
+            self._lock_fd = os.open(self.log_file + ".lock", flags, 0o644)
+            self._snapshot_lock_fd = os.open(self.snapshot_file + ".lock", flags, 0o644)
+
+        # Loading allocates millions of objects that all survive; cyclic GC
+        # passes over them would only slow startup down
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            # The snapshot lock keeps compaction from replacing the snapshot
+            # and removing rotated logs while they are replayed
+            with self._locked(self._snapshot_lock_fd), self._locked():
+                log_generation = self.replay()
+                if log_generation is not None:
+                    self.generation = log_generation
+                    if self._log_valid_size < os.path.getsize(self.log_file):
+                        # Appending after a torn record would corrupt the next one
+                        print(f"Discarding incomplete record at the end of {self.log_file}")
+                        os.truncate(self.log_file, self._log_valid_size)
+                    self._log = open(self.log_file, "ab")
+                else:
+                    rotated = [generation for generation, _ in self._rotated_logs()]
+                    generation = max(rotated + [self.generation]) + 1
+                    self._open_new_log(generation, self._create_log(generation))
+                    fsync_dir(self.log_file)
+                self._open_tail()
+                self._load_filter()
+        finally:
+            if gc_enabled:
+                gc.enable()
+        # Keep later collections from rescanning the loaded data
+        gc.freeze()
+
+    def replay(self) -> Optional[int]:
+        """Rebuild state from the snapshot and logs; return the active log generation"""
+        snapshot_generation = self._load_snapshot()
+        self.generation = snapshot_generation
+        self.clicks_total = self.links.total_clicks()
+        for generation, path in self._rotated_logs():
+            # Rotated logs older than the snapshot are left over from a crash
+            # between writing the snapshot and removing them
+            if generation >= snapshot_generation:
+                self._replay_log(path, snapshot_generation)
+        return self._replay_log(self.log_file, snapshot_generation)
+
+    def _load_filter(self) -> None:
+        if self.filter_error_rate is not None:
+            self.link_filter = LinkFilter.build(
+                (short_code for short_code, _, _ in self.links.items()),
+                max(self.filter_capacity, 2 * len(self.links)),
+                self.filter_error_rate,
+            )
+
+    def _rotated_logs(self) -> List[Tuple[int, str]]:
+        """Return (generation, path) for logs rotated out by compaction"""
+        directory = os.path.dirname(self.log_file) or "."
+        if not os.path.isdir(directory):
+            return []
+        prefix = os.path.basename(self.log_file) + "."
+        logs = []
+        for name in os.listdir(directory):
+            suffix = name[len(prefix):]
+            if name.startswith(prefix) and suffix.isdigit():
+                logs.append((int(suffix), os.path.join(directory, name)))
+        return sorted(logs)
+
+    def _load_snapshot(self) -> int:
+        """Load the snapshot and return the first generation it does not cover"""
+        for path in (self.snapshot_file, *self.legacy_snapshot_files):
+            if os.path.exists(path):
+                # A damaged snapshot must stop startup, not start empty
+                snapshot = read_snapshot(path)
+                self.links.load(*snapshot["links"])
+                self.next_id = snapshot["next_id"]
+                self._load_limits(snapshot.get("limits"))
+                if self.dedupe:
+                    self._load_url_index(snapshot.get("url_index"))
+                return snapshot["generation"]
+
+        # Import data written by the previous whole-file storage
+        if os.path.exists(settings.DATA_FILE):
+            clicks = _read_json(settings.STATS_FILE) if os.path.exists(settings.STATS_FILE) else {}
+            self.links.load(*json_columns(_read_json(settings.DATA_FILE), clicks))
+        if self.dedupe:
+            self._load_url_index(None)
+        return 0
+
+    def _load_limits(self, limits: Optional[Dict[str, list]]) -> None:
+        self.limits = {short_code: LinkLimits(*value) for short_code, value in (limits or {}).items()}
+
+    def _load_url_index(self, url_index: Optional[Dict[int, str]]) -> None:
+        """Load the persisted dedupe index, building it if the snapshot has none"""
+        if url_index is not None:
+            self.url_index = url_index
+            return
+        # Snapshot predates dedupe; this is paid once, the next snapshot stores it
+        self.url_index = {}
+        for short_code, url, _ in self.links.items():
+            if short_code not in self.limits:
+                self.url_index.setdefault(url_fingerprint(url), short_code)
+
+    def _index_url(self, short_code: str, url: str, limits: Optional[LinkLimits]) -> None:
+        """Make a new link findable by find_by_url, unless it has limits"""
+        if self.dedupe and limits is None:
+            self.url_index.setdefault(url_fingerprint(url), short_code)
+
+    def _replay_log(self, path: str, snapshot_generation: int) -> Optional[int]:
+        """Apply a log file on top of the snapshot and return its generation"""
+        if not os.path.exists(path):
+            return None
+
+        generation = None
+        self._log_valid_size = 0
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete record")
+                    record = json.loads(line)
+                except ValueError:
+                    if f.read(1):
+                        raise CorruptDataError(
+                            f"{path}: unreadable record at byte {self._log_valid_size}"
+                        )
+                    # Torn write from a crash; it was never acknowledged
+                    break
+                self._log_valid_size += len(line)
+                if record[0] == "G":
+                    generation = record[1]
+                    if generation < snapshot_generation:
+                        return generation
+                    continue
+                self._apply(record)
+        return generation
+
+    def _apply(self, record: list) -> None:
+        op = record[0]
+        if op == "L":
+            self.links.add(record[1], record[2])
+            if self.link_filter is not None:
+                self.link_filter.add(record[1])
+            limits = None
+            if len(record) > 3:
+                limits = self.limits[record[1]] = LinkLimits(record[3], record[4])
+            self._index_url(record[1], record[2], limits)
+        elif op == "D":
+            self._remove(record[1])
+        elif op == "C":
+            if self.links.add_clicks(record[1], record[2]):
+                self.clicks_total += record[2]
+        elif op == "A":
+            self.next_id = max(self.next_id, record[1])
+        elif op == "G":
+            # Another worker compacted and started a new log
+            self.generation = record[1]
+            self.log_events = 0
+            self._last_snapshot = time.monotonic()
+            return
+        self.log_events += 1
+
+    # Following other workers
+
+    def _open_tail(self) -> None:
+        """Start following the active log from its current end"""
+        if not self.shared:
+            return
+        if self._tail is not None:
+            self._tail.close()
+        self._tail = open(self.log_file, "rb")
+        self._tail.seek(0, os.SEEK_END)
+
+    def _read_tail(self) -> None:
+        """Apply complete records appended since the last read"""
+        data = self._tail.read()
+        if not data:
+            return
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            # Leave a record that is still being written for the next read
+            self._tail.seek(end - len(data), os.SEEK_CUR)
+        clicks: Dict[str, int] = {}
+        links: List[str] = []
+        expiring: List[Tuple[str, float]] = []
+        for line in data[:end].splitlines():
+            record = json.loads(line)
+            self._apply(record)
+            if record[0] == "C":
+                clicks[record[1]] = clicks.get(record[1], 0) + record[2]
+            elif record[0] in ("L", "D"):
+                links.append(record[1])
+                if len(record) > 3 and record[3] is not None:
+                    expiring.append((record[1], record[3]))
+        self._notify_links(links)
+        self._notify_expiring(expiring)
+        self._notify_clicks(clicks)
+
+    def _tail_rotated(self) -> bool:
+        try:
+            return os.stat(self.log_file).st_ino != os.fstat(self._tail.fileno()).st_ino
+        except FileNotFoundError:
+            # Another worker is between rotating and creating the new log
+            return False
+
+    def _open_log(self, generation: int):
+        """Open the log of a generation past its generation record, or return None if it was removed"""
+        rotated = f"{self.log_file}.{generation}"
+        # The active log may be rotated out while we look, so try its rotated name last too
+        for path in (rotated, self.log_file, rotated):
+            try:
+                f = open(path, "rb")
+            except FileNotFoundError:
+                continue
+            # New logs are written in full before they are renamed into place
+            if json.loads(f.readline() or b"null") == ["G", generation]:
+                return f
+            f.close()
+        return None
+
+    def refresh(self) -> None:
+        """Catch up on records written by other worker processes"""
+        if not self.shared:
+            return
+        with self._mutex:
+            self._read_tail()
+            while self._tail_rotated():
+                # The old log is sealed once renamed; drain it, then follow
+                # the next generation, which may have been rotated out as well
+                self._read_tail()
+                tail = self._open_log(self.generation + 1)
+                if tail is None:
+                    tail = self._reload()
+                else:
+                    # Its generation record is applied like any other
+                    tail.seek(0)
+                self._tail.close()
+                self._tail = tail
+                self._read_tail()
+
+    def _reload(self):
+        """
+        Rebuild state from the snapshot after compaction removed a log
+        before this worker read it; return the log to follow from there.
+        """
+        previous = None
+        while True:
+            generation = self._load_snapshot()
+            tail = self._open_log(generation)
+            if tail is not None:
+                break
+            if generation == previous:
+                raise CorruptDataError(f"{self.log_file}: log generation {generation} is missing")
+            # Compacted again while the snapshot was being read
+            previous = generation
+
+        self.generation = generation
+        self.clicks_total = self.links.total_clicks()
+        self.log_events = 0
+        self._load_filter()
+        self._notify_reload()
+        self._notify_expiring(self.expiring_links())
+        return tail
+
+    # Lookups
+
+    def get_url(self, short_code: str) -> Optional[str]:
+        url = self._lookup(short_code)
+        if url is None and self.shared:
+            self.refresh()
+            url = self._lookup(short_code)
+        return url
+
+    def _lookup(self, short_code: str) -> Optional[str]:
+        if self.link_filter is not None and short_code not in self.link_filter:
+            return None
+        return self.links.get_url(short_code)
+
+    def might_exist(self, short_code: str) -> bool:
+        # Other workers' links are only known after catching up on the log
+        return self.shared or self.link_filter is None or short_code in self.link_filter
+
+    def get_clicks(self, short_code: str) -> int:
+        self.refresh()
+        return self.links.get_clicks(short_code)
+
+    def find_by_url(self, url: str) -> Optional[str]:
+        self.refresh()
+        short_code = self.url_index.get(url_fingerprint(url))
+        if short_code is not None and dedupe_key(self.links.get_url(short_code)) == dedupe_key(url):
+            return short_code
+        return None
+
+    def get_limits(self, short_code: str) -> Optional[LinkLimits]:
+        return self.limits.get(short_code)
+
+    def expiring_links(self) -> List[Tuple[str, float]]:
+        with self._mutex:
+            return [
+                (short_code, limits.expires_at)
+                for short_code, limits in self.limits.items()
+                if limits.expires_at is not None
+            ]
+
+    def count_links(self) -> int:
+        self.refresh()
+        return len(self.links)
+
+    def total_clicks(self) -> int:
+        self.refresh()
+        return self.clicks_total
+
+    # Writes
+
+    def add_links(
+        self, links: List[Tuple[str, str]], limits: Optional[List[Optional[LinkLimits]]] = None
+    ) -> List[bool]:
+        inserted = []
+        records = []
+        with self._locked():
+            self.refresh()
+            for (short_code, url), link_limits in zip(links, limits or [None] * len(links)):
+                if not self.links.add(short_code, url):
+                    inserted.append(False)
+                    continue
+                if self.link_filter is not None:
+                    self.link_filter.add(short_code)
+                self._index_url(short_code, url, link_limits)
+                if link_limits is None:
+                    records.append(["L", short_code, url])
+                else:
+                    self.limits[short_code] = link_limits
+                    records.append(["L", short_code, url, *link_limits])
+                inserted.append(True)
+            if records:
+                self.log_events += len(records)
+                self._append(*records)
+        self._sync_if_due()
+        self._notify_links([record[1] for record in records])
+        self._notify_expiring([
+            (record[1], record[3]) for record in records if len(record) > 3 and record[3] is not None
+        ])
+        return inserted
+
+    def remove_links(self, short_codes: List[str]) -> List[str]:
+        with self._locked():
+            self.refresh()
+            removed = [short_code for short_code in short_codes if self._remove(short_code)]
+            if removed:
+                self.log_events += len(removed)
+                self._append(*(["D", short_code] for short_code in removed))
+        self._sync_if_due()
+        self._notify_links(removed)
+        return removed
+
+    def remove_expired(self, short_codes: List[str], now: float) -> List[str]:
+        with self._locked():
+            self.refresh()
+            # A code may have been reused for a new link since it was scheduled
+            removed = [
+                short_code for short_code in short_codes
+                if self._expired(short_code, now) and self._remove(short_code)
+            ]
+            if removed:
+                self.log_events += len(removed)
+                self._append(*(["D", short_code] for short_code in removed))
+        self._sync_if_due()
+        self._notify_links(removed)
+        return removed
+
+    def _expired(self, short_code: str, now: float) -> bool:
+        limits = self.limits.get(short_code)
+        if limits is None:
+            return False
+        if limits.expires_at is not None and limits.expires_at <= now:
+            return True
+        return limits.max_clicks is not None and self.links.get_clicks(short_code) >= limits.max_clicks
+
+    def _remove(self, short_code: str) -> bool:
+        url = self.links.get_url(short_code)
+        if url is None:
+            return False
+        self.clicks_total -= self.links.get_clicks(short_code)
+        self.links.remove(short_code)
+        if self.link_filter is not None:
+            self.link_filter.remove(short_code)
+        self.limits.pop(short_code, None)
+        if self.dedupe:
+            fingerprint = url_fingerprint(url)
+            if self.url_index.get(fingerprint) == short_code:
+                del self.url_index[fingerprint]
+        return True
+
+    def incr_clicks(self, short_code: str, amount: int = 1) -> None:
+        self.add_clicks({short_code: amount})
+
+    def add_clicks(self, deltas: Dict[str, int]) -> None:
+        with self._locked():
+            self.refresh()
+            records = []
+            for short_code, amount in deltas.items():
+                if self.links.add_clicks(short_code, amount):
+                    self.clicks_total += amount
+                    records.append(["C", short_code, amount])
+            if records:
+                self.log_events += len(records)
+                self._append(*records)
+        self._sync_if_due()
+        self._notify_clicks(deltas)
+
+    def lease_ids(self, count: int) -> int:
+        with self._locked():
+            self.refresh()
+            start = self.next_id
+            self.next_id += count
+            self.log_events += 1
+            self._append(["A", self.next_id])
+        # A lease must survive a crash, or its IDs could be handed out twice
+        self.flush()
+        return start
+
+    def _append(self, *records: list) -> None:
+        if self.shared and self._log_rotated():
+            self._log.close()
+            self._log = open(self.log_file, "ab")
+
+        data = "".join(
+            json.dumps(record, separators=(",", ":")) + "\n" for record in records
+        ).encode("utf-8")
+        self._log.write(data)
+        if self.shared:
+            # Other workers must see whole records once the lock is released,
+            # and our own tail must skip what we already applied
+            self._log.flush()
+            self._tail.seek(len(data), os.SEEK_CUR)
+
+        self._unsynced += len(records)
+
+    def _sync_if_due(self) -> None:
+        if (
+            self._unsynced >= self.fsync_batch
+            or time.monotonic() - self._last_sync >= self.fsync_interval
+        ):
+            self.flush()
+
+    def _log_rotated(self) -> bool:
+        return os.stat(self.log_file).st_ino != os.fstat(self._log.fileno()).st_ino
+
+    def flush(self) -> None:
+        if self._log is None:
+            return
+        if self._unsynced:
+            self._log.flush()
+            os.fsync(self._log.fileno())
+            self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    # Compaction
+
+    def needs_compaction(self) -> bool:
+        if self.log_events >= self.snapshot_min_events:
+            return True
+        return (
+            self.log_events > 0
+            and time.monotonic() - self._last_snapshot >= self.snapshot_interval
+        )
+
+    def persistence_lag(self) -> Dict[str, float]:
+        now = time.monotonic()
+        return {
+            "unsynced_events": self._unsynced,
+            "seconds_since_fsync": round(now - self._last_sync, 3) if self._unsynced else 0.0,
+            "events_since_snapshot": self.log_events,
+            "seconds_since_snapshot": round(now - self._last_snapshot, 3),
+        }
+
+    def compact(self) -> None:
+        """Rotate the log and fold everything before it into a new snapshot"""
+        # Only one worker writes a snapshot at a time, so snapshots never go
+        # back to an older generation
+        with self._locked(self._snapshot_lock_fd):
+            with self._flocked(self._lock_fd):
+                self.refresh()
+                # Written and synced before taking the mutex, so lookups never wait on the disk
+                new_log = self._create_log(self.generation + 1)
+                with self._mutex:
+                    old_log = self._log
+                    old_log.flush()
+                    os.replace(self.log_file, f"{self.log_file}.{self.generation}")
+                    self._open_new_log(self.generation + 1, new_log)
+                    self._open_tail()
+                    snapshot = self._snapshot_state()
+                # Persist both renames
+                fsync_dir(self.log_file)
+            # The rotated log is sealed, so it can be synced without the lock
+            os.fsync(old_log.fileno())
+            old_log.close()
+
+            self._write_snapshot(snapshot)
+            for generation, path in self._rotated_logs():
+                if generation < snapshot["generation"]:
+                    os.remove(path)
+
+        self._last_snapshot = time.monotonic()
+
+    def _snapshot_state(self) -> dict:
+        """Capture the state the snapshot will hold; called under the log lock"""
+        snapshot = {
+            "generation": self.generation,
+            "links": self.links.copy().items(),
+            "next_id": self.next_id,
+            "limits": {short_code: list(limits) for short_code, limits in self.limits.items()},
+        }
+        if self.dedupe:
+            snapshot["url_index"] = dict(self.url_index)
+        return snapshot
+
+    def _write_snapshot(self, snapshot: dict) -> None:
+        write_snapshot(self.snapshot_file, snapshot)
+
+    def _create_log(self, generation: int) -> str:
+        """Write and sync a log holding only its generation record; return its temporary path"""
+        path = self.log_file + ".new"
+        with open(path, "wb") as f:
+            f.write(json.dumps(["G", generation]).encode("utf-8") + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return path
+
+    def _open_new_log(self, generation: int, path: str) -> None:
+        """Move a log made by _create_log into place; the caller syncs the directory"""
+        os.replace(path, self.log_file)
+        self.generation = generation
+        self.log_events = 0
+        # Append mode, so writes from several workers never overwrite each other
+        self._log = open(self.log_file, "ab")
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self) -> None:
+        if self._log is not None:
+            with self._locked():
+                self.flush()
+            self._log.close()
+            self._log = None
+        if self._tail is not None:
+            self._tail.close()
+            self._tail = None
+        for fd in (self._lock_fd, self._snapshot_lock_fd):
+            if fd is not None:
+                os.close(fd)
+        self._lock_fd = self._snapshot_lock_fd = None
+
+
+@contextmanager
+def _file_lock(path: str):
+    """Hold an exclusive lock on a lock file across worker processes, where supported"""
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def _read_json(path: str):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except ValueError:
+        raise CorruptDataError(f"{path}: unreadable JSON")
+
+
+class MappedLogStorageEngine(LogStorageEngine):
+    """
+    Event log storage serving links from a memory-mapped index file.
+
+    Compaction writes a read-only hash index (see ``app.link_index``) in
+    place of the snapshot. Startup maps it instead of loading it, so it
+    takes the same time for any number of links, and worker processes
+    share its pages through the page cache. Links and clicks logged since
+    the index was written live in a small in-memory overlay, which each
+    compaction merges into a new index generation.
+
+    When the log is rotated, the current table is frozen under a fresh
+    overlay until the index built from it is written; workers following
+    the log switch to that index as soon as it appears.
+    """
+
+    # A lookup may page in parts of the index from disk
+    blocking_reads = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._overlay_table = type(self.links)
+        self.links: LayeredLinkTable = LayeredLinkTable(None, self._overlay_table(), 0)
+        # The index and overlay track URL fingerprints themselves
+        self.dedupe = False
+        # Generation of an index another worker is still writing
+        self._pending_generation: Optional[int] = None
+        self._index_inode: Optional[int] = None
+
+    @classmethod
+    def from_settings(cls) -> "MappedLogStorageEngine":
+        engine = super().from_settings()
+        # Snapshots are only read, to import data kept by the log backend
+        engine.snapshot_file = settings.INDEX_FILE
+        engine.legacy_snapshot_files = (settings.SNAPSHOT_FILE, settings.LEGACY_SNAPSHOT_FILE)
+        return engine
+
+    def _load_snapshot(self) -> int:
+        if not os.path.exists(self.snapshot_file):
+            # The overlay holds the import until the first compaction
+            generation = super()._load_snapshot()
+            self.links.generation = generation
+            for short_code in self.limits:
+                self.links.unshare(short_code)
+            return generation
+        index = LinkIndex(self.snapshot_file)
+        self._index_inode = index.inode
+        self._pending_generation = None
+        self.links = LayeredLinkTable(index, self._overlay_table(), index.generation)
+        self.next_id = index.next_id
+        self._load_limits(index.extra.get("limits"))
+        return index.generation
+
+    def _index_url(self, short_code: str, url: str, limits: Optional[LinkLimits]) -> None:
+        # The overlay tracks fingerprints itself
+        if limits is not None:
+            self.links.unshare(short_code)
+
+    def _apply(self, record: list) -> None:
+        if record[0] == "G":
+            # Another worker rotated the log and is writing an index of
+            # everything before it; keep serving what we have until then
+            self.links = self.links.push(self._overlay_table, record[1])
+            self._pending_generation = record[1]
+        super()._apply(record)
+
+    def refresh(self) -> None:
+        super().refresh()
+        if self._pending_generation is not None:
+            self._check_index()
+
+    def _check_index(self) -> None:
+        """Switch to an index written by another worker once it is complete"""
+        try:
+            inode = os.stat(self.snapshot_file).st_ino
+        except FileNotFoundError:
+            return
+        if inode != self._index_inode:
+            self._adopt_index(LinkIndex(self.snapshot_file))
+
+    def _adopt_index(self, index: LinkIndex) -> None:
+        with self._mutex:
+            links = self.links.rebase(index)
+            if links is self.links:
+                # Written from a log generation not followed yet; retried on the next refresh
+                return
+            self.links = links
+            self._index_inode = index.inode
+            if self._pending_generation is not None and index.generation >= self._pending_generation:
+                self._pending_generation = None
+
+    def find_by_url(self, url: str) -> Optional[str]:
+        self.refresh()
+        key = dedupe_key(url)
+        for short_code in self.links.codes_for_fingerprint(url_fingerprint(url)):
+            # The index still lists links removed since it was written
+            stored_url = self.links.get_url(short_code)
+            if stored_url is not None and short_code not in self.limits and dedupe_key(stored_url) == key:
+                return short_code
+        return None
+
+    def _snapshot_state(self) -> dict:
+        frozen = self.links
+        self.links = frozen.push(self._overlay_table, self.generation)
+        return {
+            "generation": self.generation,
+            "links": frozen.items(),
+            "next_id": self.next_id,
+            "limits": {short_code: list(limits) for short_code, limits in self.limits.items()},
+        }
+
+    def _write_snapshot(self, snapshot: dict) -> None:
+        write_index(
+            self.snapshot_file,
+            snapshot["generation"],
+            snapshot["next_id"],
+            snapshot["links"],
+            extra={"limits": snapshot["limits"]},
+        )
+        self._adopt_index(LinkIndex(self.snapshot_file))
+
+
+class SQLitePool:
+    """Per-worker pool handing each thread its own SQLite connection"""
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def get(self) -> sqlite3.Connection:
+        """Return the calling thread's connection, opening it on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path,
+                timeout=self.busy_timeout,
+                isolation_level=None,
+                check_same_thread=False,
+                cached_statements=256,
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+class SQLiteStorageEngine(StorageEngine):
+    """
+    SQLite storage in WAL mode.
+
+    Lookups go straight to the indexed primary key instead of a fully
+    loaded dict, so memory and startup time do not depend on the number of
+    links, and several worker processes can share one database file.
+    """
+
+    blocking_reads = True
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS links (
+            short_code TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            clicks INTEGER NOT NULL DEFAULT 0,
+            url_hash INTEGER,
+            expires_at REAL,
+            max_clicks INTEGER
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+        """,
+    )
+
+    # Running totals kept by triggers, so stats never scan the links table
+    TOTALS_SCHEMA = (
+        """
+        CREATE TABLE totals (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            links INTEGER NOT NULL,
+            clicks INTEGER NOT NULL
+        )
+        """,
+        """
+        INSERT INTO totals (id, links, clicks)
+        SELECT 0, COUNT(*), COALESCE(SUM(clicks), 0) FROM links
+        """,
+        """
+        CREATE TRIGGER totals_insert AFTER INSERT ON links BEGIN
+            UPDATE totals SET links = links + 1, clicks = clicks + NEW.clicks;
+        END
+        """,
+        """
+        CREATE TRIGGER totals_delete AFTER DELETE ON links BEGIN
+            UPDATE totals SET links = links - 1, clicks = clicks - OLD.clicks;
+        END
+        """,
+        """
+        CREATE TRIGGER totals_clicks AFTER UPDATE OF clicks ON links BEGIN
+            UPDATE totals SET clicks = clicks + NEW.clicks - OLD.clicks;
+        END
+        """,
+    )
+
+    # Codes read per step while building the link filter
+    FILTER_BUILD_BATCH = 50000
+    # Links imported per transaction when migrating from the log backend
+    MIGRATE_BATCH = 10000
+
+    def __init__(
+        self,
+        path: str,
+        busy_timeout: float = 5.0,
+        filter_error_rate: Optional[float] = None,
+        filter_capacity: int = 1000000,
+    ):
+        self.path = path
+        self.pool = SQLitePool(path, busy_timeout)
+        self.filter_error_rate = filter_error_rate
+        self.filter_capacity = filter_capacity
+        # Filter being built, and the last code it has read
+        self._building: Optional[LinkFilter] = None
+        self._filter_cursor: Optional[str] = None
+
+    @classmethod
+    def from_settings(cls) -> "SQLiteStorageEngine":
+        filter_error_rate = _filter_error_rate(default=not settings.SHARED_STORAGE)
+        if filter_error_rate is not None and settings.SHARED_STORAGE:
+            # Links created by other workers would be filtered out
+            print("LINK_FILTER is ignored with the sqlite backend and several workers")
+            filter_error_rate = None
+        return cls(
+            settings.SQLITE_FILE,
+            settings.SQLITE_BUSY_TIMEOUT,
+            filter_error_rate=filter_error_rate,
+            filter_capacity=settings.LINK_FILTER_CAPACITY,
+        )
+
+    def load(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = self.pool.get()
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+        # Workers starting together wait here, however long upgrading the
+        # schema and importing old data take, instead of timing out on the
+        # database lock or adding the same column twice
+        with _file_lock(self.path + ".migrate.lock"):
+            self._add_url_hash()
+            self._add_limits()
+            self._add_totals()
+            self._migrate()
+
+    def _add_url_hash(self) -> None:
+        """Add and backfill the dedupe column on databases created without it"""
+        conn = self.pool.get()
+        conn.create_function("url_fingerprint", 1, url_fingerprint, deterministic=True)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Checked under the write lock too, where lock files are not supported
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(links)")]
+            if "url_hash" not in columns:
+                conn.execute("ALTER TABLE links ADD COLUMN url_hash INTEGER")
+                conn.execute("UPDATE links SET url_hash = url_fingerprint(url)")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("CREATE INDEX IF NOT EXISTS links_url_hash ON links (url_hash)")
+
+    def _add_limits(self) -> None:
+        """Add the expiry columns to databases created without them"""
+        conn = self.pool.get()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(links)")]
+            for column, column_type in (("expires_at", "REAL"), ("max_clicks", "INTEGER")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE links ADD COLUMN {column} {column_type}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        # Only expiring links are indexed, so the index stays small
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS links_expires_at ON links (expires_at) "
+            "WHERE expires_at IS NOT NULL"
+        )
+
+    def _add_totals(self) -> None:
+        """Create the totals table and its triggers, counting existing rows once"""
+        conn = self.pool.get()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'totals'"
+            ).fetchone()
+            if not exists:
+                for statement in self.TOTALS_SCHEMA:
+                    conn.execute(statement)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _migrate(self) -> None:
+        """Import data from the JSON/event log storage on first start"""
+        conn = self.pool.get()
+        if conn.execute("SELECT value FROM meta WHERE key = 'migrated'").fetchone():
+            return
+        legacy_engine = MappedLogStorageEngine if os.path.exists(settings.INDEX_FILE) else LogStorageEngine
+        legacy = legacy_engine.from_settings()
+        legacy.replay()
+        rows = (
+            (code, url, clicks, url_fingerprint(url), *legacy.limits.get(code, LinkLimits()))
+            for code, url, clicks in legacy.links.items()
+        )
+        # Imported a batch per transaction, so the write lock is never held
+        # for long; rerunning an interrupted import skips rows it already has
+        while True:
+            batch = list(islice(rows, self.MIGRATE_BATCH))
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO links "
+                    "(short_code, url, clicks, url_hash, expires_at, max_clicks) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    batch,
+                )
+                if len(batch) < self.MIGRATE_BATCH:
+                    # Counter codes carry on past those the log backend handed out
+                    row = conn.execute("SELECT value FROM meta WHERE key = 'next_id'").fetchone()
+                    conn.execute(
+                        "INSERT OR REPLACE INTO meta (key, value) VALUES ('next_id', ?)",
+                        (str(max(int(row[0]) if row else 0, legacy.next_id)),),
+                    )
+                    conn.execute("INSERT INTO meta (key, value) VALUES ('migrated', '1')")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            if len(batch) < self.MIGRATE_BATCH:
+                break
+        if len(legacy.links):
+            print(f"Migrated {len(legacy.links)} links to {self.path}")
+
+    def build_filter(self) -> bool:
+        """
+        Read one batch of codes into the link filter.
+
+        Runs on the storage I/O thread between writes, so startup does not
+        wait for it. Until the filter is complete it is not consulted;
+        writes to codes the scan has not reached yet are left to the scan.
+        """
+        if self.filter_error_rate is None or self.link_filter is not None:
+            return True
+        if self._building is None:
+            capacity = max(self.filter_capacity, 2 * self.count_links())
+            self._building = LinkFilter(capacity, self.filter_error_rate)
+            self._filter_cursor = ""
+        rows = self.pool.get().execute(
+            "SELECT short_code FROM links WHERE short_code > ? ORDER BY short_code LIMIT ?",
+            (self._filter_cursor, self.FILTER_BUILD_BATCH),
+        ).fetchall()
+        for (short_code,) in rows:
+            self._building.add(short_code)
+        if len(rows) == self.FILTER_BUILD_BATCH:
+            self._filter_cursor = rows[-1][0]
+            return False
+        self.link_filter, self._building, self._filter_cursor = self._building, None, None
+        return True
+
+    def _update_filter(self, short_codes: List[str], added: bool) -> None:
+        link_filter = self.link_filter or self._building
+        if link_filter is None:
+            return
+        cursor = self._filter_cursor
+        update = link_filter.add if added else link_filter.remove
+        for short_code in short_codes:
+            if cursor is None or short_code <= cursor:
+                update(short_code)
+
+    def might_exist(self, short_code: str) -> bool:
+        return self.link_filter is None or short_code in self.link_filter
+
+    def get_url(self, short_code: str) -> Optional[str]:
+        if self.link_filter is not None and short_code not in self.link_filter:
+            return None
+        row = self.pool.get().execute(
+            "SELECT url FROM links WHERE short_code = ?", (short_code,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def get_clicks(self, short_code: str) -> int:
+        row = self.pool.get().execute(
+            "SELECT clicks FROM links WHERE short_code = ?", (short_code,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def find_by_url(self, url: str) -> Optional[str]:
+        key = dedupe_key(url)
+        rows = self.pool.get().execute(
+            "SELECT short_code, url FROM links"
+            " WHERE url_hash = ? AND expires_at IS NULL AND max_clicks IS NULL",
+            (url_fingerprint(url),),
+        )
+        for short_code, stored_url in rows:
+            if dedupe_key(stored_url) == key:
+                return short_code
+        return None
+
+    def get_limits(self, short_code: str) -> Optional[LinkLimits]:
+        row = self.pool.get().execute(
+            "SELECT expires_at, max_clicks FROM links WHERE short_code = ?", (short_code,)
+        ).fetchone()
+        return LinkLimits(*row) if row and row != (None, None) else None
+
+    def get_link(self, short_code: str) -> Optional[Tuple[str, Optional[LinkLimits], int]]:
+        if self.link_filter is not None and short_code not in self.link_filter:
+            return None
+        row = self.pool.get().execute(
+            "SELECT url, expires_at, max_clicks, clicks FROM links WHERE short_code = ?",
+            (short_code,),
+        ).fetchone()
+        if row is None:
+            return None
+        url, expires_at, max_clicks, clicks = row
+        if expires_at is None and max_clicks is None:
+            return url, None, clicks
+        return url, LinkLimits(expires_at, max_clicks), clicks
+
+    def expiring_links(self) -> List[Tuple[str, float]]:
+        return self.pool.get().execute(
+            "SELECT short_code, expires_at FROM links WHERE expires_at IS NOT NULL"
+        ).fetchall()
+
+    def count_links(self) -> int:
+        return self.pool.get().execute("SELECT links FROM totals").fetchone()[0]
+
+    def total_clicks(self) -> int:
+        return self.pool.get().execute("SELECT clicks FROM totals").fetchone()[0]
+
+    def add_links(
+        self, links: List[Tuple[str, str]], limits: Optional[List[Optional[LinkLimits]]] = None
+    ) -> List[bool]:
+        limits = limits or [None] * len(links)
+        conn = self.pool.get()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            inserted = [
+                conn.execute(
+                    "INSERT OR IGNORE INTO links "
+                    "(short_code, url, url_hash, expires_at, max_clicks) VALUES (?, ?, ?, ?, ?)",
+                    (short_code, url, url_fingerprint(url), *(link_limits or LinkLimits())),
+                ).rowcount == 1
+                for (short_code, url), link_limits in zip(links, limits)
+            ]
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        added = [short_code for (short_code, _), ok in zip(links, inserted) if ok]
+        self._update_filter(added, added=True)
+        self._notify_links(added)
+        self._notify_expiring([
+            (short_code, link_limits.expires_at)
+            for (short_code, _), link_limits, ok in zip(links, limits, inserted)
+            if ok and link_limits is not None and link_limits.expires_at is not None
+        ])
+        return inserted
+
+    def remove_links(self, short_codes: List[str]) -> List[str]:
+        conn = self.pool.get()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            removed = [
+                short_code
+                for short_code in short_codes
+                if conn.execute("DELETE FROM links WHERE short_code = ?", (short_code,)).rowcount
+            ]
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._update_filter(removed, added=False)
+        self._notify_links(removed)
+        return removed
+
+    def remove_expired(self, short_codes: List[str], now: float) -> List[str]:
+        conn = self.pool.get()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # A code may have been reused for a new link since it was scheduled
+            removed = [
+                short_code
+                for short_code in short_codes
+                if conn.execute(
+                    "DELETE FROM links WHERE short_code = ? "
+                    "AND (expires_at <= ? OR clicks >= max_clicks)",
+                    (short_code, now),
+                ).rowcount
+            ]
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._update_filter(removed, added=False)
+        self._notify_links(removed)
+        return removed
+
+    def incr_clicks(self, short_code: str, amount: int = 1) -> None:
+        self.add_clicks({short_code: amount})
+
+    def add_clicks(self, deltas: Dict[str, int]) -> None:
+        conn = self.pool.get()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "UPDATE links SET clicks = clicks + ? WHERE short_code = ?",
+                ((amount, code) for code, amount in deltas.items()),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._notify_clicks(deltas)
+
+    def lease_ids(self, count: int) -> int:
+        conn = self.pool.get()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'next_id'").fetchone()
+            start = int(row[0]) if row else 0
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('next_id', ?)",
+                (str(start + count),),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return start
+
+    def close(self) -> None:
+        self.pool.close()
+
+
+STORAGE_ENGINES = {
+    "log": LogStorageEngine,
+    "mmap": MappedLogStorageEngine,
+    "sqlite": SQLiteStorageEngine,
+}
+
+
+def _filter_error_rate(default: bool) -> Optional[float]:
+    """LINK_FILTER_ERROR_RATE when the link filter is on for an engine, else None"""
+    mode = settings.LINK_FILTER.lower()
+    enabled = default if mode == "auto" else mode == "true"
+    return settings.LINK_FILTER_ERROR_RATE if enabled else None
+
+
+def create_storage() -> StorageEngine:
+    """Create the storage engine selected in settings"""
+    backend = settings.STORAGE_BACKEND
+    if backend not in STORAGE_ENGINES:
+        raise ValueError(f"Unknown storage backend: {backend}")
+    return STORAGE_ENGINES[backend].from_settings()
@@ -0,0 +1,114 @@
+"""
+Background storage I/O for URL shortener
+"""
+
+import asyncio
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+
+class StorageIO:
+    """
+    A dedicated thread running storage writes off the event loop.
+
+    Jobs run one at a time in submission order, so the storage engine sees
+    the same sequence of writes as before and needs no locking of its own
+    against them. At most ``max_pending`` jobs are queued; callers beyond
+    that wait for a slot, and those waits are counted so a slow disk shows
+    up as backpressure rather than as stalled requests.
+    """
+
+    def __init__(self, max_pending: int = 1024):
+        self.max_pending = max_pending
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self.pending = 0
+        self.peak_pending = 0
+        self.backpressure_waits = 0
+        self.completed = 0
+        self.busy_seconds = 0.0
+        self.last_queue_wait = 0.0
+        self.max_queue_wait = 0.0
+        self._running_since: Optional[float] = None
+
+    def start(self) -> None:
+        """Start the I/O thread; must be called from the event loop"""
+        self._loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self._thread = threading.Thread(target=self._work, name="storage-io", daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        """Finish queued jobs and stop the I/O thread"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        await asyncio.to_thread(self._thread.join)
+        self._thread = None
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run ``fn(*args)`` on the I/O thread and return its result"""
+        if self._slots.locked():
+            self.backpressure_waits += 1
+        async with self._slots:
+            future = self._loop.create_future()
+            self.pending += 1
+            self.peak_pending = max(self.peak_pending, self.pending)
+            self._queue.put((fn, args, future, time.monotonic()))
+            try:
+                return await future
+            finally:
+                self.pending -= 1
+
+    def _work(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            fn, args, future, queued_at = job
+            started = time.monotonic()
+            self._running_since = started
+            self.last_queue_wait = started - queued_at
+            self.max_queue_wait = max(self.max_queue_wait, self.last_queue_wait)
+            try:
+                result, error = fn(*args), None
+            except BaseException as e:
+                result, error = None, e
+            self._running_since = None
+            self.busy_seconds += time.monotonic() - started
+            self.completed += 1
+            self._loop.call_soon_threadsafe(_resolve, future, result, error)
+
+    def lag(self) -> float:
+        """Seconds the job currently running has been in progress"""
+        running_since = self._running_since
+        return time.monotonic() - running_since if running_since is not None else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        """Queue depth and backpressure counters"""
+        return {
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "peak_pending": self.peak_pending,
+            "backpressure_waits": self.backpressure_waits,
+            "completed": self.completed,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "running_job_seconds": round(self.lag(), 3),
+            "last_queue_wait_seconds": round(self.last_queue_wait, 6),
+            "max_queue_wait_seconds": round(self.max_queue_wait, 6),
+        }
+
+
+def _resolve(future: asyncio.Future, result: Any, error: Optional[BaseException]) -> None:
+    # The awaiting request may have been cancelled in the meantime
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
@@ -2,19 +2,49 @@
 Utility functions for URL shortener
 """
 
+import re
 import string
-import random
-import json
-import os
-from typing import Dict, Tuple
+import secrets
+import time
+from datetime import timezone
+from typing import Optional, Set
 
 from .config import settings
+from .metrics import STORAGE_SECONDS, timed
+from .models import URLCreate
+from .normalize import InvalidURLError, create_normalizer
+from .storage import LinkLimits, StorageEngine, create_storage
+
+BASE62_ALPHABET = string.ascii_letters + string.digits
+
+# First path segments of fixed routes; filled in at startup. A link with one
+# of these codes would be shadowed by the route.
+RESERVED_CODES: Set[str] = set()
+
+# Letters, digits, "-" and "_", with at least one letter or digit; \w is
+# what str.isalnum() accepts, plus "_"
+CUSTOM_CODE = re.compile(
+    r"(?=[\w-]*[^\W_])[\w-]{%d,%d}"
+    % (settings.CUSTOM_CODE_MIN_LENGTH, settings.CUSTOM_CODE_MAX_LENGTH)
+)
+
+url_normalizer = create_normalizer()
 
 
 def generate_short_code(length: int = 6) -> str:
     """Generate a random short code"""
-    characters = string.ascii_letters + string.digits
-    return ''.join(random.choice(characters) for _ in range(length))
+    return ''.join(secrets.choice(BASE62_ALPHABET) for _ in range(length))
+
+
+def encode_base62(value: int, length: int) -> str:
+    """Encode a non-negative integer as a fixed-length base62 code"""
+    chars = []
+    for _ in range(length):
+        value, digit = divmod(value, 62)
+        chars.append(BASE62_ALPHABET[digit])
+    if value:
+        raise ValueError("Value does not fit in the requested length")
+    return ''.join(reversed(chars))
 
 
 def is_valid_url(url: str) -> bool:
@@ -24,43 +54,66 @@ def is_valid_url(url: str) -> bool:
 
 def is_valid_custom_code(code: str) -> bool:
     """Validate custom code"""
-    return (
-        len(code) >= 3 and 
-        len(code) <= 20 and 
-        code.replace('-', '').replace('_', '').isalnum()
-    )
-
-
-def load_data() -> Tuple[Dict[str, str], Dict[str, int]]:
-    """Load data from JSON files"""
-    url_storage = {}
-    stats_storage = {}
-    
+    return CUSTOM_CODE.fullmatch(code) is not None
+
+
+def validate_url_create(request: URLCreate) -> Optional[str]:
+    """
+    Return an error message if the create request is invalid.
+
+    With URL_NORMALIZE on, a valid request's URL is replaced by its
+    normalized form.
+    """
+    if url_normalizer is not None:
+        try:
+            url = url_normalizer.normalize(request.url)
+        except InvalidURLError as e:
+            return str(e)
+        # Model assignment costs microseconds, and most URLs are unchanged
+        if url != request.url:
+            request.url = url
+    elif not is_valid_url(request.url):
+        return "Invalid URL format"
+    if request.custom_code:
+        if not is_valid_custom_code(request.custom_code):
+            return "Invalid custom code format"
+        if request.custom_code in RESERVED_CODES:
+            return "Custom code is reserved"
+    limits = link_limits(request)
+    if limits is not None:
+        if limits.expires_at is not None and limits.expires_at <= time.time():
+            return "Expiry time must be in the future"
+        if limits.max_clicks is not None and limits.max_clicks < 1:
+            return "max_clicks must be at least 1"
+    return None
+
+
+def link_limits(request: URLCreate) -> Optional[LinkLimits]:
+    """Return the expiry and click cap requested for a link, or None"""
+    if request.expires_at is None and request.max_clicks is None:
+        return None
+    expires_at = None
+    if request.expires_at is not None:
+        expires = request.expires_at
+        if expires.tzinfo is None:
+            expires = expires.replace(tzinfo=timezone.utc)
+        expires_at = expires.timestamp()
+    return LinkLimits(expires_at, request.max_clicks)
+
+
+@timed(STORAGE_SECONDS.labels("load"))
+def load_data() -> StorageEngine:
+    """Create the configured storage engine and replay persisted data"""
+    storage = create_storage()
+    storage.load()
+    return storage
+
+
+@timed(STORAGE_SECONDS.labels("snapshot"))
+def save_data(storage: StorageEngine) -> None:
+    """Write a compacted snapshot of the storage engine"""
     try:
-        if os.path.exists(settings.DATA_FILE):
-            with open(settings.DATA_FILE, 'r') as f:
-                url_storage = json.load(f)
-        
-        if os.path.exists(settings.STATS_FILE):
-            with open(settings.STATS_FILE, 'r') as f:
-                stats_storage = json.load(f)
-    except Exception as e:
-        print(f"Error loading data: {e}")
-    
-    return url_storage, stats_storage
-
-
-def save_data(url_storage: Dict[str, str], stats_storage: Dict[str, int]) -> None:
-    """Save data to JSON files"""
-    try:
-        # Ensure data directory exists
-        os.makedirs(os.path.dirname(settings.DATA_FILE), exist_ok=True)
-        
-        with open(settings.DATA_FILE, 'w') as f:
-            json.dump(url_storage, f)
-        
-        with open(settings.STATS_FILE, 'w') as f:
-            json.dump(stats_storage, f)
+        storage.compact()
     except Exception as e:
         print(f"Error saving data: {e}")
 
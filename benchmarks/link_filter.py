@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Benchmark: a storm of unknown short codes with and without the link filter
+
+Every request is for a different random code, as when a scanner walks the
+catch-all route, so the negative cache never helps and each miss is a
+storage read unless the link filter rules it out. Each backend runs in a
+fresh process, with the filter on and off, through the link cache as the
+redirect route uses it.
+
+Usage: python benchmarks/link_filter.py [--links N] [--requests N] [--error-rate R]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_links(count: int):
+    """Six-character codes and realistic-length URLs, as the allocator makes"""
+    for i in range(count):
+        yield f"{i:06x}", f"https://example.com/articles/{i}?utm_source=newsletter"
+
+
+def unknown_codes(count: int):
+    """Random seven-character codes, which are never stored"""
+    rng = random.Random(1)
+    alphabet = string.ascii_letters + string.digits
+    return ["".join(rng.choice(alphabet) for _ in range(7)) for _ in range(count)]
+
+
+def open_engine(backend: str, data_dir: str, error_rate):
+    """Open a seeded engine; its filter is sized for twice the stored links"""
+    from app.storage import MappedLogStorageEngine, SQLiteStorageEngine
+
+    if backend == "sqlite":
+        return SQLiteStorageEngine(
+            os.path.join(data_dir, "links.db"), filter_error_rate=error_rate, filter_capacity=0
+        )
+    return MappedLogStorageEngine(
+        snapshot_file=os.path.join(data_dir, "links.idx"),
+        log_file=os.path.join(data_dir, "events.log"),
+        filter_error_rate=error_rate,
+        filter_capacity=0,
+    )
+
+
+def seed(backend: str, data_dir: str, links: int) -> None:
+    sys.path.insert(0, ROOT)
+    engine = open_engine(backend, data_dir, None)
+    engine.load()
+    batch = list(make_links(links))
+    for start in range(0, links, 10000):
+        chunk = batch[start:start + 10000]
+        engine.add_links(chunk, [None] * len(chunk))
+    engine.compact()
+    engine.close()
+
+
+async def storm(link_cache, codes) -> float:
+    """Look up every code once, a few at a time; return lookups/s"""
+    async def worker(chunk):
+        for short_code in chunk:
+            await link_cache.get(short_code)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(codes[i::16]) for i in range(16)))
+    return len(codes) / (time.perf_counter() - start)
+
+
+def run_worker(backend: str, data_dir: str, requests: int, error_rate) -> dict:
+    sys.path.insert(0, ROOT)
+    from app.link_cache import LinkCache
+
+    engine = open_engine(backend, data_dir, error_rate)
+    start = time.perf_counter()
+    engine.load()
+    while not engine.build_filter():
+        pass
+    build_seconds = time.perf_counter() - start
+
+    reads = []
+    get_link = engine.get_link
+
+    def counting_get_link(short_code):
+        reads.append(short_code)
+        return get_link(short_code)
+
+    engine.get_link = counting_get_link
+    link_cache = LinkCache()
+    link_cache.bind(engine)
+    codes = unknown_codes(requests)
+    rps = asyncio.run(storm(link_cache, codes))
+    engine.close()
+
+    link_filter = engine.link_filter
+    return {
+        "lookups_per_second": rps,
+        "storage_reads": len(reads),
+        "false_positive_rate": len(reads) / requests,
+        "filter_bytes": link_filter.stats()["bytes"] if link_filter is not None else 0,
+        "load_seconds": build_seconds,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--links", type=int, default=200000)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--error-rate", type=float, default=0.01)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--seed", help=argparse.SUPPRESS)
+    parser.add_argument("--data-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--filter", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.seed:
+        seed(args.seed, args.data_dir, args.links)
+        return
+    if args.worker:
+        error_rate = args.error_rate if args.filter else None
+        print(json.dumps(run_worker(args.worker, args.data_dir, args.requests, error_rate)))
+        return
+
+    print(f"{args.links} links, {args.requests} unknown codes, filter error rate {args.error_rate}")
+    print(f"{'backend':>8} {'filter':>6} {'lookups/s':>10} {'reads':>7} {'fp rate':>8} "
+          f"{'filter MB':>9} {'bytes/link':>10} {'load s':>7}")
+    for backend in ("sqlite", "mmap"):
+        with tempfile.TemporaryDirectory() as data_dir:
+            subprocess.run(
+                [sys.executable, __file__, "--seed", backend, "--data-dir", data_dir,
+                 "--links", str(args.links)],
+                check=True,
+            )
+            for use_filter in (False, True):
+                command = [
+                    sys.executable, __file__, "--worker", backend, "--data-dir", data_dir,
+                    "--requests", str(args.requests), "--error-rate", str(args.error_rate),
+                ]
+                if use_filter:
+                    command.append("--filter")
+                output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                print(
+                    f"{backend:>8} {'on' if use_filter else 'off':>6} "
+                    f"{result['lookups_per_second']:>10.0f} {result['storage_reads']:>7} "
+                    f"{result['false_positive_rate']:>8.4f} {result['filter_bytes'] / 1e6:>9.2f} "
+                    f"{result['filter_bytes'] / args.links:>10.2f} {result['load_seconds']:>7.2f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Benchmark: memory per link and lookup cost of the in-memory link tables
+
+Each table is filled with the same synthetic links in a fresh process;
+memory is what tracemalloc attributes to the table, divided by the
+number of links.
+
+Usage: python benchmarks/link_memory.py [--links N] [--lookups N]
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_links(count: int):
+    """Six-character codes and realistic-length URLs, as the allocator makes"""
+    for i in range(count):
+        yield f"{i:06x}", f"https://example.com/articles/{i}?utm_source=newsletter"
+
+
+def run_worker(table_name: str, links: int, lookups: int) -> dict:
+    sys.path.insert(0, ROOT)
+    from app.link_table import LINK_TABLES
+
+    tracemalloc.start()
+    table = LINK_TABLES[table_name]()
+    for short_code, url in make_links(links):
+        table.add(short_code, url)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    codes = [short_code for short_code, _ in make_links(links)]
+    sample = [random.choice(codes) for _ in range(lookups)]
+    get_url = table.get_url
+    start = time.perf_counter()
+    for short_code in sample:
+        get_url(short_code)
+    lookup_seconds = time.perf_counter() - start
+
+    return {
+        "bytes_per_link": memory / links,
+        "lookup_ns": lookup_seconds / lookups * 1e9,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--links", type=int, default=1000000)
+    parser.add_argument("--lookups", type=int, default=200000)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, args.links, args.lookups)))
+        return
+
+    url_bytes = sum(len(url) for _, url in make_links(min(args.links, 1000))) / min(args.links, 1000)
+    print(f"{args.links} links, average URL {url_bytes:.0f} bytes")
+    print(f"{'table':>8} {'bytes/link':>11} {'lookup ns':>10}")
+    for table_name in ("dict", "compact"):
+        output = subprocess.run(
+            [sys.executable, __file__, "--worker", table_name,
+             "--links", str(args.links), "--lookups", str(args.lookups)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{table_name:>8} {result['bytes_per_link']:>11.0f} {result['lookup_ns']:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""
+Benchmark: load test of the redirect, shorten and stats endpoints
+
+For each dataset size, seeds a fresh data directory through the storage
+engine, starts the app (a local uvicorn server, or in-process over ASGI),
+then drives GET /{short_code}, POST /shorten and GET /stats in turn with
+concurrent keep-alive clients. Reports RPS, p50/p99 latency and server
+RSS per endpoint, and saves them as JSON tagged with the git commit, so
+runs can be compared with --compare.
+
+Redirects pick codes uniformly at random from the whole dataset (with a
+fixed seed), so large datasets also measure cache misses.
+
+Usage: python benchmarks/load_test.py [--sizes 10000,1000000,10000000]
+           [--backend log] [--server uvicorn|inprocess] [--concurrency 50]
+           [--duration 10] [--output FILE] [--compare OLD.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+SEED_BATCH = 10000
+
+# (method, path, body) for one request
+Request = Tuple[str, str, Optional[bytes]]
+
+
+def link_code(i: int) -> str:
+    return f"b{i:07x}"
+
+
+def seed(links: int) -> None:
+    """Store ``links`` links with the engine configured by the environment"""
+    sys.path.insert(0, ROOT)
+    from app.utils import load_data
+
+    storage = load_data()
+    for start in range(0, links, SEED_BATCH):
+        storage.add_links([
+            (link_code(i), f"https://example.com/articles/{i}?utm_source=bench")
+            for i in range(start, min(start + SEED_BATCH, links))
+        ])
+    # Start the server from a snapshot, as a long-running deployment would
+    if hasattr(storage, "compact"):
+        storage.compact()
+    storage.close()
+
+
+def scenarios(links: int, rng: random.Random) -> Dict[str, Tuple[Callable[[], Request], int]]:
+    """Endpoint name -> (request factory, expected status)"""
+    counter = iter(range(10 ** 12))
+
+    def redirect() -> Request:
+        return "GET", "/" + link_code(rng.randrange(links)), None
+
+    def shorten() -> Request:
+        body = json.dumps({"url": f"https://example.com/new/{next(counter)}"})
+        return "POST", "/shorten", body.encode()
+
+    def stats() -> Request:
+        return "GET", "/stats", None
+
+    return {"redirect": (redirect, 302), "shorten": (shorten, 200), "stats": (stats, 200)}
+
+
+class HTTPClient:
+    """Minimal HTTP/1.1 keep-alive client, so the client is not the bottleneck"""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, method: str, path: str, body: Optional[bytes]) -> int:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+        if body is not None:
+            head += f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+        self.writer.write(head.encode() + b"\r\n" + (body or b""))
+
+        status_line = await self.reader.readline()
+        status = int(status_line.split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.partition(b":")
+            if name.lower() == b"content-length":
+                length = int(value)
+        if length and method != "HEAD":
+            await self.reader.readexactly(length)
+        return status
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+
+
+class ASGIClient:
+    """Sends requests straight to the ASGI app, without sockets"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method: str, path: str, body: Optional[bytes]) -> int:
+        status = 0
+        headers = [(b"host", b"localhost")]
+        if body is not None:
+            headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+
+        async def receive():
+            return {"type": "http.request", "body": body or b"", "more_body": False}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": b"",
+            "root_path": "",
+            "headers": headers,
+            "client": ("127.0.0.1", 50000),
+            "server": ("127.0.0.1", 8000),
+        }
+        await self.app(scope, receive, send)
+        return status
+
+    def close(self) -> None:
+        pass
+
+
+async def drive(
+    clients: list, make_request: Callable[[], Request], expected: int, duration: float
+) -> dict:
+    """Run every client in a loop for ``duration`` seconds; return RPS and latency percentiles"""
+    latencies: List[float] = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def loop(client) -> None:
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            method, path, body = make_request()
+            start = time.perf_counter()
+            try:
+                status = await client.request(method, path, body)
+            except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+                status = 0
+                client.close()
+                client.writer = None
+            latencies.append(time.perf_counter() - start)
+            if status != expected:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(loop(client) for client in clients))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+
+    def percentile(p: float) -> float:
+        return latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000 if latencies else 0.0
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(0.50),
+        "p90_ms": percentile(0.90),
+        "p99_ms": percentile(0.99),
+        "max_ms": latencies[-1] * 1000 if latencies else 0.0,
+    }
+
+
+def process_rss_mb(pid: int) -> float:
+    """Resident memory of a process and its children, from /proc (Linux only)"""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return total / 1024
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_ready(port: int, server: subprocess.Popen, timeout: float) -> float:
+    """Poll /health until the server answers; return seconds taken"""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if server.poll() is not None:
+            raise RuntimeError("server exited during startup")
+        client = HTTPClient("127.0.0.1", port)
+        try:
+            if await client.request("GET", "/health", None) == 200:
+                return time.perf_counter() - start
+        except OSError:
+            pass
+        finally:
+            client.close()
+        await asyncio.sleep(0.05)
+    raise RuntimeError(f"server not ready after {timeout} seconds")
+
+
+async def run_uvicorn(env: dict, links: int, args) -> List[dict]:
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(args.workers), "--no-access-log",
+         "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    try:
+        startup = await wait_ready(port, server, args.startup_timeout)
+        rng = random.Random(args.seed)
+        results = []
+        for endpoint, (make_request, expected) in scenarios(links, rng).items():
+            clients = [HTTPClient("127.0.0.1", port) for _ in range(args.concurrency)]
+            # Warm up connections and caches before timing
+            await drive(clients, make_request, expected, min(1.0, args.duration))
+            result = await drive(clients, make_request, expected, args.duration)
+            for client in clients:
+                client.close()
+            result.update(endpoint=endpoint, startup_seconds=startup, rss_mb=process_rss_mb(server.pid))
+            results.append(result)
+        return results
+    finally:
+        server.terminate()
+        server.wait()
+
+
+async def run_inprocess(links: int, args) -> List[dict]:
+    """Worker process: drive the app imported with this process's environment"""
+    sys.path.insert(0, ROOT)
+    start = time.perf_counter()
+    from app import main
+
+    await main.startup_event()
+    startup = time.perf_counter() - start
+    rng = random.Random(args.seed)
+    results = []
+    for endpoint, (make_request, expected) in scenarios(links, rng).items():
+        clients = [ASGIClient(main.app) for _ in range(args.concurrency)]
+        await drive(clients, make_request, expected, min(1.0, args.duration))
+        result = await drive(clients, make_request, expected, args.duration)
+        result.update(
+            endpoint=endpoint,
+            startup_seconds=startup,
+            # Includes the client, which shares this process
+            rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        )
+        results.append(result)
+    await main.shutdown_event()
+    return results
+
+
+def git_commit() -> Tuple[str, bool]:
+    """Current commit, and whether the tree has uncommitted changes"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+
+
+def compare(old_path: str, rows: List[dict]) -> None:
+    """Print RPS and p99 changes against an earlier results file"""
+    with open(old_path) as f:
+        old = json.load(f)
+    previous = {(row["links"], row["backend"], row["endpoint"]): row for row in old["results"]}
+    print(f"\ncompared with {old['commit']} ({old['timestamp']}):")
+    for row in rows:
+        before = previous.get((row["links"], row["backend"], row["endpoint"]))
+        if before is None:
+            continue
+        rps = (row["rps"] / before["rps"] - 1) * 100 if before["rps"] else 0.0
+        p99 = (row["p99_ms"] / before["p99_ms"] - 1) * 100 if before["p99_ms"] else 0.0
+        print(f"{row['links']:>10} {row['backend']:>7} {row['endpoint']:>9}  rps {rps:+6.1f}%  p99 {p99:+6.1f}%")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--sizes", default="10000,1000000", help="comma-separated link counts")
+    parser.add_argument("--backend", default="log", help="STORAGE_BACKEND; comma-separated to compare")
+    parser.add_argument("--server", choices=("uvicorn", "inprocess"), default="uvicorn")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per endpoint")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--startup-timeout", type=float, default=600.0)
+    parser.add_argument("--output", help="results file; defaults to benchmarks/results/")
+    parser.add_argument("--compare", help="earlier results file to compare with")
+    parser.add_argument("--seed-links", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--inprocess-links", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.seed_links is not None:
+        seed(args.seed_links)
+        return
+    if args.inprocess_links is not None:
+        print(json.dumps(asyncio.run(run_inprocess(args.inprocess_links, args))))
+        return
+
+    rows = []
+    print(
+        f"{'links':>10} {'backend':>7} {'endpoint':>9} {'rps':>9} {'p50 ms':>8} "
+        f"{'p99 ms':>8} {'errors':>7} {'RSS MB':>7} {'startup s':>9}"
+    )
+    for links in [int(size) for size in args.sizes.split(",")]:
+        for backend in args.backend.split(","):
+            with tempfile.TemporaryDirectory() as data_dir:
+                env = dict(
+                    os.environ,
+                    DATA_DIR=data_dir,
+                    STORAGE_BACKEND=backend,
+                    WORKERS=str(args.workers),
+                    # Keep the shorten phase from reusing codes or being
+                    # throttled, and the data set from being snapshotted mid-run
+                    DEDUPE_URLS="false",
+                    RATE_LIMIT_ENABLED="false",
+                    SNAPSHOT_INTERVAL=str(10 ** 9),
+                )
+                # Seeded in a child, so neither the server nor in-process
+                # workers inherit its memory
+                subprocess.run(
+                    [sys.executable, __file__, "--seed-links", str(links)], env=env, check=True
+                )
+                if args.server == "uvicorn":
+                    results = asyncio.run(run_uvicorn(env, links, args))
+                else:
+                    output = subprocess.run(
+                        [sys.executable, __file__, "--inprocess-links", str(links),
+                         "--concurrency", str(args.concurrency), "--duration", str(args.duration),
+                         "--seed", str(args.seed)],
+                        env=env, check=True, capture_output=True, text=True,
+                    ).stdout
+                    results = json.loads(output.strip().splitlines()[-1])
+            for result in results:
+                row = {"links": links, "backend": backend, **result}
+                rows.append(row)
+                print(
+                    f"{links:>10} {backend:>7} {row['endpoint']:>9} {row['rps']:>9.0f} "
+                    f"{row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f} {row['errors']:>7} "
+                    f"{row['rss_mb']:>7.0f} {row['startup_seconds']:>9.2f}"
+                )
+
+    commit, dirty = git_commit()
+    timestamp = time.strftime("%Y%m%dT%H%M%S")
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": timestamp,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": {
+            "server": args.server,
+            "workers": args.workers,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "seed": args.seed,
+        },
+        "results": rows,
+    }
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"load-{commit}{'-dirty' if dirty else ''}-{timestamp}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nresults written to {output}")
+
+    if args.compare:
+        compare(args.compare, rows)
+
+
+if __name__ == "__main__":
+    main()
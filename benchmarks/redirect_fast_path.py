@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Benchmark: redirect throughput with and without the ASGI fast path
+
+Drives the ASGI app in-process (no sockets), so the numbers isolate
+framework overhead: routing, validation and response construction. The
+fast path is also run with metrics off, to check the cost of timing each
+redirect against a budget.
+
+Usage: python benchmarks/redirect_fast_path.py [--requests N] [--links N] [--metrics-budget PCT]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def drive(app, codes, requests: int) -> float:
+    """Send GET /{code} requests straight to the ASGI app; return req/s"""
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    statuses = []
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    def scope(code):
+        return {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": f"/{code}",
+            "raw_path": f"/{code}".encode(),
+            "query_string": b"",
+            "root_path": "",
+            "headers": [(b"host", b"localhost")],
+            "client": ("127.0.0.1", 50000),
+            "server": ("127.0.0.1", 8000),
+        }
+
+    scopes = [scope(code) for code in codes]
+    start = time.perf_counter()
+    for i in range(requests):
+        await app(scopes[i % len(scopes)], receive, send)
+    elapsed = time.perf_counter() - start
+
+    assert all(status == 302 for status in statuses), "unexpected status"
+    return requests / elapsed
+
+
+async def run_worker(requests: int, links: int) -> dict:
+    sys.path.insert(0, ROOT)
+    from app import main
+
+    await main.startup_event()
+    codes = [f"bench{i}" for i in range(links)]
+    await main.storage_io.run(
+        main.storage.add_links, [(code, f"https://example.com/{code}") for code in codes]
+    )
+    # Warm up caches before timing
+    await drive(main.app, codes, min(requests, links))
+    rps = await drive(main.app, codes, requests)
+    await main.shutdown_event()
+    return {
+        "fast_redirect": main.settings.FAST_REDIRECT,
+        "metrics": main.settings.METRICS_ENABLED,
+        "requests_per_sec": rps,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--links", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per mode; the best is kept")
+    parser.add_argument(
+        "--metrics-budget", type=float, default=5.0,
+        help="max fast path slowdown from metrics, in percent",
+    )
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        result = asyncio.run(run_worker(args.requests, args.links))
+        print(json.dumps(result))
+        return
+
+    # Settings are read at import, so each mode runs in a fresh process
+    modes = {
+        "route": {"FAST_REDIRECT": "false", "METRICS_ENABLED": "true"},
+        "fast": {"FAST_REDIRECT": "true", "METRICS_ENABLED": "true"},
+        "fast_no_metrics": {"FAST_REDIRECT": "true", "METRICS_ENABLED": "false"},
+    }
+    results = {name: 0.0 for name in modes}
+    # Interleave modes so drift in machine load hits each of them alike
+    for _ in range(args.repeat):
+        for name, overrides in modes.items():
+            with tempfile.TemporaryDirectory() as data_dir:
+                env = dict(os.environ, DATA_DIR=data_dir, **overrides)
+                output = subprocess.run(
+                    [sys.executable, __file__, "--worker",
+                     "--requests", str(args.requests), "--links", str(args.links)],
+                    env=env, check=True, capture_output=True, text=True,
+                ).stdout
+                rps = json.loads(output.strip().splitlines()[-1])["requests_per_sec"]
+                results[name] = max(results[name], rps)
+
+    baseline = results["route"]
+    fast = results["fast"]
+    overhead = (results["fast_no_metrics"] / fast - 1) * 100
+    print(f"redirect_url route: {baseline:10.0f} req/s")
+    print(f"ASGI fast path:     {fast:10.0f} req/s")
+    print(f"speedup:            {fast / baseline:10.2f}x")
+    print(f"fast path, metrics off: {results['fast_no_metrics']:6.0f} req/s")
+    print(f"metrics overhead:   {overhead:9.1f}% (budget {args.metrics_budget:.1f}%)")
+    if overhead > args.metrics_budget:
+        sys.exit("metrics overhead is over budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Benchmark: log storage startup time against dataset size
+
+For each size, writes a snapshot of that many links in the current
+line-oriented format, as the earlier single JSON document and as the
+memory-mapped index of the "mmap" backend, plus a short event log, then
+times the engine's load() for each in a fresh process and reports its peak
+RSS.
+
+Usage: python benchmarks/startup.py [--sizes 1000000,10000000] [--log-events N]
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app.link_index import write_index  # noqa: E402
+from app.snapshot import write_snapshot  # noqa: E402
+
+
+def build_dataset(data_dir: str, links: int, log_events: int) -> None:
+    """Write every snapshot format and an event log for ``links`` links"""
+    urls = {f"c{i:07x}": f"https://example.com/articles/{i}?utm_source=bench" for i in range(links)}
+    clicks = {code: i % 100 for i, code in enumerate(urls)}
+    rows = [(code, url, clicks[code]) for code, url in urls.items()]
+    write_snapshot(os.path.join(data_dir, "snapshot.dat"), {"generation": 1, "links": rows, "next_id": links})
+    write_index(os.path.join(data_dir, "links.idx"), 1, links, rows)
+    with open(os.path.join(data_dir, "snapshot.json"), "w") as f:
+        snapshot = {"generation": 1, "urls": urls, "clicks": clicks, "next_id": links}
+        json.dump(snapshot, f, separators=(",", ":"))
+    with open(os.path.join(data_dir, "events.log"), "w") as f:
+        f.write('["G",1]\n')
+        for i in range(log_events):
+            f.write(json.dumps(["C", f"c{i % max(links, 1):07x}", 1], separators=(",", ":")) + "\n")
+
+
+def run_worker(data_dir: str, snapshot_name: str) -> dict:
+    from app.storage import LogStorageEngine, MappedLogStorageEngine
+
+    engine_class = MappedLogStorageEngine if snapshot_name.endswith(".idx") else LogStorageEngine
+    engine = engine_class(
+        snapshot_file=os.path.join(data_dir, snapshot_name),
+        log_file=os.path.join(data_dir, "events.log"),
+    )
+    start = time.perf_counter()
+    engine.load()
+    elapsed = time.perf_counter() - start
+    links = engine.count_links()
+    engine.close()
+    return {
+        "seconds": elapsed,
+        "links": links,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--sizes", default="100000,1000000")
+    parser.add_argument("--log-events", type=int, default=10000)
+    parser.add_argument("--worker", nargs=2, metavar=("DATA_DIR", "SNAPSHOT"), help=argparse.SUPPRESS)
+    parser.add_argument("--build", nargs=2, metavar=("DATA_DIR", "LINKS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(*args.worker)))
+        return
+    if args.build:
+        build_dataset(args.build[0], int(args.build[1]), args.log_events)
+        return
+
+    print(f"{'links':>10} {'format':>7} {'size MB':>8} {'load s':>8} {'peak RSS MB':>12}")
+    for links in [int(size) for size in args.sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as data_dir:
+            # Built in a child too: workers would otherwise inherit this
+            # process's peak RSS from the fork
+            subprocess.run(
+                [sys.executable, __file__, "--build", data_dir, str(links),
+                 "--log-events", str(args.log_events)],
+                check=True,
+            )
+            formats = (("lines", "snapshot.dat"), ("json", "snapshot.json"), ("mmap", "links.idx"))
+            for label, snapshot_name in formats:
+                # A fresh process, so RSS and caches belong to this load alone
+                output = subprocess.run(
+                    [sys.executable, __file__, "--worker", data_dir, snapshot_name],
+                    check=True, capture_output=True, text=True,
+                ).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                assert result["links"] == links, "snapshot did not load completely"
+                size = os.path.getsize(os.path.join(data_dir, snapshot_name)) / 2**20
+                print(
+                    f"{links:>10} {label:>7} {size:>8.1f} {result['seconds']:>8.2f} "
+                    f"{result['peak_rss_mb']:>12.0f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Benchmark: cost of URL normalization on link creation
+
+Times the prefix check against the normalizer per URL, with a large
+blocked-domain list, then create throughput with normalization off and
+on, through /shorten and through bulk batches; bulk is the worst case,
+since a batched insert costs far less than a request. URLs are mostly
+plain, with some needing their host, IDNA or percent-encoding fixed, as
+pasted URLs are. With --dedupe, creates also look each URL up, as with
+DEDUPE_URLS=true.
+
+Usage: python benchmarks/url_normalize.py [--urls N] [--blocked N] [--dedupe]
+       [--budget PCT] [--bulk-budget PCT]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TEMPLATES = (
+    "https://example.com/articles/{i}?utm_source=newsletter&utm_medium=email",
+    "https://www.example.org/search?q=item+{i}&page=2",
+    "http://shop.example.net/products/{i}/reviews#top",
+    "https://Docs.Example.COM:443/Guide/Section-{i}",
+    "https://example.com/files/report%20{i}%2epdf",
+    "https://bücher.example/katalog/{i}?titel=straße",
+)
+
+
+def make_urls(count: int):
+    """Mostly plain URLs; three in thirteen need their case, port, escapes or IDNA fixed"""
+    rng = random.Random(1)
+    weights = (5, 3, 2, 1, 1, 1)
+    return [rng.choices(TEMPLATES, weights)[0].format(i=i) for i in range(count)]
+
+
+def blocked_domains(count: int):
+    return [f"blocked{i}.example.com" for i in range(count)]
+
+
+def run_validation(urls, blocked: int) -> dict:
+    """Per-URL cost of the prefix check and of the normalizer"""
+    sys.path.insert(0, ROOT)
+    from app.normalize import URLNormalizer
+    from app.utils import is_valid_url
+
+    normalizer = URLNormalizer(blocked_domains(blocked))
+    results = {}
+    for name, check in (("prefix check", is_valid_url), ("normalizer", normalizer.normalize)):
+        start = time.perf_counter()
+        for url in urls:
+            check(url)
+        results[name] = (time.perf_counter() - start) / len(urls) * 1e6
+    return results
+
+
+async def shorten_requests(app, urls) -> float:
+    """POST each URL to /shorten straight through the ASGI app; return seconds taken"""
+    statuses = []
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/shorten",
+        "raw_path": b"/shorten",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"localhost"), (b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 50000),
+        "server": ("127.0.0.1", 8000),
+    }
+    bodies = [json.dumps({"url": url}).encode() for url in urls]
+    start = time.perf_counter()
+    for body in bodies:
+        async def receive(body=body):
+            return {"type": "http.request", "body": body, "more_body": False}
+        await app(scope, receive, send)
+    elapsed = time.perf_counter() - start
+
+    assert all(status == 200 for status in statuses), "unexpected status"
+    return elapsed
+
+
+async def run_worker(urls, batch_size: int, blocked: int) -> dict:
+    """
+    Create every URL through /shorten, then again through bulk batches,
+    interleaving batches with the normalizer off and on (off, on, on,
+    off) so drift in machine load and storage size hits both modes alike.
+    """
+    sys.path.insert(0, ROOT)
+    from app import main, utils
+    from app.config import settings
+    from app.bulk import shorten_batch
+    from app.normalize import URLNormalizer
+
+    await main.startup_event()
+    normalizers = {"off": None, "on": URLNormalizer(blocked_domains(blocked))}
+    results = {}
+    for endpoint in ("shorten", "bulk"):
+        seconds = {name: 0.0 for name in normalizers}
+        for batch, index in enumerate(range(0, len(urls), batch_size)):
+            name = ("off", "on", "on", "off")[batch % 4]
+            utils.url_normalizer = normalizers[name]
+            chunk = urls[index:index + batch_size]
+            if endpoint == "shorten":
+                seconds[name] += await shorten_requests(main.app, chunk)
+                continue
+            items = [{"url": url} for url in chunk]
+            start = time.perf_counter()
+            lines = shorten_batch(
+                main.storage, main.allocator, items, index, "http://localhost", settings.DEDUPE_URLS
+            )
+            seconds[name] += time.perf_counter() - start
+            assert all('"short_code"' in line for line in lines), lines[0]
+        for name in normalizers:
+            results[f"{endpoint}_{name}"] = len(urls) / 2 / seconds[name]
+    await main.shutdown_event()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--urls", type=int, default=20000)
+    parser.add_argument("--blocked", type=int, default=100000, help="blocked domains")
+    parser.add_argument("--batch-size", type=int, default=250)
+    parser.add_argument("--repeat", type=int, default=3, help="runs; the best of each mode is kept")
+    parser.add_argument(
+        "--budget", type=float, default=10.0,
+        help="max /shorten slowdown from normalization, in percent",
+    )
+    parser.add_argument(
+        "--bulk-budget", type=float, default=30.0,
+        help="max bulk slowdown from normalization, in percent",
+    )
+    parser.add_argument("--dedupe", action="store_true", help="look each URL up, as DEDUPE_URLS does")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    urls = make_urls(args.urls)
+    if args.worker:
+        print(json.dumps(asyncio.run(run_worker(urls, args.batch_size, args.blocked))))
+        return
+
+    for name, micros in run_validation(urls, args.blocked).items():
+        print(f"{name + ':':<20}{micros:8.2f} us/url")
+
+    results = {}
+    for _ in range(args.repeat):
+        with tempfile.TemporaryDirectory() as data_dir:
+            env = dict(
+                os.environ, DATA_DIR=data_dir, METRICS_ENABLED="false", RATE_LIMIT_ENABLED="false"
+            )
+            output = subprocess.run(
+                [sys.executable, __file__, "--worker", "--urls", str(args.urls),
+                 "--batch-size", str(args.batch_size), "--blocked", str(args.blocked)],
+                env=dict(env, DEDUPE_URLS=str(args.dedupe).lower()), check=True, capture_output=True, text=True,
+            ).stdout
+            for name, rate in json.loads(output.strip().splitlines()[-1]).items():
+                results[name] = max(results.get(name, 0.0), rate)
+
+    overheads = {}
+    for endpoint in ("shorten", "bulk"):
+        off, on = results[f"{endpoint}_off"], results[f"{endpoint}_on"]
+        overheads[endpoint] = (off / on - 1) * 100
+        print(f"{endpoint:<8} off: {off:8.0f} /s  on: {on:8.0f} /s  overhead: {overheads[endpoint]:5.1f}%")
+    print(f"overhead budget: /shorten {args.budget:.1f}%, bulk {args.bulk_budget:.1f}%")
+    if overheads["shorten"] > args.budget:
+        sys.exit("normalization overhead on /shorten is over budget")
+    if overheads["bulk"] > args.bulk_budget:
+        sys.exit("normalization overhead on bulk batches is over budget")
+
+
+if __name__ == "__main__":
+    main()
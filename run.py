@@ -10,6 +10,7 @@ if __name__ == "__main__":
     print(f"🚀 Starting URL Shortener on http://{settings.HOST}:{settings.PORT}")
     print(f"📁 Data directory: {settings.DATA_DIR}")
     print(f"🔧 Debug mode: {settings.DEBUG}")
+    print(f"👷 Workers: {settings.WORKERS}")
     
     try:
         uvicorn.run(
@@ -17,6 +18,7 @@ if __name__ == "__main__":
             host=settings.HOST,
             port=settings.PORT,
             reload=settings.DEBUG,
+            workers=1 if settings.DEBUG else settings.WORKERS,
             log_level="info",
             access_log=True
         )
@@ -0,0 +1,53 @@
+"""
+Fixtures shared by the tests
+"""
+
+import pytest
+import pytest_asyncio
+
+from app.config import settings
+from app.storage import LogStorageEngine, MappedLogStorageEngine, SQLiteStorageEngine
+from app.storage_io import StorageIO
+
+
+@pytest.fixture
+def storage(request, tmp_path, monkeypatch):
+    """
+    A loaded storage engine in an empty directory.
+
+    Parametrize indirectly with engine options, e.g. ``{"dedupe": True}``;
+    ``"engine"`` picks the class, LogStorageEngine by default.
+    """
+    # Keep imports of older data away from the working directory
+    for name, file_name in (
+        ("DATA_FILE", "url_data.json"),
+        ("STATS_FILE", "stats_data.json"),
+        ("SNAPSHOT_FILE", "snapshot.dat"),
+        ("LEGACY_SNAPSHOT_FILE", "snapshot.json"),
+        ("LOG_FILE", "events.log"),
+        ("INDEX_FILE", "links.idx"),
+    ):
+        monkeypatch.setattr(settings, name, str(tmp_path / file_name))
+    options = dict(getattr(request, "param", {}))
+    engine_class = options.pop("engine", LogStorageEngine)
+    if engine_class is SQLiteStorageEngine:
+        engine = engine_class(str(tmp_path / "links.db"), **options)
+    else:
+        snapshot_name = "links.idx" if engine_class is MappedLogStorageEngine else "snapshot.dat"
+        engine = engine_class(
+            snapshot_file=str(tmp_path / snapshot_name),
+            log_file=str(tmp_path / "events.log"),
+            **options,
+        )
+    engine.load()
+    yield engine
+    engine.close()
+
+
+@pytest_asyncio.fixture
+async def io(request):
+    """A running storage I/O thread; parametrize indirectly with its queue size"""
+    storage_io = StorageIO(max_pending=getattr(request, "param", 1024))
+    storage_io.start()
+    yield storage_io
+    await storage_io.stop()
@@ -0,0 +1,88 @@
+"""
+Tests for short code allocation
+"""
+
+import pytest
+
+from app import allocator as allocator_module
+from app.allocator import CounterAllocator, FeistelPermutation, RandomAllocator
+from app.storage import LogStorageEngine, SQLiteStorageEngine
+
+
+def open_twin(storage):
+    """A second worker's engine on the same files"""
+    if isinstance(storage, SQLiteStorageEngine):
+        twin = SQLiteStorageEngine(storage.path)
+    else:
+        twin = LogStorageEngine(
+            snapshot_file=storage.snapshot_file,
+            log_file=storage.log_file,
+            shared=True,
+        )
+    twin.load()
+    return twin
+
+
+@pytest.mark.parametrize("size", [1, 5, 62, 1000, 3844])
+def test_feistel_permutation_is_a_bijection(size):
+    permutation = FeistelPermutation(b"key", size)
+    values = [permutation.permute(value) for value in range(size)]
+    assert sorted(values) == list(range(size))
+
+
+def test_feistel_permutation_depends_on_the_key():
+    a = FeistelPermutation(b"one", 1000)
+    b = FeistelPermutation(b"two", 1000)
+    assert [a.permute(v) for v in range(20)] != [b.permute(v) for v in range(20)]
+
+
+@pytest.mark.parametrize("scramble_key", [None, "secret"])
+def test_counter_codes_are_unique_across_lengths(storage, scramble_key):
+    allocator = CounterAllocator(storage, length=2, block_size=500, scramble_key=scramble_key)
+    # All of the 3844 two-character codes, then the first three-character ones
+    codes = [allocator.encode(value) for value in range(62 ** 2 + 500)]
+    assert len(set(codes)) == len(codes)
+    assert {len(code) for code in codes[:62 ** 2]} == {2}
+    assert {len(code) for code in codes[62 ** 2:]} == {3}
+
+
+@pytest.mark.parametrize(
+    "storage", [{"shared": True}, {"engine": SQLiteStorageEngine}], indirect=True
+)
+def test_counter_workers_lease_disjoint_blocks(storage):
+    twin = open_twin(storage)
+    try:
+        a = CounterAllocator(storage, block_size=10)
+        b = CounterAllocator(twin, block_size=10)
+        codes = [allocator.create(f"https://example.com/{i}") for i in range(25) for allocator in (a, b)]
+        assert len(set(codes)) == 50
+        assert a.collisions == b.collisions == 0
+    finally:
+        twin.close()
+
+
+def test_counter_skips_taken_and_reserved_codes(storage, monkeypatch):
+    allocator = CounterAllocator(storage, length=2, block_size=10)
+    taken, reserved = allocator.encode(0), allocator.encode(1)
+    storage.add_link(taken, "https://custom.example/")
+    monkeypatch.setattr(allocator_module, "RESERVED_CODES", {reserved})
+    assert allocator.next_code() == allocator.encode(2)
+    assert allocator.collisions == 2
+
+
+def test_random_allocator_grows_after_max_attempts(storage, monkeypatch):
+    storage.add_link("aa", "https://a.example/")
+    monkeypatch.setattr(allocator_module, "generate_short_code", lambda length: "a" * length)
+    allocator = RandomAllocator(storage, length=2, max_attempts=3)
+    assert allocator.create("https://b.example/") == "aaa"
+    assert allocator.length == 3
+    assert allocator.collisions == 3
+
+
+def test_random_allocator_skips_reserved_codes(storage, monkeypatch):
+    candidates = iter(["api", "api", "xyz"])
+    monkeypatch.setattr(allocator_module, "generate_short_code", lambda length: next(candidates))
+    monkeypatch.setattr(allocator_module, "RESERVED_CODES", {"api"})
+    allocator = RandomAllocator(storage, length=3, max_attempts=8)
+    assert allocator.next_code() == "xyz"
+    assert allocator.collisions == 2
@@ -0,0 +1,71 @@
+"""
+Tests for per-link click time series
+"""
+
+import random
+from collections import Counter
+
+import pytest
+
+from app.analytics import RANGES, ClickAnalytics, LinkSeries
+
+
+def expected_buckets(events, minute, range_name):
+    """Per-bucket sums of (minute, count) events, computed the slow way"""
+    resolution, count = RANGES[range_name]
+    size = {"minute": 1, "hour": 60, "day": 1440}[resolution]
+    current = minute // size
+    totals = Counter()
+    for event_minute, clicks in events:
+        totals[event_minute // size] += clicks
+    return [totals[bucket] for bucket in range(current - count + 1, current + 1)]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_query_matches_reference(seed):
+    rnd = random.Random(seed)
+    analytics = ClickAnalytics(max_links=10, days=90)
+    events = []
+    minute = rnd.randrange(10**7)
+    for _ in range(3000):
+        # Mostly steady traffic, with the odd gap of hours or days
+        minute += rnd.choice([0, 1, 1, 2, 5, 30, 61, 600, 1440, 3000])
+        clicks = rnd.randint(1, 50)
+        analytics.record({"a": clicks}, now=minute * 60 + 30)
+        events.append((minute, clicks))
+        if rnd.random() < 0.05:
+            for range_name in RANGES:
+                result = analytics.query("a", range_name, now=minute * 60 + 59)
+                assert [b["clicks"] for b in result["buckets"]] == expected_buckets(events, minute, range_name)
+
+
+def test_counters_widen_on_overflow():
+    series = LinkSeries(days=7, minute=0)
+    assert series.counts.typecode == "H"
+    series.add(0, 60000)
+    series.add(1, 60000)
+    # The hour roll-up no longer fits in 16 bits
+    series.add(60, 1)
+    assert series.counts.typecode == "I"
+    assert series.by_hour(60, 2) == [120000, 1]
+    assert series.by_minute(1, 2) == [60000, 60000]
+
+
+def test_untracked_and_evicted_links():
+    analytics = ClickAnalytics(max_links=2, days=7)
+    analytics.record({"a": 1}, now=600)
+    analytics.record({"b": 1}, now=660)
+    analytics.record({"c": 1}, now=720)
+
+    result = analytics.query("a", "1h", now=720)
+    assert result["clicks"] == 0
+    assert result["tracked_since"] is None
+    result = analytics.query("c", "1h", now=720)
+    assert result["clicks"] == 1
+    assert result["tracked_since"] == "1970-01-01T00:12:00+00:00"
+
+
+def test_range_beyond_retention():
+    analytics = ClickAnalytics(days=7)
+    with pytest.raises(ValueError):
+        analytics.query("a", "30d")
@@ -0,0 +1,203 @@
+"""
+Tests for the HTTP API, run in-process through httpx
+"""
+
+import json
+import threading
+
+import httpx
+import pytest
+import pytest_asyncio
+
+from app import main
+from app.config import settings
+from app.rate_limit import RateLimiter
+
+
+@pytest_asyncio.fixture
+async def client(tmp_path, monkeypatch):
+    """Start the app on an empty data directory"""
+    for name, file_name in (
+        ("DATA_FILE", "url_data.json"),
+        ("STATS_FILE", "stats_data.json"),
+        ("SNAPSHOT_FILE", "snapshot.dat"),
+        ("LEGACY_SNAPSHOT_FILE", "snapshot.json"),
+        ("LOG_FILE", "events.log"),
+        ("INDEX_FILE", "links.idx"),
+    ):
+        monkeypatch.setattr(settings, name, str(tmp_path / file_name))
+    monkeypatch.setattr(settings, "STORAGE_BACKEND", "log")
+    monkeypatch.setattr(settings, "SHARED_STORAGE", False)
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", False)
+    await main.startup_event()
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://sho.rt") as client:
+        yield client
+    await main.shutdown_event()
+    main.background_tasks.clear()
+
+
+async def shorten(client, url, **fields):
+    return await client.post("/shorten", json={"url": url, **fields})
+
+
+@pytest.mark.asyncio
+async def test_shorten_and_redirect(client):
+    response = await shorten(client, "https://example.com/a")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["short_url"] == f"http://sho.rt/{body['short_code']}"
+    assert body["original_url"] == "https://example.com/a"
+
+    redirect = await client.get(f"/{body['short_code']}")
+    assert redirect.status_code == 302
+    assert redirect.headers["location"] == "https://example.com/a"
+
+    stats = (await client.get(f"/stats/{body['short_code']}")).json()
+    assert stats["total_clicks"] == 1
+    assert (await client.get("/stats")).json() == {"total_urls": 1, "total_clicks": 1}
+
+
+@pytest.mark.asyncio
+async def test_stats_range(client):
+    short_code = (await shorten(client, "https://example.com/")).json()["short_code"]
+    week = await client.get(f"/stats/{short_code}", params={"range": "7d"})
+    assert week.status_code == 200
+    assert week.json()["range"] == "7d"
+    bogus = await client.get(f"/stats/{short_code}", params={"range": "1y"})
+    assert bogus.status_code == 400
+    assert bogus.json()["detail"].startswith("Range must be one of")
+
+
+@pytest.mark.asyncio
+async def test_custom_codes(client):
+    assert (await shorten(client, "https://example.com/", custom_code="mine")).status_code == 200
+    taken = await shorten(client, "https://example.com/", custom_code="mine")
+    assert taken.status_code == 400
+    assert taken.json()["detail"] == "Custom code already exists"
+    reserved = await shorten(client, "https://example.com/", custom_code="stats")
+    assert reserved.json()["detail"] == "Custom code is reserved"
+
+
+@pytest.mark.asyncio
+async def test_rejects_invalid_requests(client):
+    assert (await shorten(client, "ftp://example.com/")).status_code == 400
+    assert (await shorten(client, "https://example.com/", max_clicks=0)).status_code == 400
+    assert (await client.get("/nope")).status_code == 404
+    assert (await client.get("/stats/nope")).status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_capped_link_stops_redirecting(client):
+    short_code = (await shorten(client, "https://example.com/", max_clicks=1)).json()["short_code"]
+    assert (await client.get(f"/{short_code}")).status_code == 302
+    assert (await client.get(f"/{short_code}")).status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_bulk_streams_one_line_per_item(client):
+    items = [{"url": "https://example.com/1"}, {"url": "bad"}, {"url": "https://example.com/2"}]
+    response = await client.post("/shorten/bulk", json=items)
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[1] == {"index": 1, "detail": "Invalid URL format"}
+    for line in (lines[0], lines[2]):
+        assert (await client.get(f"/{line['short_code']}")).status_code == 302
+
+    ndjson = "\n".join(json.dumps(item) for item in items)
+    response = await client.post(
+        "/shorten/bulk", content=ndjson, headers={"content-type": "application/x-ndjson"}
+    )
+    assert len(response.text.splitlines()) == 3
+
+
+@pytest.mark.asyncio
+async def test_rate_limit(client, monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(main, "shorten_limiter", RateLimiter(rate=0.1, burst=2))
+    assert (await shorten(client, "https://example.com/1")).status_code == 200
+    assert (await shorten(client, "https://example.com/2")).status_code == 200
+    limited = await shorten(client, "https://example.com/3")
+    assert limited.status_code == 429
+    assert int(limited.headers["retry-after"]) == 10
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_ignores_spoofed_forwarded_entries(client, monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(settings, "RATE_LIMIT_TRUST_PROXY", True)
+    monkeypatch.setattr(main, "shorten_limiter", RateLimiter(rate=0.1, burst=1))
+    for i, spoofed in enumerate(["1.1.1.1", "2.2.2.2"]):
+        # The proxy appended 9.9.9.9; what comes before it is up to the client
+        response = await client.post(
+            "/shorten",
+            json={"url": f"https://example.com/{i}"},
+            headers={"x-forwarded-for": f"{spoofed}, 9.9.9.9"},
+        )
+    assert response.status_code == 429
+
+    # Behind two proxies the first one's entry is the client
+    monkeypatch.setattr(settings, "RATE_LIMIT_PROXY_HOPS", 2)
+    statuses = []
+    for i, spoofed in enumerate(["3.3.3.3", "4.4.4.4"]):
+        response = await client.post(
+            "/shorten",
+            json={"url": f"https://example.com/b{i}"},
+            headers={"x-forwarded-for": f"{spoofed}, 10.0.0.1, 9.9.9.9"},
+        )
+        statuses.append(response.status_code)
+    assert statuses == [200, 429]
+
+
+@pytest.mark.asyncio
+async def test_bulk_items_share_a_global_budget(client, monkeypatch):
+    assert main.bulk_limiter.global_rate == settings.RATE_LIMIT_BULK_GLOBAL_PER_SECOND
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(settings, "RATE_LIMIT_TRUST_PROXY", True)
+    monkeypatch.setattr(
+        main, "bulk_limiter", RateLimiter(rate=0.1, burst=10, global_rate=0.1, global_burst=15)
+    )
+    items = [{"url": f"https://example.com/{i}"} for i in range(10)]
+    stored = 0
+    for address in ("1.1.1.1", "2.2.2.2"):
+        response = await client.post(
+            "/shorten/bulk", json=items, headers={"x-forwarded-for": address}
+        )
+        stored += sum("short_code" in json.loads(line) for line in response.text.splitlines())
+    assert stored == 15
+
+
+@pytest.mark.asyncio
+async def test_health(client):
+    assert (await client.get("/health")).json() == {"status": "healthy", "total_urls": 0}
+    ready = await client.get("/health/ready")
+    assert ready.status_code == 200
+    assert ready.json()["status"] == "ready"
+
+
+@pytest.mark.asyncio
+async def test_metrics(client):
+    await shorten(client, "https://example.com/")
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "url_shortener_links 1\n" in response.text
+
+
+@pytest.mark.asyncio
+async def test_blocking_reads_run_off_the_event_loop(client, monkeypatch):
+    short_code = (await shorten(client, "https://example.com/")).json()["short_code"]
+    monkeypatch.setattr(main.storage, "blocking_reads", True)
+    threads = set()
+    for name in ("count_links", "total_clicks", "exists", "get_clicks"):
+        read = getattr(main.storage, name)
+
+        def traced(*args, read=read):
+            threads.add(threading.get_ident())
+            return read(*args)
+
+        monkeypatch.setattr(main.storage, name, traced)
+
+    for path in ("/stats", f"/stats/{short_code}", "/health", "/metrics"):
+        assert (await client.get(path)).status_code == 200
+    assert threads and threading.get_ident() not in threads
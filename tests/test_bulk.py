@@ -0,0 +1,106 @@
+"""
+Tests for bulk link creation: streamed parsing and batched inserts
+"""
+
+import json
+
+import pytest
+
+from app.allocator import RandomAllocator
+from app.bulk import BulkItemError, BulkParseError, iter_json_items, shorten_batch
+from app.storage import LinkLimits
+
+BASE_URL = "http://sho.rt"
+
+
+async def chunked(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+async def parse(data: bytes, ndjson=False, size=7, max_item_bytes=1000):
+    return [item async for item in iter_json_items(chunked(data, size), ndjson, max_item_bytes)]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("size", [1, 3, 7, 1000])
+async def test_parses_array_in_any_chunking(size):
+    items = [{"url": "https://a.example/ä"}, {"url": "https://b.example/", "custom_code": "bee"}, []]
+    data = json.dumps(items, ensure_ascii=False).encode("utf-8")
+    assert await parse(data, size=size) == items
+
+
+@pytest.mark.asyncio
+async def test_parses_ndjson():
+    data = b'{"url": "https://a.example/"}\n\n{"url": "https://b.example/"}\nnot json\n{"url": "c"}'
+    items = await parse(data, ndjson=True)
+    assert items[:2] == [{"url": "https://a.example/"}, {"url": "https://b.example/"}]
+    assert isinstance(items[2], BulkParseError)
+    assert items[3] == {"url": "c"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("data, message", [
+    (b'{"url": "https://a.example/"}', "Expected a JSON array"),
+    (b'[{"url": "https://a.example/"}, {"url": ', "Malformed JSON array"),
+    (b'[{"url": "' + b"a" * 2000 + b'"}]', "Item too large"),
+])
+async def test_reports_unparsable_input(data, message):
+    items = await parse(data)
+    assert isinstance(items[-1], BulkParseError)
+    assert str(items[-1]) == message
+
+
+@pytest.fixture
+def storage(storage):
+    storage.add_link("taken", "https://taken.example/")
+    return storage
+
+
+def run_batch(storage, items, dedupe=False):
+    lines = shorten_batch(storage, RandomAllocator(storage), items, 10, BASE_URL, dedupe)
+    assert all(line.endswith("\n") for line in lines)
+    return [json.loads(line) for line in lines]
+
+
+def test_stores_batch_and_reports_each_item(storage):
+    results = run_batch(storage, [
+        {"url": "https://a.example/"},
+        {"url": "ftp://a.example/"},
+        {"url": "https://b.example/", "custom_code": "taken"},
+        {"url": "https://c.example/", "custom_code": "mine"},
+        {"nope": 1},
+        BulkItemError("Rate limit exceeded"),
+        {"url": "https://e.example/", "expires_at": "2000-01-01T00:00:00Z"},
+        {"url": "https://f.example/", "max_clicks": 2},
+    ])
+
+    assert storage.get_url(results[0]["short_code"]) == "https://a.example/"
+    assert results[0]["short_url"] == f"{BASE_URL}/{results[0]['short_code']}"
+    assert results[1] == {"index": 11, "detail": "Invalid URL format"}
+    assert results[2] == {"index": 12, "detail": "Custom code already exists"}
+    assert results[3]["short_code"] == "mine"
+    assert storage.get_url("mine") == "https://c.example/"
+    assert results[4] == {"index": 14, "detail": "Invalid request"}
+    assert results[5] == {"index": 15, "detail": "Rate limit exceeded"}
+    assert results[6] == {"index": 16, "detail": "Expiry time must be in the future"}
+    assert storage.get_limits(results[7]["short_code"]) == LinkLimits(max_clicks=2)
+    assert storage.count_links() == 4
+
+
+@pytest.mark.parametrize("storage", [{"dedupe": True}], indirect=True)
+def test_dedupe_reuses_codes(storage):
+    results = run_batch(storage, [
+        {"url": "https://taken.example/"},
+        {"url": "https://new.example/"},
+        {"url": "https://NEW.example"},
+        {"url": "https://new.example/", "max_clicks": 1},
+    ], dedupe=True)
+
+    assert results[0]["short_code"] == "taken"
+    assert results[1]["short_code"] == results[2]["short_code"]
+    # Each request gets its own URL back
+    assert results[2]["original_url"] == "https://NEW.example"
+    # Links with limits are never shared
+    assert results[3]["short_code"] != results[1]["short_code"]
+    assert storage.count_links() == 3
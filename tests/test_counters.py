@@ -0,0 +1,82 @@
+"""
+Tests for the write-behind click buffer
+"""
+
+import pytest
+
+from app.counters import ClickBuffer
+
+
+@pytest.fixture
+def storage(storage):
+    storage.add_link("a", "https://a.example/")
+    storage.add_link("b", "https://b.example/")
+    return storage
+
+
+def test_drain_merges_shards():
+    clicks = ClickBuffer(shards=4)
+    for short_code in ("a", "b", "a", "c"):
+        clicks.incr(short_code)
+    assert clicks.get("a") == 2
+    assert clicks.pending == 4
+    assert clicks.drain() == {"a": 2, "b": 1, "c": 1}
+    assert clicks.pending == 0
+    assert clicks.get("a") == 0
+
+
+def test_shard_count_must_be_power_of_two():
+    with pytest.raises(ValueError):
+        ClickBuffer(shards=3)
+
+
+@pytest.mark.asyncio
+async def test_flush_writes_deltas(storage, io):
+    clicks = ClickBuffer()
+    clicks.incr("a")
+    clicks.incr("a")
+    clicks.incr("b")
+    assert await clicks.flush(storage, io) == 3
+    assert storage.get_clicks("a") == 2
+    assert storage.get_clicks("b") == 1
+    assert clicks.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_deltas(storage, io, monkeypatch):
+    clicks = ClickBuffer()
+    clicks.incr("a")
+    clicks.incr("b")
+
+    def fail(deltas):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(storage, "add_clicks", fail)
+    with pytest.raises(OSError):
+        await clicks.flush(storage, io)
+    # Clicks recorded while the write was failing are kept as well
+    clicks.incr("a")
+    assert clicks.pending == 3
+    assert clicks.get("a") == 2
+
+    monkeypatch.undo()
+    await clicks.flush(storage, io)
+    assert storage.get_clicks("a") == 2
+    assert storage.get_clicks("b") == 1
+    assert clicks.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_sync_does_not_write_twice(storage, io, monkeypatch):
+    clicks = ClickBuffer()
+    clicks.incr("a")
+
+    def fail():
+        raise OSError("fsync failed")
+
+    monkeypatch.setattr(storage, "flush", fail)
+    await clicks.flush(storage, io)
+    monkeypatch.undo()
+    await clicks.flush(storage, io)
+    assert storage.get_clicks("a") == 1
+    assert clicks.pending == 0
@@ -0,0 +1,91 @@
+"""
+Tests for the expired link reaper
+"""
+
+import time
+
+import pytest
+
+from app.expiry import ExpiryReaper
+from app.storage import LinkLimits, MappedLogStorageEngine, SQLiteStorageEngine
+
+ENGINES = [{}, {"engine": MappedLogStorageEngine}, {"engine": SQLiteStorageEngine}]
+
+
+@pytest.fixture
+def storage(storage):
+    for i in range(5):
+        storage.add_link(f"e{i}", f"https://example.com/{i}", LinkLimits(expires_at=100.0 + i))
+    storage.add_link("kept", "https://example.com/")
+    return storage
+
+
+def test_due_pops_in_expiry_order_a_batch_at_a_time():
+    reaper = ExpiryReaper(batch_size=2)
+    reaper.load([("c", 3.0), ("a", 1.0), ("late", 50.0)])
+    reaper.schedule([("b", 2.0)])
+    assert reaper.due(10.0) == ["a", "b"]
+    assert reaper.due(10.0) == ["c"]
+    assert reaper.due(10.0) == []
+    assert len(reaper) == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("storage", ENGINES, indirect=True)
+async def test_reap_removes_due_links(storage, io):
+    reaper = ExpiryReaper(batch_size=2)
+    reaper.load(storage.expiring_links())
+    # Already removed links are skipped
+    storage.remove_links(["e0"])
+    assert await reaper.reap(storage, io, now=103.0) == 3
+    assert storage.count_links() == 2
+    assert storage.get_url("e4") is not None
+    assert reaper.reaped == 3
+    assert len(reaper) == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_removal_is_retried(storage, io, monkeypatch):
+    reaper = ExpiryReaper()
+    reaper.load(storage.expiring_links())
+
+    def fail(short_codes, now):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(storage, "remove_expired", fail)
+    with pytest.raises(OSError):
+        await reaper.reap(storage, io, now=200.0)
+    monkeypatch.undo()
+    assert await reaper.reap(storage, io, now=200.0) == 5
+    assert storage.count_links() == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("storage", ENGINES, indirect=True)
+async def test_reused_code_is_not_reaped(storage, io):
+    reaper = ExpiryReaper()
+    expires_at = time.time() + 3600
+    storage.add_link("once", "https://example.com/once", LinkLimits(expires_at, max_clicks=1))
+    reaper.load(storage.expiring_links())
+    # Used up, so reaped early...
+    storage.add_clicks({"once": 1})
+    reaper.expire_now("once")
+    assert await reaper.reap(storage, io) == 6
+    # ...and the code taken again for a link that never expires
+    storage.add_link("once", "https://example.com/kept")
+    assert await reaper.reap(storage, io, now=expires_at) == 0
+    assert storage.get_url("once") == "https://example.com/kept"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("storage", ENGINES, indirect=True)
+async def test_capped_link_is_reaped_once_used_up(storage, io):
+    reaper = ExpiryReaper()
+    storage.add_link("capped", "https://example.com/c", LinkLimits(max_clicks=2))
+    storage.add_clicks({"capped": 1})
+    reaper.expire_now("capped")
+    assert await reaper.reap(storage, io) == 0
+    storage.add_clicks({"capped": 1})
+    reaper.expire_now("capped")
+    assert await reaper.reap(storage, io) == 1
+    assert storage.get_url("capped") is None
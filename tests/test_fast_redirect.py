@@ -0,0 +1,85 @@
+"""
+Tests for fast-path redirects
+"""
+
+import pytest
+
+from app.counters import ClickBuffer
+from app.fast_redirect import FastRedirectMiddleware, RedirectCache
+from app.link_cache import LinkCache
+from app.storage import LinkLimits
+
+
+@pytest.fixture
+def storage(storage):
+    storage.add_link("open", "https://example.com/a b")
+    storage.add_link("capped", "https://example.com/", LinkLimits(max_clicks=1))
+    return storage
+
+
+class App:
+    """Stands in for the FastAPI app behind the middleware"""
+
+    def __init__(self):
+        self.scopes = []
+
+    async def __call__(self, scope, receive, send):
+        self.scopes.append(scope)
+        await send({"type": "http.response.start", "status": 404, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+
+async def get(middleware, path):
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": path}
+    await middleware(scope, None, send)
+    return messages[0]
+
+
+@pytest.fixture
+def middleware(storage):
+    cache = LinkCache()
+    cache.bind(storage)
+    expired = []
+    cache.on_expired = expired.append
+    redirects = RedirectCache(cache)
+    clicks = ClickBuffer()
+    redirects.bind(clicks, reserved={"stats"})
+    middleware = FastRedirectMiddleware(App(), redirects)
+    middleware.expired = expired
+    middleware.clicks = clicks
+    return middleware
+
+
+@pytest.mark.asyncio
+async def test_known_code_redirects(middleware):
+    response = await get(middleware, "/open")
+    assert response["status"] == 302
+    assert (b"location", b"https://example.com/a%20b") in response["headers"]
+    assert middleware.clicks.get("open") == 1
+    assert middleware.app.scopes == []
+
+
+@pytest.mark.asyncio
+async def test_missing_code_is_flagged_for_the_app(middleware):
+    assert (await get(middleware, "/nope"))["status"] == 404
+    assert middleware.app.scopes[0]["state"]["link_missing"] is True
+
+
+@pytest.mark.asyncio
+async def test_capped_link_is_used_once_per_request(middleware):
+    assert (await get(middleware, "/capped"))["status"] == 302
+    assert (await get(middleware, "/capped"))["status"] == 404
+    assert middleware.expired == ["capped"]
+    assert middleware.app.scopes[0]["state"]["link_missing"] is True
+
+
+@pytest.mark.asyncio
+async def test_reserved_paths_fall_through_unflagged(middleware):
+    await get(middleware, "/stats")
+    await get(middleware, "/stats/open")
+    assert all("state" not in scope for scope in middleware.app.scopes)
@@ -0,0 +1,101 @@
+"""
+Tests for the hot-link cache in front of storage
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from app.link_cache import LinkCache
+from app.storage import LinkLimits, MappedLogStorageEngine
+
+
+@pytest.fixture
+def storage(storage):
+    storage.add_link("a", "https://a.example/")
+    return storage
+
+
+def bound_cache(storage, **kwargs):
+    cache = LinkCache(**kwargs)
+    cache.bind(storage)
+    return cache
+
+
+@pytest.mark.asyncio
+async def test_hits_and_misses(storage):
+    cache = bound_cache(storage)
+    assert await cache.get("a") == "https://a.example/"
+    assert await cache.get("a") == "https://a.example/"
+    assert await cache.get("nope") is None
+    assert await cache.get("nope") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["negative_hits"]) == (1, 2, 1)
+
+
+@pytest.mark.asyncio
+async def test_invalidate_forgets_unknown_codes(storage):
+    cache = bound_cache(storage)
+    assert await cache.get("b") is None
+    storage.add_link("b", "https://b.example/")
+    cache.invalidate(["b"])
+    assert await cache.get("b") == "https://b.example/"
+
+
+@pytest.mark.asyncio
+async def test_entries_are_reloaded_after_ttl(storage):
+    cache = bound_cache(storage, ttl=0.0)
+    assert await cache.get("a") == "https://a.example/"
+    storage.remove_links(["a"])
+    assert await cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+
+
+@pytest.mark.asyncio
+async def test_lru_eviction(storage):
+    storage.add_links([("b", "https://b.example/"), ("c", "https://c.example/")])
+    cache = bound_cache(storage, max_entries=2)
+    for short_code in ("a", "b", "a", "c"):
+        await cache.get(short_code)
+    assert cache.stats()["evictions"] == 1
+    # b was least recently used
+    assert await cache.get("a") == "https://a.example/"
+    assert cache.stats()["hits"] == 2
+
+
+@pytest.mark.asyncio
+async def test_limits_are_checked_on_the_entry(storage):
+    storage.add_link("capped", "https://c.example/", LinkLimits(max_clicks=2))
+    storage.add_clicks({"capped": 1})
+    storage.add_link("expired", "https://e.example/", LinkLimits(expires_at=time.time() - 1))
+    cache = bound_cache(storage)
+    expired = []
+    cache.on_expired = expired.append
+
+    assert await cache.get("capped") == "https://c.example/"
+    assert await cache.get("capped") is None
+    assert await cache.get("expired") is None
+    assert expired == ["capped", "expired"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("storage", [{"filter_error_rate": 0.01}], indirect=True)
+async def test_filtered_codes_skip_storage(storage):
+    cache = bound_cache(storage)
+    assert await cache.get("a") == "https://a.example/"
+    misses = [f"missing{i}" for i in range(100)]
+    for short_code in misses:
+        assert await cache.get(short_code) is None
+    assert cache.stats()["filtered"] > 90
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("storage", [{"engine": MappedLogStorageEngine}], indirect=True)
+async def test_concurrent_misses_share_one_read(storage):
+    cache = bound_cache(storage)
+    urls = await asyncio.gather(*(cache.get("a") for _ in range(10)))
+    assert urls == ["https://a.example/"] * 10
+    stats = cache.stats()
+    assert stats["loads"] == 1
+    assert stats["coalesced_loads"] == 9
@@ -0,0 +1,38 @@
+"""
+Tests for the counting Bloom filter over short codes
+"""
+
+from app.link_filter import COUNTER_MAX, LinkFilter
+
+
+def test_no_false_negatives():
+    codes = [f"code{i}" for i in range(5000)]
+    link_filter = LinkFilter.build(codes, capacity=10000)
+    assert all(short_code in link_filter for short_code in codes)
+    assert link_filter.stats()["codes"] == 5000
+
+
+def test_false_positive_rate_is_near_target():
+    link_filter = LinkFilter.build((f"code{i}" for i in range(10000)), capacity=10000, error_rate=0.01)
+    false_positives = sum(f"other{i}" in link_filter for i in range(20000))
+    assert false_positives / 20000 < 0.02
+    assert 0.005 < link_filter.error_rate() < 0.015
+
+
+def test_removed_codes_are_forgotten():
+    link_filter = LinkFilter.build(["a", "b"], capacity=100)
+    link_filter.remove("a")
+    assert "a" not in link_filter
+    assert "b" in link_filter
+    assert link_filter.count == 1
+
+
+def test_saturated_counters_never_cause_false_negatives():
+    link_filter = LinkFilter(capacity=1)
+    # The same code added past the counter limit pins its counters there
+    for _ in range(COUNTER_MAX + 5):
+        link_filter.add("hot")
+    link_filter.add("other")
+    for _ in range(COUNTER_MAX + 5):
+        link_filter.remove("hot")
+    assert "other" in link_filter
@@ -0,0 +1,242 @@
+"""
+Tests for the event log storage engines: restarts, compaction and damaged files
+"""
+
+import json
+import os
+import shutil
+
+import pytest
+
+from app.config import settings
+from app.snapshot import CorruptDataError, read_snapshot
+from app.storage import LinkExistsError, LinkLimits, LogStorageEngine, MappedLogStorageEngine
+
+EXPIRES_AT = 4102444800.0
+
+
+@pytest.fixture(autouse=True)
+def no_legacy_data(tmp_path, monkeypatch):
+    """Keep the import of whole-file data away from the working directory"""
+    monkeypatch.setattr(settings, "DATA_FILE", str(tmp_path / "url_data.json"))
+    monkeypatch.setattr(settings, "STATS_FILE", str(tmp_path / "stats_data.json"))
+
+
+def open_engine(data_dir, engine_class=LogStorageEngine, **kwargs):
+    snapshot_name = "links.idx" if engine_class is MappedLogStorageEngine else "snapshot.dat"
+    engine = engine_class(
+        snapshot_file=str(data_dir / snapshot_name),
+        log_file=str(data_dir / "events.log"),
+        **kwargs,
+    )
+    engine.load()
+    return engine
+
+
+def add_sample_links(engine):
+    engine.add_links([("a", "https://a.example/"), ("b", "https://b.example/")])
+    engine.add_link("e", "https://e.example/", LinkLimits(expires_at=EXPIRES_AT))
+    engine.add_clicks({"a": 3, "b": 1})
+    engine.remove_links(["b"])
+
+
+def assert_sample_links(engine):
+    assert engine.get_url("a") == "https://a.example/"
+    assert engine.get_url("b") is None
+    assert engine.get_clicks("a") == 3
+    assert engine.get_limits("e") == LinkLimits(expires_at=EXPIRES_AT)
+    assert engine.expiring_links() == [("e", EXPIRES_AT)]
+    assert engine.count_links() == 2
+    assert engine.total_clicks() == 3
+
+
+@pytest.mark.parametrize("engine_class, link_table", [
+    (LogStorageEngine, "dict"),
+    (LogStorageEngine, "compact"),
+    (MappedLogStorageEngine, "dict"),
+])
+@pytest.mark.parametrize("compact", [False, True])
+def test_restart_keeps_links(tmp_path, engine_class, link_table, compact):
+    engine = open_engine(tmp_path, engine_class, link_table=link_table)
+    add_sample_links(engine)
+    if compact:
+        engine.compact()
+        engine.add_clicks({"a": 1})
+        engine.add_clicks({"a": -1})
+    engine.close()
+
+    engine = open_engine(tmp_path, engine_class, link_table=link_table)
+    assert_sample_links(engine)
+    with pytest.raises(LinkExistsError):
+        engine.add_link("a", "https://other.example/")
+    engine.close()
+
+
+def test_compaction_removes_rotated_logs(tmp_path):
+    engine = open_engine(tmp_path)
+    add_sample_links(engine)
+    engine.compact()
+    engine.compact()
+    assert sorted(os.listdir(tmp_path)) == ["events.log", "snapshot.dat"]
+    assert read_snapshot(str(tmp_path / "snapshot.dat"))["generation"] == engine.generation
+    assert engine.log_events == 0
+    engine.close()
+
+
+def test_interrupted_compaction_replays_rotated_log(tmp_path):
+    engine = open_engine(tmp_path)
+    add_sample_links(engine)
+
+    def crash(snapshot):
+        raise OSError("disk full")
+
+    engine._write_snapshot = crash
+    with pytest.raises(OSError):
+        engine.compact()
+    engine.add_link("c", "https://c.example/")
+    engine.close()
+    assert os.path.exists(tmp_path / "events.log.1")
+
+    engine = open_engine(tmp_path)
+    assert engine.get_url("a") == "https://a.example/"
+    assert engine.get_url("b") is None
+    assert engine.get_url("c") == "https://c.example/"
+    assert engine.get_clicks("a") == 3
+    assert engine.count_links() == 3
+    engine.close()
+
+
+def test_stale_rotated_log_is_not_replayed(tmp_path):
+    engine = open_engine(tmp_path)
+    add_sample_links(engine)
+    engine.flush()
+    shutil.copy(tmp_path / "events.log", tmp_path / "saved.log")
+    engine.compact()
+    engine.close()
+    # As if the process died between writing the snapshot and removing the log
+    shutil.copy(tmp_path / "saved.log", tmp_path / "events.log.1")
+
+    engine = open_engine(tmp_path)
+    assert_sample_links(engine)
+    engine.close()
+
+
+def test_torn_record_is_discarded(tmp_path, capsys):
+    engine = open_engine(tmp_path)
+    add_sample_links(engine)
+    engine.close()
+    with open(tmp_path / "events.log", "ab") as f:
+        f.write(b'["L", "torn", "https://t')
+
+    engine = open_engine(tmp_path)
+    assert "incomplete record" in capsys.readouterr().out
+    assert_sample_links(engine)
+    engine.add_link("c", "https://c.example/")
+    engine.close()
+
+    # Appends after the torn record are readable
+    engine = open_engine(tmp_path)
+    assert engine.get_url("torn") is None
+    assert engine.get_url("c") == "https://c.example/"
+    engine.close()
+
+
+def test_damaged_record_stops_startup(tmp_path):
+    engine = open_engine(tmp_path)
+    add_sample_links(engine)
+    engine.close()
+    with open(tmp_path / "events.log", "ab") as f:
+        f.write(b'["C", "a", \n')
+        f.write(json.dumps(["C", "a", 1]).encode() + b"\n")
+
+    with pytest.raises(CorruptDataError):
+        open_engine(tmp_path)
+
+
+def _flip_last_byte(path):
+    with open(path, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 0x20]))
+
+
+def test_damaged_snapshot_stops_startup(tmp_path):
+    engine = open_engine(tmp_path)
+    add_sample_links(engine)
+    engine.compact()
+    engine.close()
+    _flip_last_byte(tmp_path / "snapshot.dat")
+
+    with pytest.raises(CorruptDataError, match="checksum"):
+        open_engine(tmp_path)
+
+
+def test_json_snapshot_is_migrated(tmp_path):
+    legacy = tmp_path / "snapshot.json"
+    legacy.write_text(json.dumps({
+        "generation": 1,
+        "urls": {"a": "https://a.example/", "e": "https://e.example/"},
+        "clicks": {"a": 3},
+        "limits": {"e": [EXPIRES_AT, None]},
+    }))
+    engine = open_engine(tmp_path, legacy_snapshot_files=(str(legacy),))
+    engine.compact()
+    engine.close()
+    legacy.unlink()
+
+    engine = open_engine(tmp_path)
+    assert engine.get_url("a") == "https://a.example/"
+    assert engine.get_clicks("a") == 3
+    assert engine.expiring_links() == [("e", EXPIRES_AT)]
+    engine.close()
+
+
+def test_whole_file_data_is_imported(tmp_path):
+    (tmp_path / "url_data.json").write_text(json.dumps({"a": "https://a.example/"}))
+    (tmp_path / "stats_data.json").write_text(json.dumps({"a": 7}))
+    engine = open_engine(tmp_path)
+    assert engine.get_url("a") == "https://a.example/"
+    assert engine.total_clicks() == 7
+    engine.close()
+
+
+def test_dedupe_index_survives_restart(tmp_path):
+    engine = open_engine(tmp_path, dedupe=True)
+    engine.add_link("a", "https://a.example/x")
+    engine.add_link("e", "https://e.example/", LinkLimits(expires_at=EXPIRES_AT))
+    engine.compact()
+    engine.close()
+
+    engine = open_engine(tmp_path, dedupe=True)
+    assert engine.find_by_url("HTTPS://A.example/x") == "a"
+    # Links with limits are never shared
+    assert engine.find_by_url("https://e.example/") is None
+    engine.close()
+
+
+def test_damaged_index_header_stops_startup(tmp_path):
+    engine = open_engine(tmp_path, MappedLogStorageEngine)
+    add_sample_links(engine)
+    engine.compact()
+    engine.close()
+    with open(tmp_path / "links.idx", "r+b") as f:
+        f.seek(10)
+        f.write(b"\xff")
+
+    with pytest.raises(CorruptDataError, match="header"):
+        open_engine(tmp_path, MappedLogStorageEngine)
+
+
+def test_damaged_index_body_is_caught_by_compaction(tmp_path):
+    engine = open_engine(tmp_path, MappedLogStorageEngine)
+    add_sample_links(engine)
+    engine.compact()
+    engine.close()
+    data = (tmp_path / "links.idx").read_bytes()
+    (tmp_path / "links.idx").write_bytes(data.replace(b"https://a.example/", b"https://A.example/"))
+
+    # Lookups only read the header's checksum; the next full read checks the body
+    engine = open_engine(tmp_path, MappedLogStorageEngine)
+    with pytest.raises(CorruptDataError, match="checksum"):
+        engine.compact()
@@ -0,0 +1,93 @@
+"""
+Tests for the Prometheus metrics registry
+"""
+
+import asyncio
+
+import pytest
+
+from app.config import settings
+from app.metrics import Histogram, Registry, timed
+
+
+def rendered(registry):
+    return [line for line in registry.render().splitlines() if not line.startswith("#")]
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 5.0):
+        histogram.observe(value)
+    assert rendered(registry) == [
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="1.0"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_sum 5.65",
+        "latency_seconds_count 4",
+    ]
+
+
+def test_labelled_histogram_keeps_labels_before_le():
+    registry = Registry()
+    histogram = registry.histogram("latency_seconds", "Latency", ("path",), buckets=(1.0,))
+    histogram.labels("fast").observe(0.5)
+    assert rendered(registry)[:2] == [
+        'latency_seconds_bucket{path="fast",le="1.0"} 1',
+        'latency_seconds_bucket{path="fast",le="+Inf"} 1',
+    ]
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.counter("events_total", "Events", ("name",)).labels('a\\b"c\nd').inc()
+    assert rendered(registry) == ['events_total{name="a\\\\b\\"c\\nd"} 1']
+
+
+def test_label_count_is_checked():
+    counter = Registry().counter("events_total", "Events", ("name",))
+    with pytest.raises(ValueError):
+        counter.labels("a", "b")
+
+
+def test_failing_callback_is_skipped(capsys):
+    registry = Registry()
+    registry.callback("broken", "Broken", "gauge", lambda: 1 / 0)
+    registry.callback("events_total", "Events", "counter", lambda: {"hit": 2}, labelname="event")
+    registry.gauge("in_flight", "In flight").set(3)
+    output = registry.render()
+    assert "broken" not in output
+    assert 'events_total{event="hit"} 2' in output
+    assert "in_flight 3" in output
+    assert "Error reading metric broken" in capsys.readouterr().out
+
+
+def test_timed_observes_sync_and_async_calls(monkeypatch):
+    monkeypatch.setattr(settings, "METRICS_ENABLED", True)
+    registry = Registry()
+    histogram = registry.histogram("call_seconds", "Calls")
+    in_flight = registry.gauge("in_flight", "In flight")
+
+    @timed(histogram)
+    def sync_call():
+        return 1
+
+    @timed(histogram, in_flight)
+    async def async_call():
+        assert in_flight.value == 1
+        return 2
+
+    assert sync_call() == 1
+    assert asyncio.run(async_call()) == 2
+    assert sum(histogram.counts) == 2
+    assert in_flight.value == 0
+
+
+def test_timed_returns_function_unchanged_when_disabled(monkeypatch):
+    monkeypatch.setattr(settings, "METRICS_ENABLED", False)
+    histogram = Registry().histogram("call_seconds", "Calls")
+
+    def call():
+        return 1
+
+    assert timed(histogram)(call) is call
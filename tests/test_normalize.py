@@ -0,0 +1,78 @@
+"""
+Tests for URL normalization and dedupe keys
+"""
+
+from urllib.parse import urlsplit, urlunsplit
+
+import pytest
+
+from app.normalize import InvalidURLError, URLNormalizer, dedupe_key
+
+
+@pytest.fixture
+def normalizer():
+    return URLNormalizer(["blocked.example", "Evil.Example"])
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("https://example.com/a?b=1#c", "https://example.com/a?b=1#c"),
+    ("  HTTPS://Docs.Example.COM:443/Guide  ", "https://docs.example.com/Guide"),
+    ("http://example.com:8080", "http://example.com:8080/"),
+    ("https://example.com/report%20%2epdf", "https://example.com/report%20.pdf"),
+    ("https://example.com/%7euser/a b", "https://example.com/~user/a%20b"),
+    ("https://bücher.example/straße", "https://xn--bcher-kva.example/stra%C3%9Fe"),
+    ("http://[::1]:80/", "http://[::1]/"),
+])
+def test_normalizes(normalizer, url, expected):
+    assert normalizer.normalize(url) == expected
+
+
+@pytest.mark.parametrize("url", [
+    "ftp://example.com/",
+    "https://example..com/",
+    "https://-example.com/",
+    "https://example.com:99999/",
+    "https://user@example.com/",
+    "https://example.com/\x00",
+    "https://" + "a" * 64 + ".com/",
+    "https://blocked.example/",
+    "https://WWW.Blocked.Example/",
+    "https://evil.example/",
+])
+def test_rejects(normalizer, url):
+    with pytest.raises(InvalidURLError):
+        normalizer.normalize(url)
+    # The host check is cached; a second look must agree
+    with pytest.raises(InvalidURLError):
+        normalizer.normalize(url)
+
+
+def test_rejects_long_urls():
+    with pytest.raises(InvalidURLError):
+        URLNormalizer(max_length=30).normalize("https://example.com/" + "a" * 20)
+
+
+def _reference_key(url):
+    parts = urlsplit(url.strip())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", parts.query, parts.fragment))
+
+
+@pytest.mark.parametrize("url", [
+    "https://example.com/a?b=1#c",
+    "HTTPS://Example.com",
+    "https://example.com/?",
+    "https://example.com/a#",
+    "https://example.com/a\tb",
+    "https://example.com/a　",
+    "https:////example.com",
+    "ftp://example.com/x",
+    "https://example.com/ä?q=ü",
+])
+def test_dedupe_key_matches_urlsplit(url):
+    assert dedupe_key(url) == _reference_key(url)
+
+
+def test_normalized_urls_are_their_own_dedupe_key(normalizer):
+    for url in ("HTTPS://Docs.Example.COM:443", "https://bücher.example/a b?", "http://example.com/#"):
+        normalized = normalizer.normalize(url)
+        assert dedupe_key(normalized) == normalized
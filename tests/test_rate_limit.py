@@ -0,0 +1,75 @@
+"""
+Tests for the per-client and global token buckets
+"""
+
+import pytest
+
+from app import rate_limit
+from app.rate_limit import RateLimiter
+
+
+class Clock:
+    """Stands in for the time module, advanced by hand"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    return clock
+
+
+def test_burst_then_rate(clock):
+    limiter = RateLimiter(rate=2, burst=3)
+    assert [limiter.acquire("a") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.acquire("a") == pytest.approx(0.5)
+    # Other clients have their own bucket
+    assert limiter.acquire("b") == 0.0
+
+    clock.now += 0.5
+    assert limiter.acquire("a") == 0.0
+    assert limiter.acquire("a") > 0
+    assert limiter.stats()["limited"] == 2
+
+
+def test_global_bucket_bounds_all_clients(clock):
+    limiter = RateLimiter(rate=10, burst=10, global_rate=1, global_burst=2)
+    assert limiter.acquire("a") == 0.0
+    assert limiter.acquire("b") == 0.0
+    assert limiter.acquire("c") == pytest.approx(1.0)
+
+
+def test_grant_takes_what_is_available(clock):
+    limiter = RateLimiter(rate=100, burst=250)
+    assert limiter.grant("a", 200) == (200, 0.0)
+    granted, retry_after = limiter.grant("a", 200)
+    assert granted == 50
+    assert retry_after == pytest.approx(0.01)
+    clock.now += 1
+    assert limiter.grant("a", 200) == (100, pytest.approx(0.01))
+
+
+def test_sweep_drops_refilled_buckets(clock):
+    limiter = RateLimiter(rate=1, burst=5, sweep_interval=60)
+    limiter.acquire("a")
+    clock.now += 3
+    limiter.acquire("b")
+    clock.now += 3
+    # a has refilled; b has not yet
+    assert limiter.sweep() == 1
+    assert limiter.stats()["clients"] == 1
+
+
+def test_client_buckets_are_bounded(clock):
+    limiter = RateLimiter(rate=1, burst=1, max_clients=2)
+    for client in ("a", "b", "c"):
+        limiter.acquire(client)
+    assert limiter.stats() == {"clients": 2, "limited": 0, "evictions": 1}
+    # The least recently used client was forgiven
+    assert limiter.acquire("a") == 0.0
@@ -0,0 +1,168 @@
+"""
+Tests for log storage shared by several worker processes
+"""
+
+import multiprocessing
+import threading
+
+import pytest
+
+from app.link_index import LinkIndex
+from app.storage import LinkExistsError, LinkLimits, LogStorageEngine, MappedLogStorageEngine
+
+ENGINES = [LogStorageEngine, MappedLogStorageEngine]
+
+
+def new_engine(engine_class, data_dir):
+    return engine_class(
+        snapshot_file=str(data_dir / "snapshot.dat"),
+        log_file=str(data_dir / "events.log"),
+        shared=True,
+    )
+
+
+def open_engine(engine_class, data_dir):
+    engine = new_engine(engine_class, data_dir)
+    engine.load()
+    return engine
+
+
+@pytest.mark.parametrize("engine_class", ENGINES)
+def test_follows_logs_removed_by_compaction(engine_class, tmp_path):
+    a, b, c = (open_engine(engine_class, tmp_path) for _ in range(3))
+    a.compact()
+    a.add_link("x", "https://a.example/")
+    # Removes the log generation c has not read yet
+    b.compact()
+
+    assert c.get_url("x") == "https://a.example/"
+    with pytest.raises(LinkExistsError):
+        c.add_link("x", "https://other.example/")
+    c.compact()
+    for engine in (a, b, c):
+        engine.close()
+
+    restarted = open_engine(engine_class, tmp_path)
+    assert restarted.get_url("x") == "https://a.example/"
+    restarted.close()
+
+
+@pytest.mark.parametrize("engine_class", ENGINES)
+def test_reload_notifies_listeners(engine_class, tmp_path):
+    a, b = open_engine(engine_class, tmp_path), open_engine(engine_class, tmp_path)
+    reloads = []
+    expiring = []
+    b.on_reload = lambda: reloads.append(True)
+    b.on_expiring = expiring.extend
+    a.add_link("x", "https://a.example/", LinkLimits(expires_at=4102444800.0))
+    a.compact()
+    a.compact()
+
+    b.refresh()
+    assert reloads == [True]
+    assert ("x", 4102444800.0) in expiring
+    assert b.get_url("x") == "https://a.example/"
+    a.close()
+    b.close()
+
+
+@pytest.mark.parametrize("engine_class", ENGINES)
+def test_load_waits_for_compaction(engine_class, tmp_path):
+    a = open_engine(engine_class, tmp_path)
+    a.add_link("x", "https://a.example/")
+    b = new_engine(engine_class, tmp_path)
+    loader = threading.Thread(target=b.load)
+    write_snapshot = a._write_snapshot
+
+    def write_snapshot_while_loading(snapshot):
+        loader.start()
+        loader.join(0.2)
+        assert loader.is_alive()
+        write_snapshot(snapshot)
+
+    a._write_snapshot = write_snapshot_while_loading
+    a.compact()
+    loader.join()
+    assert b.get_url("x") == "https://a.example/"
+    a.close()
+    b.close()
+
+
+@pytest.mark.parametrize("engine_class", ENGINES)
+def test_lookups_do_not_wait_for_peer_lock(engine_class, tmp_path):
+    a = open_engine(engine_class, tmp_path)
+    b = open_engine(engine_class, tmp_path)
+    with a._locked():
+        writer = threading.Thread(target=b.add_link, args=("x", "https://b.example/"))
+        writer.start()
+        writer.join(0.1)
+        assert writer.is_alive()
+        # A miss catches up on the log, which must not wait for the writer
+        lookup = threading.Thread(target=b.get_url, args=("y",))
+        lookup.start()
+        lookup.join(1.0)
+        assert not lookup.is_alive()
+    writer.join()
+    assert a.get_url("x") == "https://b.example/"
+    a.close()
+    b.close()
+
+
+def test_adopts_index_written_ahead_of_tail(tmp_path):
+    a = open_engine(MappedLogStorageEngine, tmp_path)
+    b = open_engine(MappedLogStorageEngine, tmp_path)
+    a.add_link("x", "https://a.example/")
+    a.compact()
+    # The index shows up before b has read the log generation it was written at
+    b._check_index()
+    b.refresh()
+
+    assert isinstance(b.links.base, LinkIndex)
+    assert b.links.base.generation == a.generation
+    assert b._pending_generation is None
+    assert b.get_url("x") == "https://a.example/"
+    a.close()
+    b.close()
+
+
+def _create_and_click(engine_class, data_dir, worker, codes, results):
+    engine = open_engine(engine_class, data_dir)
+    inserted = 0
+    for i, short_code in enumerate(codes):
+        try:
+            engine.add_link(short_code, f"https://example.com/{worker}/{short_code}")
+            inserted += 1
+        except LinkExistsError:
+            pass
+        engine.add_clicks({short_code: 1})
+        # Workers take turns compacting, so tails are often rotated out
+        if i % 10 == worker:
+            engine.compact()
+    engine.close()
+    results.put(inserted)
+
+
+@pytest.mark.parametrize("engine_class", ENGINES)
+def test_workers_agree_across_compactions(engine_class, tmp_path):
+    open_engine(engine_class, tmp_path).close()
+    codes = [f"code{i}" for i in range(500)]
+    workers = 4
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    processes = [
+        context.Process(target=_create_and_click, args=(engine_class, tmp_path, worker, codes, results))
+        for worker in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    inserted = sum(results.get(timeout=60) for _ in processes)
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    # Each code was created by exactly one worker, and no click was lost
+    assert inserted == len(codes)
+    engine = open_engine(engine_class, tmp_path)
+    assert engine.count_links() == len(codes)
+    assert engine.total_clicks() == workers * len(codes)
+    engine.close()
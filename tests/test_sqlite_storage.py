@@ -0,0 +1,157 @@
+"""
+Tests for the SQLite storage engine
+"""
+
+import multiprocessing
+import sqlite3
+
+import pytest
+
+from app.config import settings
+from app.storage import LinkExistsError, LinkLimits, LogStorageEngine, SQLiteStorageEngine
+
+
+@pytest.fixture
+def legacy_dir(tmp_path, monkeypatch):
+    """Point the log backend's settings at an empty data directory"""
+    monkeypatch.setattr(settings, "SNAPSHOT_FILE", str(tmp_path / "snapshot.dat"))
+    monkeypatch.setattr(settings, "LEGACY_SNAPSHOT_FILE", str(tmp_path / "snapshot.json"))
+    monkeypatch.setattr(settings, "LOG_FILE", str(tmp_path / "events.log"))
+    monkeypatch.setattr(settings, "INDEX_FILE", str(tmp_path / "links.idx"))
+    monkeypatch.setattr(settings, "DATA_FILE", str(tmp_path / "url_data.json"))
+    monkeypatch.setattr(settings, "STATS_FILE", str(tmp_path / "stats_data.json"))
+    monkeypatch.setattr(settings, "SHARED_STORAGE", False)
+    return tmp_path
+
+
+def write_legacy_links(count):
+    engine = LogStorageEngine.from_settings()
+    engine.load()
+    engine.add_links([(f"code{i}", f"https://example.com/{i}") for i in range(count)])
+    engine.add_clicks({"code1": 5})
+    engine.add_link("expiring", "https://example.com/e", LinkLimits(expires_at=4102444800.0))
+    engine.close()
+
+
+def open_engine(path, busy_timeout=5.0):
+    engine = SQLiteStorageEngine(str(path), busy_timeout)
+    engine.load()
+    return engine
+
+
+def test_migrates_log_data_once(legacy_dir):
+    write_legacy_links(100)
+    engine = open_engine(legacy_dir / "links.db")
+    assert engine.count_links() == 101
+    assert engine.get_clicks("code1") == 5
+    assert engine.total_clicks() == 5
+    assert engine.get_limits("expiring") == LinkLimits(expires_at=4102444800.0)
+    assert engine.expiring_links() == [("expiring", 4102444800.0)]
+    engine.remove_links(["code2"])
+    engine.close()
+
+    # Already migrated; the removed link stays removed
+    engine = open_engine(legacy_dir / "links.db")
+    assert engine.count_links() == 100
+    assert engine.get_url("code2") is None
+    engine.close()
+
+
+def test_migration_keeps_leased_ids(legacy_dir):
+    engine = LogStorageEngine.from_settings()
+    engine.load()
+    engine.lease_ids(3000)
+    engine.close()
+
+    engine = open_engine(legacy_dir / "links.db")
+    # Counter codes issued by the log backend are not handed out again
+    assert engine.lease_ids(10) == 3000
+    engine.close()
+
+
+def _open_and_count(path, busy_timeout, results):
+    engine = open_engine(path, busy_timeout)
+    results.put(engine.count_links())
+    engine.close()
+
+
+def test_workers_wait_for_migration(legacy_dir, monkeypatch):
+    write_legacy_links(20000)
+    monkeypatch.setattr(SQLiteStorageEngine, "MIGRATE_BATCH", 500)
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    processes = [
+        context.Process(target=_open_and_count, args=(legacy_dir / "links.db", 0.2, results))
+        for _ in range(3)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+    assert [results.get() for _ in processes] == [20001] * 3
+
+
+def write_old_schema(path, count):
+    """A migrated database from before url_hash, limits and totals"""
+    conn = sqlite3.connect(str(path))
+    conn.execute(
+        "CREATE TABLE links "
+        "(short_code TEXT PRIMARY KEY, url TEXT NOT NULL, clicks INTEGER NOT NULL DEFAULT 0)"
+    )
+    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    conn.execute("INSERT INTO meta (key, value) VALUES ('migrated', '1')")
+    conn.executemany(
+        "INSERT INTO links (short_code, url, clicks) VALUES (?, ?, 1)",
+        ((f"code{i}", f"https://example.com/{i}") for i in range(count)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_workers_upgrade_the_schema_once(tmp_path):
+    write_old_schema(tmp_path / "links.db", 20000)
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    processes = [
+        context.Process(target=_open_and_count, args=(tmp_path / "links.db", 5.0, results))
+        for _ in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+    assert [results.get() for _ in processes] == [20000] * 4
+
+    engine = open_engine(tmp_path / "links.db")
+    assert engine.total_clicks() == 20000
+    assert engine.find_by_url("https://example.com/7") == "code7"
+    engine.close()
+
+
+def test_links_clicks_and_limits(tmp_path):
+    engine = open_engine(tmp_path / "links.db")
+    assert engine.add_links([("a", "https://a.example/"), ("b", "https://b.example/")]) == [True, True]
+    assert engine.add_links([("a", "https://other.example/")]) == [False]
+    with pytest.raises(LinkExistsError):
+        engine.add_link("b", "https://other.example/")
+    engine.add_clicks({"a": 2, "missing": 1})
+    engine.incr_clicks("a")
+    assert engine.get_clicks("a") == 3
+    assert engine.total_clicks() == 3
+    assert engine.find_by_url("https://b.example/") == "b"
+    assert engine.find_by_url("https://c.example/") is None
+    assert engine.get_link("a") == ("https://a.example/", None, 3)
+
+    engine.add_link("capped", "https://c.example/", LinkLimits(max_clicks=2))
+    assert engine.get_link("capped") == ("https://c.example/", LinkLimits(None, 2), 0)
+    # Links with limits are never handed out again for the same URL
+    assert engine.find_by_url("https://c.example/") is None
+
+    assert engine.remove_links(["a", "missing"]) == ["a"]
+    assert engine.count_links() == 2
+    assert engine.total_clicks() == 0
+    start = engine.lease_ids(10)
+    assert engine.lease_ids(5) == start + 10
+    engine.close()
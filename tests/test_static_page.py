@@ -0,0 +1,82 @@
+"""
+Tests for precompressed static page delivery
+"""
+
+import gzip
+
+import pytest
+
+from app import static_page
+from app.static_page import PrecompressedPage
+
+CONTENT = "<html><body>" + "hello " * 100 + "</body></html>"
+
+
+@pytest.fixture
+def page(monkeypatch):
+    # gzip and identity only, whether or not brotli is installed
+    monkeypatch.setattr(static_page, "brotli", None)
+    return PrecompressedPage(CONTENT, "text/html", max_age=60)
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, coding",
+    [
+        ("", "identity"),
+        ("gzip", "gzip"),
+        ("deflate, GZIP;q=0.5", "gzip"),
+        ("gzip;q=0", "identity"),
+        ("gzip;q=0.0, identity", "identity"),
+        ("*", "gzip"),
+        ("*;q=0", "identity"),
+        ("*, gzip;q=0", "identity"),
+        ("br", "identity"),
+        ("gzip;q=bogus", "identity"),
+    ],
+)
+def test_coding_follows_accept_encoding(page, accept_encoding, coding):
+    response = page.respond({"accept-encoding": accept_encoding})
+    assert response.status_code == 200
+    if coding == "identity":
+        assert "content-encoding" not in response.headers
+        assert response.body == CONTENT.encode()
+    else:
+        assert response.headers["content-encoding"] == coding
+        assert gzip.decompress(response.body) == CONTENT.encode()
+
+
+def test_brotli_is_preferred_when_installed():
+    brotli = pytest.importorskip("brotli")
+    page = PrecompressedPage(CONTENT, "text/html")
+    response = page.respond({"accept-encoding": "gzip, br"})
+    assert response.headers["content-encoding"] == "br"
+    assert brotli.decompress(response.body) == CONTENT.encode()
+
+
+def test_caching_headers(page):
+    for accept_encoding in ("", "gzip"):
+        response = page.respond({"accept-encoding": accept_encoding})
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert response.headers["cache-control"] == "public, max-age=60"
+        assert response.headers["content-type"].startswith("text/html")
+    plain = page.respond({}).headers["etag"]
+    gzipped = page.respond({"accept-encoding": "gzip"}).headers["etag"]
+    assert plain != gzipped
+
+
+@pytest.mark.parametrize("weak", [False, True])
+def test_matching_etag_gets_304(page, weak):
+    etag = page.respond({"accept-encoding": "gzip"}).headers["etag"]
+    if_none_match = ("W/" if weak else "") + etag
+    response = page.respond({"accept-encoding": "gzip", "if-none-match": f'"other", {if_none_match}'})
+    assert response.status_code == 304
+    assert response.body == b""
+    assert response.headers["etag"] == etag
+    assert response.headers["vary"] == "Accept-Encoding"
+
+
+def test_stale_etag_gets_the_page(page):
+    response = page.respond({"if-none-match": '"stale"'})
+    assert response.status_code == 200
+    assert response.body == CONTENT.encode()
+    assert page.respond({"if-none-match": "*"}).status_code == 304